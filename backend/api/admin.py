@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Author, Follower, FollowRequest, Post, Comment, Like, Inbox, Node
+from .models import Author, Follower, FollowRequest, Post, Comment, Like, Inbox, Node, Outbox, Timeline, Image, RemotePost, RemotePostSync, RemoteAuthor, RemoteAuthorSync
 
 admin.site.register(Author)
 admin.site.register(Follower)
@@ -9,4 +9,24 @@ admin.site.register(Post)
 admin.site.register(Comment)
 admin.site.register(Like)
 admin.site.register(Inbox)
-admin.site.register(Node)
\ No newline at end of file
+admin.site.register(Outbox)
+admin.site.register(Timeline)
+admin.site.register(Image)
+admin.site.register(RemotePost)
+admin.site.register(RemotePostSync)
+admin.site.register(RemoteAuthor)
+admin.site.register(RemoteAuthorSync)
+
+
+# shows the circuit breaker health of each node, so it's clear why a node's content is missing
+@admin.register(Node)
+class NodeAdmin(admin.ModelAdmin):
+    list_display = ['team_name', 'api_url', 'is_active', 'breaker_state', 'error_rate', 'consecutive_failures', 'last_error', 'health_checked_at']
+    list_filter = ['is_active', 'breaker_state']
+    readonly_fields = ['breaker_state', 'breaker_opened_at', 'consecutive_failures', 'recent_requests', 'recent_failures', 'last_error', 'health_checked_at']
+
+    @admin.display(description='recent error rate')
+    def error_rate(self, node):
+        if not node.recent_requests:
+            return "-"
+        return f"{100 * node.recent_failures / node.recent_requests:.0f}% of {node.recent_requests}"
@@ -0,0 +1,192 @@
+import aiohttp
+import asyncio
+import logging
+import requests
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from .nodes import get_node_by_host
+from .breaker import NodeUnavailable, get_breaker, save_breaker_states
+from .metrics import record_node_call
+from .utils import get_cache_ttl, get_cache_key, get_conditional_headers, update_cache_entry, response_from_cache, get_node_request_url, log_node_response
+
+logger = logging.getLogger(__name__)
+
+# The asyncio side of the federation client (api/utils.py), used by the async views (api/async_views.py).
+# Remote calls are awaited on one pooled aiohttp session per event loop instead of holding a worker thread each,
+# and share the response cache and the circuit breakers with the threaded client.
+# Responses are handed back as requests responses so the views handle them exactly like the threaded client's.
+
+# event loop -> aiohttp session
+_client_sessions = {}
+# background revalidations, kept here so they aren't garbage collected while running
+_refresh_tasks = set()
+
+
+def get_client_session():
+    """
+    Get (or lazily create) the pooled aiohttp session of the running event loop
+    """
+    loop = asyncio.get_running_loop()
+    session = _client_sessions.get(loop)
+    if session is None or session.closed:
+        for old_loop in [old_loop for old_loop in _client_sessions if old_loop.is_closed()]:
+            del _client_sessions[old_loop]
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit_per_host=settings.FEDERATION_POOL_SIZE),
+            timeout=aiohttp.ClientTimeout(sock_connect=settings.FEDERATION_CONNECT_TIMEOUT, sock_read=settings.FEDERATION_READ_TIMEOUT),
+            headers={"Accept-Encoding": "gzip, deflate"},
+        )
+        _client_sessions[loop] = session
+    return session
+
+
+async def close_client_session():
+    """
+    Close the session of the running event loop, for loops that only live for one request
+    """
+    session = _client_sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
+
+
+async def async_node_request(node, method, request_url, headers=None, **kwargs):
+    """
+    Send a request to a node through the pooled aiohttp session, like node_request.
+    aiohttp errors are raised as requests ConnectionErrors so callers handle them the same way.
+    """
+    breaker = get_breaker(node)
+    if not breaker.allow_request():
+        raise NodeUnavailable(f"circuit open for node {node.team_name}")
+
+    headers = dict(headers or {})
+    headers.setdefault("Authorization", f"Basic {node.base64_authorization}")
+    start = time.perf_counter()
+    try:
+        async with get_client_session().request(method, request_url, headers=headers, **kwargs) as client_response:
+            content = await client_response.read()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        record_node_call(node, time.perf_counter() - start)
+        breaker.record_failure(e or "timeout")
+        raise requests.exceptions.ConnectionError(str(e) or "timeout")
+    record_node_call(node, time.perf_counter() - start, client_response.status)
+
+    response = requests.Response()
+    response.status_code = client_response.status
+    response._content = content
+    response.headers = CaseInsensitiveDict(client_response.headers)
+    response.encoding = get_encoding_from_headers(response.headers)
+    response.url = str(client_response.url)
+
+    if response.status_code >= 500:
+        breaker.record_failure(f"{response.status_code} from {request_url}")
+    else:
+        breaker.record_success()
+    return response
+
+
+async def _async_fetch_from_node(node, path, headers=None):
+    request_url = get_node_request_url(node, path)
+
+    try:
+        response = await async_node_request(node, "get", request_url, headers=headers)
+    except requests.exceptions.RequestException as e:
+        logger.warning("Request failed for node: %s %s: %s", node.team_name, node.api_url, e)
+        return None
+
+    log_node_response(node, request_url, response)
+    return response
+
+
+async def _async_refresh_cached_response(node, path, key, ttl, entry, lock_key=None):
+    try:
+        response = await _async_fetch_from_node(node, path, headers=get_conditional_headers(entry))
+        response, new_entry, timeout = update_cache_entry(ttl, entry, response)
+        if new_entry is not None:
+            await cache.aset(key, new_entry, timeout)
+        return response
+    finally:
+        if lock_key is not None:
+            await cache.adelete(lock_key)
+
+
+async def async_get_request_node(node, path):
+    """
+    Send a get request for path to the given node, like get_request_node (same cache), returns None if the node could not be reached
+    """
+    ttl = get_cache_ttl(path)
+    if ttl <= 0:
+        return await _async_fetch_from_node(node, path)
+
+    key = get_cache_key(node, path)
+    entry = await cache.aget(key)
+    now = time.time()
+
+    if entry is not None:
+        if now < entry["expires"]:
+            if entry["status"] is None:
+                return None
+            return response_from_cache(entry)
+
+        if entry["status"] == 200 and now < entry["stale_until"]:
+            # serve the stale copy right away and let a single background refresh update it
+            lock_key = f"{key}:refreshing"
+            if await cache.aadd(lock_key, True, settings.FEDERATION_CONNECT_TIMEOUT + settings.FEDERATION_READ_TIMEOUT):
+                task = asyncio.create_task(_async_refresh_cached_response(node, path, key, ttl, entry, lock_key))
+                _refresh_tasks.add(task)
+                task.add_done_callback(_refresh_tasks.discard)
+            return response_from_cache(entry)
+
+    return await _async_refresh_cached_response(node, path, key, ttl, entry)
+
+
+def _get_active_nodes(host_urls):
+    return {host_url: get_node_by_host(host_url, active=True) for host_url in host_urls}
+
+
+async def async_get_request_remote(host_url, path):
+    """
+    Send a get request for path to the active node with the given host_url, returns None if there is none or it could not be reached
+    """
+    responses, _ = await async_get_request_remote_many({None: (host_url, path)}, deadline=None)
+    return responses[None]
+
+
+async def async_get_request_remote_many(targets, deadline=False):
+    """
+    Send the get requests in targets ({key: (host_url, path)}) concurrently, like get_request_remote_many.
+    Returns ({key: response or None}, partial). deadline=None waits for every request (they are bounded by the timeouts).
+    """
+    if deadline is False:
+        deadline = settings.FEDERATION_FANOUT_DEADLINE
+
+    # the node lookups may load the registry from the database, that has to happen off the event loop
+    nodes = await sync_to_async(_get_active_nodes)({host_url for host_url, _ in targets.values()})
+
+    responses = {}
+    tasks = {}
+    for key, (host_url, path) in targets.items():
+        node = nodes[host_url]
+        if node is None:
+            logger.warning("No active node found for host: %s", host_url)
+            responses[key] = None
+        else:
+            tasks[asyncio.create_task(async_get_request_node(node, path))] = key
+
+    not_done = set()
+    if tasks:
+        done, not_done = await asyncio.wait(tasks, timeout=deadline)
+        for task in not_done:
+            task.cancel()
+        for task in done:
+            try:
+                responses[tasks[task]] = task.result()
+            except Exception as e:
+                logger.warning("Fan-out request failed: %s", e)
+                responses[tasks[task]] = None
+
+    await sync_to_async(save_breaker_states)()
+    return responses, len(not_done) > 0
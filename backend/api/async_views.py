@@ -0,0 +1,142 @@
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse
+from rest_framework import exceptions
+from .models import Author
+from .mirror import get_synced_author_ids
+from .utils import get_remote_posts
+from .async_utils import async_get_request_remote, close_client_session
+from . import views
+
+# Async versions of the views that mostly wait on other nodes (ASYNC_FEDERATION_VIEWS, see api/urls.py).
+# The home feed and the remote authors list aren't among them, they read the mirror and the remote author directory
+# (see api/mirror.py and api/directory.py).
+# Under ASGI their remote GETs are awaited on the aiohttp client (api/async_utils.py) instead of holding a worker
+# thread, so a slow node doesn't tie up the server. DRF views can't be async, so these are plain Django views that
+# run the DRF view's own authentication and permission checks, and hand everything that isn't a remote GET to it.
+
+
+def authenticate_request(request, sync_view):
+    """
+    Run the DRF view sync_view's own checks (authentication, permissions and throttles, as configured for it)
+    on a plain Django request. Returns (DRF request, None) or (None, error response)
+    """
+    view = sync_view.cls(**sync_view.initkwargs)
+    view.args, view.kwargs = (), {}
+    view.headers = view.default_response_headers
+    drf_request = view.initialize_request(request)
+    view.request = drf_request
+    try:
+        view.initial(drf_request)
+    except exceptions.APIException as e:
+        # DRF's own error response, with its WWW-Authenticate header or 403
+        response = view.finalize_response(drf_request, view.handle_exception(e))
+        return None, response.render()
+    return drf_request, None
+
+
+def federation_view(sync_view):
+    """
+    Make an async view out of a coroutine that answers the remote GETs, it returns None for whatever
+    the DRF view sync_view should handle instead.
+    """
+    def decorator(handle_remote):
+        async def view(request, *args, **kwargs):
+            try:
+                if request.method == "GET":
+                    response = await handle_remote(request, *args, **kwargs)
+                    if response is not None:
+                        return response
+                return await sync_to_async(sync_view)(request, *args, **kwargs)
+            finally:
+                # outside of ASGI every async view runs on its own short lived event loop, so its session can't be reused
+                if not isinstance(request, ASGIRequest):
+                    await close_client_session()
+
+        view.__name__ = sync_view.__name__
+        view.__doc__ = sync_view.__doc__
+        # the DRF view's class keeps the endpoint in the swagger docs
+        view.cls = sync_view.cls
+        view.initkwargs = sync_view.initkwargs
+        view.csrf_exempt = True
+        return view
+    return decorator
+
+
+@federation_view(views.get_and_create_post)
+async def get_and_create_post(request, id_author):
+    author = await Author.objects.filter(id=id_author).afirst()
+    if author is None or not author.is_remote:
+        return None
+    # the posts of the authors followed here are read from the mirror, nothing to wait on
+    if await sync_to_async(get_synced_author_ids)([id_author]):
+        return None
+
+    drf_request, error = await sync_to_async(authenticate_request)(request, views.get_and_create_post)
+    if error is not None:
+        return error
+
+    response = await async_get_request_remote(host_url=author.host, path=f"authors/{id_author}/posts/")
+    if response is not None and response.status_code == 200:
+        def build_posts():
+            return views.get_remote_author_posts_response(drf_request, get_remote_posts(response, drf_request), id_author)
+        return JsonResponse(await sync_to_async(build_posts)())
+    return JsonResponse({"details": "Error getting posts from remote server"}, status=400)
+
+
+@federation_view(views.get_and_create_comment)
+async def get_and_create_comment(request, id_author, id_post):
+    post_author = await Author.objects.filter(id=id_author).afirst()
+    if post_author is None or not post_author.is_remote:
+        return None
+
+    drf_request, error = await sync_to_async(authenticate_request)(request, views.get_and_create_comment)
+    if error is not None:
+        return error
+
+    response = await async_get_request_remote(host_url=post_author.host, path=f"authors/{id_author}/posts/{id_post}/comments")
+    if response is None:
+        # same as the DRF view, fall back to what we have locally
+        return None
+    if response.status_code == 200:
+        return_response = response.json()
+        if "comments" in return_response and "items" not in return_response:
+            return_response["items"] = return_response["comments"]
+        return JsonResponse(return_response, safe=False)
+    return JsonResponse(response.text, status=response.status_code, safe=False)
+
+
+@federation_view(views.get_post_likes)
+async def get_post_likes(request, id_author, id_post):
+    post_author = await Author.objects.filter(id=id_author).afirst()
+    if post_author is None or not post_author.is_remote:
+        return None
+
+    drf_request, error = await sync_to_async(authenticate_request)(request, views.get_post_likes)
+    if error is not None:
+        return error
+
+    response = await async_get_request_remote(host_url=post_author.host, path=f"authors/{id_author}/posts/{id_post}/likes")
+    if response is None:
+        return JsonResponse({"details": "Error getting likes from remote server"}, status=400)
+    if response.status_code == 200:
+        return JsonResponse(response.json(), safe=False)
+    return JsonResponse(response.text, status=response.status_code, safe=False)
+
+
+@federation_view(views.get_image)
+async def get_image(request, id_author, id_post):
+    author = await Author.objects.filter(id=id_author).afirst()
+    if author is None or not author.is_remote:
+        return None
+
+    drf_request, error = await sync_to_async(authenticate_request)(request, views.get_image)
+    if error is not None:
+        return error
+
+    response = await async_get_request_remote(host_url=author.host, path=f"authors/{id_author}/posts/{id_post}/image")
+    if response is not None and response.status_code == 200:
+        return HttpResponse(response.content, content_type=response.headers.get('Content-Type'))
+    # same as the DRF view, fall back to what we have locally, without asking the node again
+    request.remote_image_fetched = True
+    return None
@@ -0,0 +1,492 @@
+import io
+import math
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from datetime import timedelta
+from importlib import import_module
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.hashers import make_password
+from django.core.wsgi import get_wsgi_application
+from django.db import connections
+from django.utils import timezone
+from PIL import Image as PILImage
+from .breaker import reset_breaker
+from .counters import rebuild_post_counters
+from .directory import refresh_remote_authors
+from .mirror import sync_remote_posts
+from .models import Author, Comment, Follower, Image, Inbox, Like, Outbox, Post, RemoteAuthorSync, RemotePostSync
+from .nodes import invalidate_node_registry
+from .outbox import deliver_outbox
+from .search import index_authors
+from .stubnode import StubNode
+from .timeline import rebuild_timeline
+
+# Load testing against a synthetic social graph (manage.py seed_dataset, then manage.py loadtest).
+#   - the dataset has a power-law follower graph (a few authors have most of the followers) with a share of the
+#     follows returned as friendships, posts in every visibility including image posts, comments, likes and inbox items.
+#     Seeded authors are recognised by their email domain, so a dataset can be removed and seeded again
+#   - the load test sends the hot GETs concurrently through the real WSGI application (all the middleware included)
+#     as logged in seeded authors, and reports latency percentiles, throughput and SQL queries per request
+#     (read from the Server-Timing header, see api/metrics.py) for each endpoint
+#   - the federation benchmark (manage.py bench_federation) runs stub nodes (api/stubnode.py) as the peers, and for
+#     each number of remote followees and fraction of slow peers measures a mirror sync round, the home feed,
+#     a remote author directory refresh, the remote authors listing and an inbox delivery round
+
+SEED_EMAIL_DOMAIN = "seed.snackoverflow.test"
+# the viewer and remote authors of the federation benchmark, removed when it ends
+STUB_EMAIL_DOMAIN = "stub.snackoverflow.test"
+SEED_PASSWORD = "seeded-password"
+BATCH_SIZE = 1000
+
+VISIBILITIES = (("PUBLIC", 0.6), ("FRIENDS", 0.25), ("UNLISTED", 0.15))
+
+
+def get_seeded_authors():
+    return Author.objects.filter(email__endswith=f"@{SEED_EMAIL_DOMAIN}")
+
+
+def clear_dataset():
+    """
+    Remove the seeded authors and everything of theirs, returns the number of authors removed
+    """
+    authors = get_seeded_authors()
+    count = authors.count()
+    # the rows are removed with the posts and authors they belong to
+    Post.objects.filter(author__in=authors).delete()
+    authors.delete()
+    return count
+
+
+def _make_images(rng, count):
+    images = []
+    for i in range(count):
+        buffer = io.BytesIO()
+        color = tuple(rng.randrange(256) for _ in range(3))
+        PILImage.new("RGB", (64 + 32 * i, 48 + 24 * i), color).save(buffer, format="PNG")
+        # stored like the images of posts, under the hash of their bytes
+        images.append(Image.objects.store(buffer.getvalue(), "image/png"))
+    return images
+
+
+def _follow_graph(rng, author_ids, average_following, alpha, friend_ratio):
+    """
+    Pick who follows whom: how many authors each one follows is exponentially distributed around average_following,
+    and who gets followed follows a power law (the i-th most popular author is weighted 1 / i^alpha)
+    """
+    popularity = list(author_ids)
+    rng.shuffle(popularity)
+    cum_weights = []
+    total = 0.0
+    for rank in range(len(popularity)):
+        total += 1 / (rank + 1) ** alpha
+        cum_weights.append(total)
+
+    pairs = set()
+    for author_id in author_ids:
+        following = min(len(author_ids) - 1, int(rng.expovariate(1 / average_following)) + 1)
+        for followed_id in set(rng.choices(popularity, cum_weights=cum_weights, k=following)):
+            if followed_id != author_id:
+                pairs.add((author_id, followed_id))
+    for follower_id, followed_id in list(pairs):
+        if rng.random() < friend_ratio:
+            pairs.add((followed_id, follower_id))
+    return pairs
+
+
+def seed_dataset(authors=1000, posts_per_author=5, average_following=20, alpha=1.1, friend_ratio=0.3, image_ratio=0.1,
+                 comments_per_post=2, likes_per_post=4, inbox_per_author=20, days=90, host="http://localhost/", seed=0, log=None):
+    """
+    Seed a synthetic dataset, on top of whatever is in the database. Returns the number of rows made per model
+    """
+    rng = random.Random(seed)
+    log = log or (lambda message: None)
+    now = timezone.now()
+
+    def random_time():
+        return now - timedelta(seconds=rng.uniform(0, days * 24 * 3600))
+
+    # authors, the password is hashed once for all of them
+    password = make_password(SEED_PASSWORD)
+    run = uuid.uuid4().hex[:8]
+    author_rows = []
+    for i in range(authors):
+        author_id = uuid.uuid4()
+        author_rows.append(Author(
+            id=author_id, email=f"{run}-{i}@{SEED_EMAIL_DOMAIN}", display_name=f"seeded author {i}", github="https://github.com",
+            host=host, url=f"{host}api/authors/{author_id}", password=password, is_active=True,
+        ))
+    Author.objects.bulk_create(author_rows, batch_size=BATCH_SIZE)
+    author_ids = [author.id for author in author_rows]
+    log(f"{len(author_rows)} authors")
+
+    pairs = _follow_graph(rng, author_ids, average_following, alpha, friend_ratio)
+    Follower.objects.bulk_create(
+        [Follower(follower_id=follower_id, followed_user_id=followed_id) for follower_id, followed_id in pairs],
+        batch_size=BATCH_SIZE, ignore_conflicts=True,
+    )
+    log(f"{len(pairs)} follows")
+
+    # posts, auto_now_add stamps them all with now so their dates are spread out after they are made
+    images = _make_images(rng, 4)
+    post_rows = []
+    for author_id in author_ids:
+        for _ in range(rng.randint(0, 2 * posts_per_author)):
+            post_id = uuid.uuid4()
+            post_url = f"{host}api/authors/{author_id}/posts/{post_id}"
+            visibility = rng.choices([name for name, _ in VISIBILITIES], weights=[weight for _, weight in VISIBILITIES])[0]
+            post = Post(
+                id=post_id, author_id=author_id, title=f"seeded post {len(post_rows)}", description="a seeded post",
+                source=post_url, origin=post_url, comments=f"{post_url}/comments", visibility=visibility,
+            )
+            if rng.random() < image_ratio:
+                post.contentType = "image/png;base64"
+                post.content = ""
+                post.image = rng.choice(images)
+            else:
+                post.contentType = rng.choice(["text/plain", "text/markdown"])
+                post.content = " ".join(rng.choice(["snack", "overflow", "federated", "post", "hello", "world"]) for _ in range(rng.randint(5, 60)))
+            post_rows.append(post)
+    Post.objects.bulk_create(post_rows, batch_size=BATCH_SIZE)
+    # images no seeded post picked would never be cleared with the dataset
+    Image.objects.delete_unused([image.hash for image in images])
+    for post in post_rows:
+        post.published = random_time()
+    Post.objects.bulk_update(post_rows, ['published'], batch_size=BATCH_SIZE)
+    log(f"{len(post_rows)} posts")
+
+    # comments and likes on the posts that can be read by others
+    readable = [post for post in post_rows if post.visibility != "UNLISTED"]
+    comment_rows = []
+    like_pairs = set()
+    for post in readable:
+        for _ in range(int(rng.expovariate(1 / comments_per_post)) if comments_per_post else 0):
+            comment_rows.append(Comment(
+                author_id=rng.choice(author_ids), post=post, comment="a seeded comment",
+                contentType="text/plain",
+            ))
+        for _ in range(int(rng.expovariate(1 / likes_per_post)) if likes_per_post else 0):
+            like_pairs.add((rng.choice(author_ids), post))
+    Comment.objects.bulk_create(comment_rows, batch_size=BATCH_SIZE)
+    for comment in comment_rows:
+        comment.published = comment.post.published + timedelta(seconds=rng.uniform(0, 3600))
+    Comment.objects.bulk_update(comment_rows, ['published'], batch_size=BATCH_SIZE)
+    Like.objects.bulk_create(
+        [Like(author_id=author_id, post=post, summary="seeded author likes your post", object=post.origin) for author_id, post in like_pairs],
+        batch_size=BATCH_SIZE,
+    )
+    log(f"{len(comment_rows)} comments, {len(like_pairs)} likes")
+
+    # inbox items as the other authors would have sent them
+    inbox_rows = []
+    for author_id in author_ids:
+        for _ in range(rng.randint(0, 2 * inbox_per_author)):
+            sender_id = rng.choice(author_ids)
+            post = rng.choice(readable) if readable else None
+            kind = rng.choice(["post", "comment", "Like", "Follow"]) if post else "Follow"
+            item = {"type": kind, "author": {"type": "author", "id": f"{host}api/authors/{sender_id}"}}
+            if kind == "post":
+                item.update({"id": post.origin, "title": post.title, "visibility": post.visibility})
+            elif kind == "comment":
+                item.update({"comment": "a seeded comment", "post": post.origin})
+            elif kind == "Like":
+                item.update({"summary": "seeded author likes your post", "object": post.origin})
+            else:
+                item.update({"summary": "seeded author wants to follow you", "object": {"type": "author", "id": f"{host}api/authors/{author_id}"}})
+            inbox_rows.append(Inbox(author_id=author_id, item=item))
+    Inbox.objects.bulk_create(inbox_rows, batch_size=BATCH_SIZE)
+    for inbox in inbox_rows:
+        inbox.published = random_time()
+    Inbox.objects.bulk_update(inbox_rows, ['published'], batch_size=BATCH_SIZE)
+    log(f"{len(inbox_rows)} inbox items")
+
+    # bulk_create skips the signals, so the counters, the home feeds and the search index are built from the rows
+    rebuild_post_counters()
+    for author in author_rows:
+        rebuild_timeline(author)
+    index_authors(author_rows)
+    log("counters, timelines and search index rebuilt")
+
+    return {
+        "authors": len(author_rows), "follows": len(pairs), "posts": len(post_rows), "comments": len(comment_rows),
+        "likes": len(like_pairs), "inbox": len(inbox_rows),
+    }
+
+
+# endpoint name: (weight in the mix, path of a request given the viewer and a post)
+ENDPOINTS = {
+    "publicPosts": (3, lambda viewer, post: "/api/publicPosts/"),
+    "friendsFollowerPosts": (4, lambda viewer, post: f"/api/friendsFollowerPosts/{viewer}"),
+    "authorPosts": (3, lambda viewer, post: f"/api/authors/{post[0]}/posts/"),
+    "inbox": (2, lambda viewer, post: f"/api/authors/{viewer}/inbox"),
+    "comments": (2, lambda viewer, post: f"/api/authors/{post[0]}/posts/{post[1]}/comments"),
+    "likes": (2, lambda viewer, post: f"/api/authors/{post[0]}/posts/{post[1]}/likes"),
+}
+
+_QUERIES = re.compile(r'db;dur=[\d.]+;desc="(\d+) queries"')
+
+
+def _login(author):
+    """
+    Make a session for the author, returns its key
+    """
+    session = import_module(settings.SESSION_ENGINE).SessionStore()
+    session[SESSION_KEY] = str(author.pk)
+    session[BACKEND_SESSION_KEY] = "django.contrib.auth.backends.ModelBackend"
+    session[HASH_SESSION_KEY] = author.get_session_auth_hash()
+    session.save()
+    return session.session_key
+
+
+def _call(application, path, query, session_key):
+    """
+    Send a GET through the WSGI application, returns (status, headers, body size)
+    """
+    environ = {
+        "REQUEST_METHOD": "GET", "PATH_INFO": path, "QUERY_STRING": query, "SCRIPT_NAME": "",
+        "SERVER_NAME": "localhost", "SERVER_PORT": "80", "SERVER_PROTOCOL": "HTTP/1.1", "HTTP_HOST": "localhost",
+        "HTTP_ACCEPT": "application/json", "HTTP_COOKIE": f"{settings.SESSION_COOKIE_NAME}={session_key}",
+        "wsgi.version": (1, 0), "wsgi.url_scheme": "http", "wsgi.input": io.BytesIO(b""), "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True, "wsgi.multiprocess": False, "wsgi.run_once": False,
+    }
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started["status"] = int(status.split(" ", 1)[0])
+        started["headers"] = dict(headers)
+
+    body = application(environ, start_response)
+    try:
+        size = sum(len(chunk) for chunk in body)
+    finally:
+        if hasattr(body, "close"):
+            body.close()
+    return started["status"], started["headers"], size
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of sorted values
+    """
+    if not values:
+        return None
+    return values[max(math.ceil(fraction * len(values)), 1) - 1]
+
+
+def _summarize(samples, elapsed):
+    latencies = sorted(latency for latency, status, queries, size in samples)
+    queries = [queries for latency, status, queries, size in samples if queries is not None]
+    return {
+        "requests": len(samples),
+        "errors": sum(1 for latency, status, queries, size in samples if status >= 400),
+        "throughput": round(len(samples) / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+            "p95": round(percentile(latencies, 0.95) * 1000, 2) if latencies else None,
+            "p99": round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+            "mean": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else None,
+            "max": round(latencies[-1] * 1000, 2) if latencies else None,
+        },
+        "queries": {
+            "mean": round(sum(queries) / len(queries), 2) if queries else None,
+            "max": max(queries) if queries else None,
+        },
+        "bytes_mean": round(sum(size for latency, status, queries, size in samples) / len(samples)) if samples else None,
+    }
+
+
+def run_load_test(duration=30, concurrency=8, max_requests=None, endpoints=None, page_size=None, viewers=200, seed=0, log=None):
+    """
+    Send the hot GETs through the WSGI application from concurrency threads for duration seconds
+    (or until max_requests are sent), as seeded authors. page_size pages the lists with the cursor pagination,
+    otherwise they are requested whole like the frontend does. Returns the results
+    """
+    log = log or (lambda message: None)
+    endpoints = endpoints or list(ENDPOINTS)
+    rng = random.Random(seed)
+
+    viewer_authors = list(get_seeded_authors().order_by("?")[:viewers])
+    if not viewer_authors:
+        raise ValueError("There is no seeded dataset, run seed_dataset first")
+    sessions = [(str(author.id), _login(author)) for author in viewer_authors]
+    posts = [(str(author_id), str(post_id)) for author_id, post_id in Post.objects.filter(
+        author__in=get_seeded_authors(), visibility="PUBLIC"
+    ).order_by("?").values_list("author_id", "id")[:1000]]
+    if not posts:
+        raise ValueError("The seeded dataset has no public posts")
+    query = f"cursor=&size={page_size}" if page_size else ""
+
+    application = get_wsgi_application()
+    samples = {name: [] for name in endpoints}
+    samples_lock = threading.Lock()
+    sent = [0]
+    deadline = time.perf_counter() + duration
+
+    def worker(worker_rng):
+        try:
+            while time.perf_counter() < deadline:
+                with samples_lock:
+                    if max_requests is not None and sent[0] >= max_requests:
+                        return
+                    sent[0] += 1
+                name = worker_rng.choices(endpoints, weights=[ENDPOINTS[name][0] for name in endpoints])[0]
+                viewer, session_key = worker_rng.choice(sessions)
+                path = ENDPOINTS[name][1](viewer, worker_rng.choice(posts))
+                start = time.perf_counter()
+                # the likes aren't paginated
+                status, headers, size = _call(application, path, query if name != "likes" else "", session_key)
+                latency = time.perf_counter() - start
+                match = _QUERIES.search(headers.get("Server-Timing", ""))
+                with samples_lock:
+                    samples[name].append((latency, status, int(match.group(1)) if match else None, size))
+        finally:
+            connections.close_all()
+
+    log(f"{concurrency} threads for {duration}s against {', '.join(endpoints)}")
+    started_at = timezone.now()
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(random.Random(rng.random()),)) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    return {
+        "started_at": started_at.isoformat(),
+        "elapsed": round(elapsed, 3),
+        "concurrency": concurrency,
+        "page_size": page_size,
+        "dataset": {
+            "authors": get_seeded_authors().count(),
+            "posts": Post.objects.filter(author__in=get_seeded_authors()).count(),
+            "follows": Follower.objects.filter(follower__in=get_seeded_authors()).count(),
+        },
+        "total": _summarize([sample for name in endpoints for sample in samples[name]], elapsed),
+        "endpoints": {name: _summarize(samples[name], elapsed) for name in endpoints},
+    }
+
+
+def _reset_peers(viewer, registered):
+    """
+    Put the stub nodes back to how they started, between two scenarios
+    """
+    Follower.objects.filter(follower=viewer).delete()
+    RemotePostSync.objects.filter(author__email__endswith=f"@{STUB_EMAIL_DOMAIN}").delete()
+    for node in registered:
+        reset_breaker(node)
+        Outbox.objects.filter(node=node).delete()
+        RemoteAuthorSync.objects.filter(node=node).delete()
+    # the registry's Nodes hold the breaker states they were loaded with
+    invalidate_node_registry()
+
+
+def _time_feed(application, viewer, session_key, requests):
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        _call(application, f"/api/friendsFollowerPosts/{viewer.id}", "", session_key)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return {"p50": round(percentile(latencies, 0.50) * 1000, 2), "p95": round(percentile(latencies, 0.95) * 1000, 2)} if latencies else None
+
+
+def run_federation_benchmark(followees=(10, 50, 100), slow_fractions=(0, 0.25, 0.5), peers=4, fast_latency="lognormal:20,0.3",
+                             slow_latency="lognormal:1000,0.5", error_rate=0.0, posts_per_author=20, content_bytes=500,
+                             pagination="paged", feed_requests=10, seed=0, log=None):
+    """
+    Measure the federation paths against stub peers for every number of remote followees and fraction of slow peers.
+    The first round(peers * fraction) peers answer with slow_latency, the others with fast_latency.
+    Returns the results
+    """
+    log = log or (lambda message: None)
+    authors_per_peer = -(-max(followees) // peers)
+    stubs = [
+        StubNode(team_name=f"stub peer {i}", authors=authors_per_peer, posts_per_author=posts_per_author, latency=fast_latency,
+                 error_rate=error_rate, content_bytes=content_bytes, pagination=pagination, seed=seed + i).start()
+        for i in range(peers)
+    ]
+    registered = []
+    run = uuid.uuid4().hex[:8]
+    try:
+        registered = [stub.register() for stub in stubs]
+        viewer = Author.objects.create(email=f"{run}-viewer@{STUB_EMAIL_DOMAIN}", display_name="federation benchmark viewer",
+                                       github="https://github.com", host="http://localhost/", password=SEED_PASSWORD)
+        viewer.url = f"{viewer.host}api/authors/{viewer.id}"
+        viewer.save(update_fields=["url"])
+        # the peers' authors, interleaved so any number of followees is spread evenly over the peers
+        remote_authors = []
+        for index in range(authors_per_peer):
+            for stub in stubs:
+                author_id = stub.get_author_ids()[index]
+                remote_authors.append(Author(
+                    id=author_id, email=f"{run}-{author_id}@{STUB_EMAIL_DOMAIN}", display_name=stub.authors[author_id]["displayName"],
+                    github="https://github.com", host=stub.url, url=stub.authors[author_id]["url"], is_remote=True,
+                ))
+        Author.objects.bulk_create(remote_authors, batch_size=BATCH_SIZE)
+        node_by_host = {node.host_url: node for node in registered}
+
+        application = get_wsgi_application()
+        session_key = _login(viewer)
+        results = []
+        for slow_fraction in slow_fractions:
+            slow = round(peers * slow_fraction)
+            for i, stub in enumerate(stubs):
+                stub.set_latency(slow_latency if i < slow else fast_latency)
+            for count in followees:
+                _reset_peers(viewer, registered)
+                followed = remote_authors[:count]
+                Follower.objects.bulk_create([Follower(follower=viewer, followed_user=author) for author in followed])
+
+                start = time.perf_counter()
+                sync = sync_remote_posts(batch_size=count)
+                sync_seconds = time.perf_counter() - start
+                synced = RemotePostSync.objects.filter(author__in=followed, last_synced_at__isnull=False).count()
+
+                feed = _time_feed(application, viewer, session_key, feed_requests)
+
+                start = time.perf_counter()
+                refresh_remote_authors()
+                directory_seconds = time.perf_counter() - start
+
+                start = time.perf_counter()
+                status, _, _ = _call(application, "/api/remote-authors/", "", session_key)
+                remote_authors_seconds = time.perf_counter() - start
+
+                for author in followed:
+                    node = node_by_host[author.host]
+                    Outbox.objects.create(node=node, request_url=f"{node.api_url}authors/{author.id}/inbox",
+                                          payload={"type": "inbox", "author": viewer.url, "object": {"type": "Follow", "summary": "benchmark"}})
+                start = time.perf_counter()
+                deliver_outbox(batch_size=count)
+                delivery_seconds = time.perf_counter() - start
+
+                row = {
+                    "followees": count, "slow_fraction": slow_fraction, "slow_peers": slow,
+                    "sync_seconds": round(sync_seconds, 3), "synced": synced, "sync_failed": sync["failed"],
+                    "feed_ms": feed, "directory_seconds": round(directory_seconds, 3), "remote_authors_ms": round(remote_authors_seconds * 1000, 2), "remote_authors_status": status,
+                    "delivery_seconds": round(delivery_seconds, 3),
+                    "delivered": Outbox.objects.filter(node__in=registered, status="SENT").count(),
+                }
+                results.append(row)
+                log(f"{count} followees, {slow}/{peers} slow peers: sync {row['sync_seconds']}s ({synced} synced), "
+                    f"feed p50 {feed['p50'] if feed else None}ms, directory {row['directory_seconds']}s, remote authors {row['remote_authors_ms']}ms, delivery {row['delivery_seconds']}s")
+    finally:
+        for stub in stubs:
+            stub.stop()
+        Author.objects.filter(email__endswith=f"@{STUB_EMAIL_DOMAIN}").delete()
+        for node in registered:
+            reset_breaker(node)
+            node.delete()
+        connections.close_all()
+
+    return {
+        "peers": peers, "fast_latency": fast_latency, "slow_latency": slow_latency, "error_rate": error_rate,
+        "posts_per_author": posts_per_author, "pagination": pagination,
+        "stub_requests": {stub.team_name: stub.stats for stub in stubs},
+        "scenarios": results,
+    }
@@ -0,0 +1,157 @@
+from collections import deque
+from datetime import datetime, timezone as dt_timezone
+from django.conf import settings
+import logging
+import requests
+import threading
+import time
+from .models import Node
+
+logger = logging.getLogger(__name__)
+
+# A circuit breaker per node, kept in memory by the federation client (api/utils.py node_request):
+#   CLOSED    requests go through, FEDERATION_BREAKER_FAILURES failures in a row (errors, timeouts, 5xx) open it
+#   OPEN      requests fail right away without waiting on the node, for FEDERATION_BREAKER_COOLDOWN seconds
+#   HALF_OPEN a single probe request goes through, it closes the breaker if it succeeds and opens it again if not
+# The state and the error rate of the last FEDERATION_BREAKER_WINDOW seconds are saved on the Node
+# (see save_breaker_states) so they show up in the admin.
+
+CLOSED = "CLOSED"
+OPEN = "OPEN"
+HALF_OPEN = "HALF_OPEN"
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+class NodeUnavailable(requests.exceptions.ConnectionError):
+    """
+    Raised instead of sending a request to a node whose breaker is open,
+    it is a ConnectionError so callers handle it like any unreachable node
+    """
+
+
+class CircuitBreaker:
+    def __init__(self, node):
+        self.node_id = node.id
+        self.team_name = node.team_name
+        self.lock = threading.Lock()
+        self.state = node.breaker_state
+        self.opened_at = node.breaker_opened_at.timestamp() if node.breaker_opened_at else None
+        self.consecutive_failures = node.consecutive_failures
+        self.last_error = node.last_error
+        self.probe_started_at = None
+        # (time, succeeded) of the recent requests
+        self.results = deque()
+        self.changed = False
+        self.unsaved_results = False
+        self.saved_at = 0
+
+    def allow_request(self):
+        with self.lock:
+            if self.state == OPEN and time.time() - self.opened_at >= settings.FEDERATION_BREAKER_COOLDOWN:
+                self.state = HALF_OPEN
+                self.probe_started_at = None
+                self.changed = True
+            if self.state == HALF_OPEN:
+                # a probe that never reported back (it can't take longer than the timeouts) doesn't block new probes
+                probe_timeout = settings.FEDERATION_CONNECT_TIMEOUT + settings.FEDERATION_READ_TIMEOUT
+                if self.probe_started_at is not None and time.time() - self.probe_started_at < probe_timeout:
+                    return False
+                self.probe_started_at = time.time()
+                return True
+            return self.state == CLOSED
+
+    def record_success(self):
+        with self.lock:
+            self._add_result(True)
+            self.consecutive_failures = 0
+            if self.state != CLOSED:
+                logger.info("Circuit closed for node: %s", self.team_name)
+                self.state = CLOSED
+                self.opened_at = None
+                self.probe_started_at = None
+                self.changed = True
+
+    def record_failure(self, error):
+        with self.lock:
+            self._add_result(False)
+            self.consecutive_failures += 1
+            self.last_error = str(error)[:1000]
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.consecutive_failures >= settings.FEDERATION_BREAKER_FAILURES):
+                logger.warning("Circuit opened for node: %s after %s failures: %s", self.team_name, self.consecutive_failures, self.last_error)
+                self.state = OPEN
+                self.opened_at = time.time()
+                self.probe_started_at = None
+                self.changed = True
+
+    def _add_result(self, succeeded):
+        now = time.time()
+        self.unsaved_results = True
+        self.results.append((now, succeeded))
+        while self.results and self.results[0][0] < now - settings.FEDERATION_BREAKER_WINDOW:
+            self.results.popleft()
+
+    def get_stats(self):
+        with self.lock:
+            window_start = time.time() - settings.FEDERATION_BREAKER_WINDOW
+            recent = [succeeded for at, succeeded in self.results if at >= window_start]
+            return {
+                "state": self.state,
+                "opened_at": self.opened_at,
+                "consecutive_failures": self.consecutive_failures,
+                "recent_requests": len(recent),
+                "recent_failures": recent.count(False),
+                "last_error": self.last_error,
+            }
+
+
+def get_breaker(node):
+    """
+    Get (or lazily create) the breaker of a node, a new breaker starts from the state saved on the Node
+    """
+    breaker = _breakers.get(node.id)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(node.id)
+            if breaker is None:
+                breaker = CircuitBreaker(node)
+                _breakers[node.id] = breaker
+    return breaker
+
+
+def save_breaker_states(force=False):
+    """
+    Save the breaker state and recent error rate of each node on its Node row.
+    State changes are saved right away, error rates at most every FEDERATION_BREAKER_SAVE_INTERVAL seconds.
+    The breakers are updated from worker threads, this is called from request threads so only they touch the database.
+    """
+    now = time.time()
+    for breaker in list(_breakers.values()):
+        if not (force or breaker.changed or (breaker.unsaved_results and now - breaker.saved_at >= settings.FEDERATION_BREAKER_SAVE_INTERVAL)):
+            continue
+        breaker.changed = False
+        breaker.unsaved_results = False
+        breaker.saved_at = now
+        stats = breaker.get_stats()
+        Node.objects.filter(id=breaker.node_id).update(
+            breaker_state=stats["state"],
+            breaker_opened_at=datetime.fromtimestamp(stats["opened_at"], dt_timezone.utc) if stats["opened_at"] else None,
+            consecutive_failures=stats["consecutive_failures"],
+            recent_requests=stats["recent_requests"],
+            recent_failures=stats["recent_failures"],
+            last_error=stats["last_error"],
+            health_checked_at=datetime.fromtimestamp(now, dt_timezone.utc),
+        )
+
+
+def reset_breaker(node):
+    """
+    Close a node's breaker and forget its recent requests, on the Node too
+    """
+    with _breakers_lock:
+        _breakers.pop(node.id, None)
+    Node.objects.filter(id=node.id).update(
+        breaker_state=CLOSED, breaker_opened_at=None, consecutive_failures=0, recent_requests=0, recent_failures=0, last_error="",
+    )
+    node.breaker_state, node.breaker_opened_at, node.consecutive_failures, node.last_error = CLOSED, None, 0, ""
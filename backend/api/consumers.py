@@ -0,0 +1,30 @@
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+
+# New inbox items (posts, follow requests, likes, comments) are pushed to the author's open pages over a websocket,
+# so the frontend doesn't have to poll GET authors/<id>/inbox. The Inbox post_save signal (api/signals.py)
+# sends every new row to the group of its author.
+
+
+def get_inbox_group(author_id):
+    return f"inbox_{author_id}"
+
+
+class InboxConsumer(AsyncJsonWebsocketConsumer):
+    """
+    ws/authors/<id_author>/inbox, only the author can listen to their inbox
+    """
+    async def connect(self):
+        user = self.scope.get("user")
+        self.group = get_inbox_group(self.scope["url_route"]["kwargs"]["id_author"])
+        if user is None or not user.is_authenticated or get_inbox_group(user.id) != self.group:
+            await self.close()
+            return
+        await self.channel_layer.group_add(self.group, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, code):
+        if self.channel_layer is not None and hasattr(self, "group"):
+            await self.channel_layer.group_discard(self.group, self.channel_name)
+
+    async def inbox_item(self, event):
+        await self.send_json({"type": "inbox", "item": event["item"]})
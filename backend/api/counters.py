@@ -0,0 +1,42 @@
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from .models import Comment, Like, Post
+
+# Post.count (comments) and Post.likeCount are denormalized counters, so the posts can be served without counting
+# rows. They are changed with F() updates from the Comment and Like signals (api/signals.py), in the same transaction
+# as the insert or delete, and can be rebuilt from the rows with `manage.py rebuild_post_counters` if they drift.
+
+
+def change_post_counter(post_id, field, delta):
+    """
+    Atomically add delta to a counter of a post, it never goes below 0
+    """
+    if post_id is None:
+        return
+    posts = Post.objects.filter(pk=post_id)
+    if delta < 0:
+        posts = posts.filter(**{f"{field}__gte": -delta})
+    # an UPDATE of the counter column only, the rest of the row (and its content) isn't rewritten
+    posts.update(**{field: F(field) + delta})
+
+
+def _counted(model):
+    return Coalesce(Subquery(
+        model.objects.filter(post=OuterRef('pk')).order_by().values('post').annotate(total=Count('pk')).values('total')
+    ), 0)
+
+
+def rebuild_post_counters(batch_size=500):
+    """
+    Recount the comments and likes of the local posts whose counters drifted.
+    Returns the number of posts fixed.
+    """
+    # the counters of remote posts come from their node
+    drifted = Post.objects.filter(author__is_remote=False).annotate(
+        comment_total=_counted(Comment), like_total=_counted(Like),
+    ).filter(~Q(count=F('comment_total')) | ~Q(likeCount=F('like_total'))).values_list('pk', flat=True)
+
+    drifted = list(drifted)
+    for start in range(0, len(drifted), batch_size):
+        Post.objects.filter(pk__in=drifted[start:start + batch_size]).update(count=_counted(Comment), likeCount=_counted(Like))
+    return len(drifted)
@@ -0,0 +1,172 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+import validators
+from .models import Node, RemoteAuthor, RemoteAuthorSync
+from .search import index_remote_authors
+from .utils import get_request_remote_many
+
+# The other nodes' authors are kept in the RemoteAuthor table by a background worker (manage.py refresh_remote_authors),
+# /api/remote-authors/ pages and searches it instead of asking every node for its whole list on every call.
+# Each round refreshes the active nodes that are due, all of them at once:
+#   - the first page of a node's authors is asked for with the ETag / Last-Modified of the last refresh, so an
+#     unchanged node costs a 304
+#   - otherwise its pages are read until one comes back short (a node that doesn't page sends everything at once)
+#   - once the whole list was read, the node's authors missing from it are removed
+# Authors whose host isn't a valid url are dropped here, once, instead of on every read.
+
+
+def _pick_due():
+    due_before = timezone.now() - timedelta(seconds=settings.REMOTE_AUTHOR_DIRECTORY_INTERVAL)
+    return list(Node.objects.filter(is_active=True).filter(
+        Q(author_sync__isnull=True) | Q(author_sync__last_checked_at__isnull=True) | Q(author_sync__last_checked_at__lt=due_before)
+    ).order_by(F('author_sync__last_checked_at').asc(nulls_first=True), 'id'))
+
+
+def _store_authors(node, authors, seen_at):
+    """
+    Upsert a page of a node's authors into the directory, returns the urls stored
+    """
+    rows = {}
+    for author in authors:
+        if not isinstance(author, dict):
+            continue
+        url = author.get('id') or author.get('url')
+        if not url or not validators.url(author.get('host') or ""):
+            continue
+        rows[url] = RemoteAuthor(
+            node=node, url=url, host=author['host'], display_name=(author.get('displayName') or "")[:200], data=author, seen_at=seen_at,
+        )
+    if not rows:
+        return set()
+    # only the new authors and the ones whose name or github changed are indexed again for the search
+    known = {url: (display_name, data.get('github')) for url, display_name, data in RemoteAuthor.objects.filter(url__in=rows).values_list('url', 'display_name', 'data')}
+    changed = [url for url, row in rows.items() if known.get(url) != (row.display_name, row.data.get('github'))]
+    RemoteAuthor.objects.bulk_create(
+        list(rows.values()), update_conflicts=True, unique_fields=['url'],
+        update_fields=['node', 'host', 'display_name', 'data', 'seen_at'],
+    )
+    if changed:
+        index_remote_authors(RemoteAuthor.objects.filter(url__in=changed))
+    return set(rows)
+
+
+def refresh_remote_authors():
+    """
+    Refresh one round of due nodes' authors into the directory.
+    Returns {"checked": ..., "unchanged": ..., "authors": ..., "failed": ...}
+    """
+    size = settings.REMOTE_AUTHOR_DIRECTORY_PAGE_SIZE
+
+    # the authors of removed or deactivated nodes aren't listed anymore
+    RemoteAuthor.objects.exclude(node__is_active=True).delete()
+
+    nodes = _pick_due()
+    states = {state.node_id: state for state in RemoteAuthorSync.objects.filter(node__in=nodes)}
+    for node in nodes:
+        if node.id not in states:
+            states[node.id] = RemoteAuthorSync(node_id=node.id)
+
+    result = {"checked": 0, "unchanged": 0, "authors": 0, "failed": 0}
+    now = timezone.now()
+    # the urls read from each node during this round
+    seen = {node.id: set() for node in nodes}
+    pending = {node.id: node for node in nodes}
+    page = 1
+    while pending and page <= settings.REMOTE_AUTHOR_DIRECTORY_MAX_PAGES:
+        targets = {node.id: (node.host_url, f"authors/?page={page}&size={size}") for node in pending.values()}
+        headers = {}
+        for node_id in pending:
+            state = states[node_id]
+            headers[node_id] = {}
+            # only the first page is revalidated, the later ones are only asked for when it changed
+            if page == 1 and state.last_synced_at is not None:
+                if state.etag:
+                    headers[node_id]["If-None-Match"] = state.etag
+                if state.last_modified:
+                    headers[node_id]["If-Modified-Since"] = state.last_modified
+
+        responses, _ = get_request_remote_many(targets, deadline=settings.REMOTE_AUTHOR_DIRECTORY_DEADLINE, headers=headers)
+
+        next_pending = {}
+        for node_id, node in pending.items():
+            state = states[node_id]
+            if node_id not in responses:
+                # missed the deadline, the node stays due for the next round
+                if page > 1:
+                    # the walk didn't finish, the first page has to be read again next round
+                    state.etag = state.last_modified = ""
+                continue
+            response = responses[node_id]
+            state.last_checked_at = now
+            if page == 1:
+                result["checked"] += 1
+
+            if response is not None and response.status_code == 404 and page > 1:
+                # a node that 404s past its last page: the previous page was the last one
+                _finish(node, state, now)
+                continue
+            if response is None or response.status_code not in (200, 304):
+                state.last_status_code = response.status_code if response is not None else None
+                if page > 1:
+                    # the walk didn't finish, the first page has to be read again next round
+                    state.etag = state.last_modified = ""
+                result["failed"] += 1
+                continue
+
+            state.last_status_code = response.status_code
+            if response.status_code == 304:
+                state.last_synced_at = now
+                result["unchanged"] += 1
+                continue
+
+            try:
+                payload = response.json()
+            except ValueError:
+                result["failed"] += 1
+                continue
+            authors = (payload.get('items') or []) if isinstance(payload, dict) else payload
+            if not isinstance(authors, list):
+                result["failed"] += 1
+                continue
+            urls = _store_authors(node, authors, now)
+            result["authors"] += len(urls)
+            if page == 1:
+                state.etag = response.headers.get("ETag", "")
+                state.last_modified = response.headers.get("Last-Modified", "")
+
+            new_urls = urls - seen[node_id]
+            seen[node_id] |= urls
+            # a short page is the last one, and a node that ignores the paging sends the same authors again
+            if len(authors) == size and new_urls:
+                next_pending[node_id] = node
+            else:
+                _finish(node, state, now)
+
+        pending = next_pending
+        page += 1
+
+    # the nodes with more pages than REMOTE_AUTHOR_DIRECTORY_MAX_PAGES didn't finish either
+    for node_id in pending:
+        states[node_id].etag = states[node_id].last_modified = ""
+
+    for state in states.values():
+        if state.last_checked_at is not None:
+            state.save()
+    return result
+
+
+def _finish(node, state, now):
+    """
+    The node's whole list was read: the authors missing from it are gone
+    """
+    RemoteAuthor.objects.filter(node=node, seen_at__lt=now).delete()
+    state.last_synced_at = now
+
+
+def get_unsynced_node_count():
+    """
+    How many active nodes never had their authors read, the directory misses them
+    """
+    return Node.objects.filter(is_active=True).exclude(author_sync__last_synced_at__isnull=False).count()
@@ -0,0 +1,138 @@
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from django.conf import settings
+from PIL import Image as PILImage, ImageOps
+import io
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Resized/re-encoded variants of post images (?w=320&fmt=webp on get_image).
+# Variants are rendered once by a small pool of worker threads, so Pillow work never runs on the request thread
+# and concurrent requests for the same variant share one render. They are kept as files in IMAGE_VARIANT_CACHE_DIR,
+# the least recently used ones are removed once the cache is over IMAGE_VARIANT_CACHE_BYTES.
+
+VARIANT_FORMATS = {
+    "webp": ("WEBP", "image/webp"),
+    "jpeg": ("JPEG", "image/jpeg"),
+    "jpg": ("JPEG", "image/jpeg"),
+    "png": ("PNG", "image/png"),
+}
+# the same format under another name, its variants are the ones of the format
+FORMAT_ALIASES = {"jpg": "jpeg"}
+
+_variant_executor = ThreadPoolExecutor(max_workers=settings.IMAGE_VARIANT_WORKERS, thread_name_prefix="image-variants")
+# variant path -> future of the render in progress
+_pending = {}
+_pending_lock = threading.RLock()
+_evict_lock = threading.Lock()
+
+
+def get_variant_width(width):
+    """
+    Snap a requested width up to one of IMAGE_VARIANT_WIDTHS, so only a few variants exist per image
+    """
+    for allowed in sorted(settings.IMAGE_VARIANT_WIDTHS):
+        if width <= allowed:
+            return allowed
+    return max(settings.IMAGE_VARIANT_WIDTHS)
+
+
+def get_variant_name(image_hash, width, fmt):
+    return f"{image_hash}-{width or 'full'}.{FORMAT_ALIASES.get(fmt, fmt)}"
+
+
+def _render_variant(data, width, fmt, path):
+    with PILImage.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        if width:
+            # keeps the aspect ratio and never scales up
+            image.thumbnail((width, image.height))
+        pil_format = VARIANT_FORMATS[fmt][0]
+        if pil_format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+
+        # write to a temporary file first so a half written variant is never served
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            image.save(tmp_path, format=pil_format)
+            os.replace(tmp_path, path)
+        finally:
+            # still there if the save failed
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+    _evict_variants()
+    return path
+
+
+def _evict_variants():
+    """
+    Remove the least recently used variants until the cache fits in IMAGE_VARIANT_CACHE_BYTES
+    """
+    with _evict_lock:
+        entries = []
+        for entry in os.scandir(settings.IMAGE_VARIANT_CACHE_DIR):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= settings.IMAGE_VARIANT_CACHE_BYTES:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def _open_cached(path):
+    try:
+        # the modification time is the last use, for the LRU eviction
+        os.utime(path)
+        return open(path, "rb")
+    except FileNotFoundError:
+        return None
+
+
+def get_image_variant(image_hash, width, fmt, load_image):
+    """
+    Get an open file of the variant of an image, rendering it first if it isn't cached.
+    load_image is only called on a miss and returns the original bytes, it runs on the calling thread so the
+    workers never touch the database.
+    Returns None if the variant can't be rendered (not an image Pillow can read, or it took too long)
+    """
+    os.makedirs(settings.IMAGE_VARIANT_CACHE_DIR, exist_ok=True)
+    path = os.path.join(settings.IMAGE_VARIANT_CACHE_DIR, get_variant_name(image_hash, width, fmt))
+
+    file = _open_cached(path)
+    if file is not None:
+        return file
+
+    with _pending_lock:
+        future = _pending.get(path)
+    if future is None:
+        data = load_image()
+        with _pending_lock:
+            future = _pending.get(path)
+            if future is None:
+                future = _variant_executor.submit(_render_variant, data, width, fmt, path)
+                _pending[path] = future
+                future.add_done_callback(lambda done: _forget_pending(path, done))
+
+    try:
+        future.result(timeout=settings.IMAGE_VARIANT_TIMEOUT)
+    except TimeoutError:
+        return None
+    except Exception as e:
+        logger.warning("image variant error: %s", e)
+        return None
+    return _open_cached(path)
+
+
+def _forget_pending(path, future):
+    with _pending_lock:
+        if _pending.get(path) is future:
+            del _pending[path]
@@ -0,0 +1,105 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+# Logging of the api (configured by LOGGING in the settings). Every module logs to logging.getLogger(__name__):
+#   - records are formatted in the calling thread and put on a queue, a background thread writes them to stdout,
+#     so a request never waits on the stream
+#   - they are written as one JSON object per line, with the extra fields of the record, long values are truncated
+#   - the per-item debug events (one per post, per follower...) are logged with extra=SAMPLED and only 1 in
+#     LOG_SAMPLE_EVERY of each is kept
+
+SAMPLED = {"sampled": True}
+
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "sampled", "taskName"}
+
+
+def truncate(value, max_length):
+    """
+    Shorten a long value (e.g. a post with a base64 image) to max_length characters
+    """
+    value = value if isinstance(value, str) else str(value)
+    if len(value) <= max_length:
+        return value
+    return f"{value[:max_length]}... ({len(value)} characters)"
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    Format a record as a JSON line
+    """
+    def __init__(self, max_length=1000, **kwargs):
+        super().__init__(**kwargs)
+        self.max_length = max_length
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": truncate(record.getMessage(), self.max_length),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value if isinstance(value, (int, float, bool)) or value is None else truncate(value, self.max_length)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep 1 in every `every` of each sampled event, the kept ones say how many they stand for
+    """
+    def __init__(self, every=100):
+        super().__init__()
+        self.every = max(int(every), 1)
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if not getattr(record, "sampled", False):
+            return True
+        key = (record.name, record.msg)
+        with self._lock:
+            count = self._counts.get(key, 0)
+            self._counts[key] = count + 1
+        if count % self.every:
+            return False
+        record.sample_rate = self.every
+        return True
+
+
+class QueueLogHandler(QueueHandler):
+    """
+    Queue the records for a background thread that writes them to the stream
+    """
+    def __init__(self, stream=None, sample_every=100):
+        super().__init__(queue.SimpleQueue())
+        self.stream = stream
+        self.addFilter(SamplingFilter(sample_every))
+        self._listener_pid = None
+        self._listener_lock = threading.Lock()
+
+    def _start_listener(self):
+        if self._listener_pid == os.getpid():
+            return
+        with self._listener_lock:
+            if self._listener_pid == os.getpid():
+                return
+            # a forked worker doesn't get the listener thread of its parent, it starts its own
+            self.queue = queue.SimpleQueue()
+            listener = QueueListener(self.queue, logging.StreamHandler(self.stream or sys.stdout))
+            listener.start()
+            # whatever is still queued is written before the process exits
+            atexit.register(listener.stop)
+            self._listener_pid = os.getpid()
+
+    def enqueue(self, record):
+        self._start_listener()
+        super().enqueue(record)
@@ -0,0 +1,57 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from api.benchmark import run_federation_benchmark
+from api.stubnode import PAGINATIONS
+
+
+def number_list(value, cast):
+    return [cast(item) for item in value.split(",") if item.strip()]
+
+
+class Command(BaseCommand):
+    help = "Measure the mirror sync, feed, remote author directory and listing and inbox delivery against stub peers, by number of remote followees and share of slow peers"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--followees", default="10,50,100", help="comma separated numbers of remote authors followed")
+        parser.add_argument("--slow-fractions", default="0,0.25,0.5", help="comma separated shares of the peers that are slow")
+        parser.add_argument("--peers", type=int, default=4)
+        parser.add_argument("--fast-latency", default="lognormal:20,0.3")
+        parser.add_argument("--slow-latency", default="lognormal:1000,0.5")
+        parser.add_argument("--error-rate", type=float, default=0.0)
+        parser.add_argument("--posts-per-author", type=int, default=20)
+        parser.add_argument("--content-bytes", type=int, default=500)
+        parser.add_argument("--pagination", choices=PAGINATIONS, default="paged")
+        parser.add_argument("--feed-requests", type=int, default=10, help="feed requests timed per scenario")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", default=None, help="write the results as JSON to this file")
+
+    def handle(self, *args, **options):
+        try:
+            followees = number_list(options["followees"], int)
+            slow_fractions = number_list(options["slow_fractions"], float)
+        except ValueError as e:
+            raise CommandError(str(e))
+        if not followees or not slow_fractions or options["peers"] < 1:
+            raise CommandError("Give at least one number of followees, one slow fraction and one peer")
+
+        try:
+            results = run_federation_benchmark(
+                followees=followees, slow_fractions=slow_fractions, peers=options["peers"], fast_latency=options["fast_latency"],
+                slow_latency=options["slow_latency"], error_rate=options["error_rate"], posts_per_author=options["posts_per_author"],
+                content_bytes=options["content_bytes"], pagination=options["pagination"], feed_requests=options["feed_requests"],
+                seed=options["seed"], log=self.stdout.write,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(f"{'followees':>10}{'slow':>6}{'sync s':>9}{'synced':>8}{'feed p50':>10}{'feed p95':>10}{'dir s':>8}{'authors ms':>12}{'deliver s':>11}{'sent':>6}")
+        for row in results["scenarios"]:
+            feed = row["feed_ms"] or {"p50": 0, "p95": 0}
+            self.stdout.write(
+                f"{row['followees']:>10}{row['slow_fraction']:>6}{row['sync_seconds']:>9}{row['synced']:>8}{feed['p50']:>10}{feed['p95']:>10}{row['directory_seconds']:>8}"
+                f"{row['remote_authors_ms']:>12}{row['delivery_seconds']:>11}{row['delivered']:>6}"
+            )
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                json.dump(results, file, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
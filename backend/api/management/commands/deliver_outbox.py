@@ -0,0 +1,20 @@
+import time
+from django.core.management.base import BaseCommand
+from api.outbox import deliver_outbox
+
+
+class Command(BaseCommand):
+    help = "Deliver the queued activities in the outbox to the remote inboxes, retrying failed deliveries with backoff"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--loop", action="store_true", help="keep delivering until interrupted")
+        parser.add_argument("--interval", type=float, default=5, help="seconds to sleep between rounds when looping")
+        parser.add_argument("--batch-size", type=int, default=None, help="maximum deliveries per round")
+
+    def handle(self, *args, **options):
+        while True:
+            attempted = deliver_outbox(batch_size=options["batch_size"])
+            self.stdout.write(f"Attempted {attempted} deliveries")
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,37 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from api.benchmark import ENDPOINTS, run_load_test
+
+
+class Command(BaseCommand):
+    help = "Send the hot GETs concurrently through the WSGI application against the seeded dataset and report latency, throughput and SQL queries"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--duration", type=float, default=30, help="seconds to run for")
+        parser.add_argument("--concurrency", type=int, default=8, help="number of threads sending requests")
+        parser.add_argument("--requests", type=int, default=None, help="stop after this many requests")
+        parser.add_argument("--endpoint", action="append", choices=list(ENDPOINTS), help="only these endpoints (repeatable), default all")
+        parser.add_argument("--page-size", type=int, default=None, help="page the lists with the cursor pagination instead of requesting them whole")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", default=None, help="write the results as JSON to this file")
+
+    def handle(self, *args, **options):
+        try:
+            results = run_load_test(
+                duration=options["duration"], concurrency=options["concurrency"], max_requests=options["requests"],
+                endpoints=options["endpoint"], page_size=options["page_size"], seed=options["seed"], log=self.stdout.write,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(f"{'endpoint':<22}{'requests':>9}{'errors':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}")
+        for name, summary in [*results["endpoints"].items(), ("total", results["total"])]:
+            latency = summary["latency_ms"]
+            self.stdout.write(
+                f"{name:<22}{summary['requests']:>9}{summary['errors']:>8}{summary['throughput'] or 0:>9}"
+                f"{latency['p50'] or 0:>9}{latency['p95'] or 0:>9}{latency['p99'] or 0:>9}{summary['queries']['mean'] or 0:>9}"
+            )
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                json.dump(results, file, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
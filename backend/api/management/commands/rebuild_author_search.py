@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from api.search import rebuild_author_search
+
+
+class Command(BaseCommand):
+    help = "Index the local authors and the remote author directory for the author search again"
+
+    def handle(self, *args, **options):
+        count = rebuild_author_search()
+        self.stdout.write(f"Indexed {count} authors")
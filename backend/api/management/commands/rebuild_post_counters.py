@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from api.counters import rebuild_post_counters
+
+
+class Command(BaseCommand):
+    help = "Recount the comments and likes of the local posts whose counters drifted"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="posts updated per statement")
+
+    def handle(self, *args, **options):
+        fixed = rebuild_post_counters(batch_size=options["batch_size"])
+        self.stdout.write(f"Fixed the counters of {fixed} posts")
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from api.models import Author
+from api.timeline import rebuild_timeline
+
+
+class Command(BaseCommand):
+    help = "Rebuild the materialized home feed of every local author from the follow graph and posts"
+
+    def handle(self, *args, **options):
+        authors = Author.objects.filter(is_remote=False)
+        for author in authors.iterator():
+            rebuild_timeline(author)
+        self.stdout.write(f"Rebuilt {authors.count()} timelines")
@@ -0,0 +1,22 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from api.reconcile import reconcile_follow_state
+
+
+class Command(BaseCommand):
+    help = "Check the pending remote follow requests and the remote followers against their nodes and store the results"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--loop", action="store_true", help="keep checking until interrupted")
+        parser.add_argument("--interval", type=float, default=None, help="seconds to sleep between rounds when looping (default FOLLOW_RECONCILE_INTERVAL / 4)")
+        parser.add_argument("--batch-size", type=int, default=None, help="maximum checks per round")
+
+    def handle(self, *args, **options):
+        interval = options["interval"] if options["interval"] is not None else settings.FOLLOW_RECONCILE_INTERVAL / 4
+        while True:
+            result = reconcile_follow_state(batch_size=options["batch_size"])
+            self.stdout.write(f"Checked {result['checked']} relationships, {result['accepted']} follow requests accepted, {result['removed']} followers removed")
+            if not options["loop"]:
+                break
+            time.sleep(interval)
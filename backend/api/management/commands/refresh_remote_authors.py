@@ -0,0 +1,21 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from api.directory import refresh_remote_authors
+
+
+class Command(BaseCommand):
+    help = "Refresh the directory of the other nodes' authors that /api/remote-authors/ serves"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--loop", action="store_true", help="keep refreshing until interrupted")
+        parser.add_argument("--interval", type=float, default=None, help="seconds to sleep between rounds when looping (default REMOTE_AUTHOR_DIRECTORY_INTERVAL / 4)")
+
+    def handle(self, *args, **options):
+        interval = options["interval"] if options["interval"] is not None else settings.REMOTE_AUTHOR_DIRECTORY_INTERVAL / 4
+        while True:
+            result = refresh_remote_authors()
+            self.stdout.write(f"Checked {result['checked']} nodes, {result['unchanged']} unchanged, {result['authors']} authors refreshed, {result['failed']} failed")
+            if not options["loop"]:
+                break
+            time.sleep(interval)
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from api.benchmark import clear_dataset, seed_dataset
+
+
+class Command(BaseCommand):
+    help = "Seed a synthetic social graph (authors, follows, posts, comments, likes, inbox items) for load testing"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--authors", type=int, default=1000)
+        parser.add_argument("--posts-per-author", type=int, default=5, help="average posts per author")
+        parser.add_argument("--following", type=int, default=20, help="average number of authors each author follows")
+        parser.add_argument("--alpha", type=float, default=1.1, help="power law exponent of the follower counts")
+        parser.add_argument("--friend-ratio", type=float, default=0.3, help="share of the follows that are followed back")
+        parser.add_argument("--image-ratio", type=float, default=0.1, help="share of the posts that are image posts")
+        parser.add_argument("--comments-per-post", type=int, default=2, help="average comments per post")
+        parser.add_argument("--likes-per-post", type=int, default=4, help="average likes per post")
+        parser.add_argument("--inbox-per-author", type=int, default=20, help="average inbox items per author")
+        parser.add_argument("--host", default="http://localhost/", help="host of the seeded authors")
+        parser.add_argument("--seed", type=int, default=0, help="random seed, the same seed makes the same graph")
+        parser.add_argument("--clear", action="store_true", help="remove the previously seeded dataset first")
+
+    def handle(self, *args, **options):
+        if options["clear"]:
+            self.stdout.write(f"Removed {clear_dataset()} seeded authors")
+        counts = seed_dataset(
+            authors=options["authors"], posts_per_author=options["posts_per_author"], average_following=options["following"],
+            alpha=options["alpha"], friend_ratio=options["friend_ratio"], image_ratio=options["image_ratio"],
+            comments_per_post=options["comments_per_post"], likes_per_post=options["likes_per_post"],
+            inbox_per_author=options["inbox_per_author"], host=options["host"], seed=options["seed"], log=self.stdout.write,
+        )
+        self.stdout.write("Seeded " + ", ".join(f"{count} {name}" for name, count in counts.items()))
@@ -0,0 +1,46 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from api.stubnode import PAGINATIONS, STUB_PASSWORD, STUB_USERNAME, StubNode
+
+
+class Command(BaseCommand):
+    help = "Run a stub federation node with generated authors and posts, to benchmark against slow or failing peers"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--team-name", default="stub node", help="team name of the Node it registers as")
+        parser.add_argument("--bind", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8100)
+        parser.add_argument("--authors", type=int, default=10)
+        parser.add_argument("--posts-per-author", type=int, default=20)
+        parser.add_argument("--latency", default="fixed:0", help="fixed:MS, uniform:MIN_MS,MAX_MS, lognormal:MEDIAN_MS,SIGMA or exp:MEAN_MS")
+        parser.add_argument("--error-rate", type=float, default=0.0, help="share of the requests answered with a 500")
+        parser.add_argument("--drop-rate", type=float, default=0.0, help="share of the requests whose connection is closed without an answer")
+        parser.add_argument("--content-bytes", type=int, default=500, help="size of the content of each post")
+        parser.add_argument("--image-bytes", type=int, default=20000, help="size of the image served for the image posts")
+        parser.add_argument("--pagination", choices=PAGINATIONS, default="paged")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--register", action="store_true", help="register it as a Node of this server")
+
+    def handle(self, *args, **options):
+        try:
+            stub = StubNode(
+                team_name=options["team_name"], authors=options["authors"], posts_per_author=options["posts_per_author"],
+                latency=options["latency"], error_rate=options["error_rate"], drop_rate=options["drop_rate"],
+                content_bytes=options["content_bytes"], image_bytes=options["image_bytes"], pagination=options["pagination"],
+                bind=options["bind"], port=options["port"], seed=options["seed"],
+            ).start()
+        except (ValueError, OSError) as e:
+            raise CommandError(str(e))
+
+        if options["register"]:
+            node = stub.register()
+            self.stdout.write(f"Registered as node {node.id} ({node.team_name})")
+        self.stdout.write(f"Serving {len(stub.authors)} authors at {stub.api_url}, basic auth {STUB_USERNAME}:{STUB_PASSWORD}")
+        try:
+            while True:
+                time.sleep(60)
+                self.stdout.write(", ".join(f"{count} {kind}" for kind, count in stub.stats.items()))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stub.stop()
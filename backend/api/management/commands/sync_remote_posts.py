@@ -0,0 +1,22 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from api.mirror import sync_remote_posts
+
+
+class Command(BaseCommand):
+    help = "Mirror the posts of the remote authors that local authors follow from their nodes"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--loop", action="store_true", help="keep syncing until interrupted")
+        parser.add_argument("--interval", type=float, default=None, help="seconds to sleep between rounds when looping (default REMOTE_POST_SYNC_INTERVAL / 4)")
+        parser.add_argument("--batch-size", type=int, default=None, help="maximum authors per round")
+
+    def handle(self, *args, **options):
+        interval = options["interval"] if options["interval"] is not None else settings.REMOTE_POST_SYNC_INTERVAL / 4
+        while True:
+            result = sync_remote_posts(batch_size=options["batch_size"])
+            self.stdout.write(f"Checked {result['checked']} remote authors, {result['unchanged']} unchanged, {result['posts']} posts synced, {result['failed']} failed")
+            if not options["loop"]:
+                break
+            time.sleep(interval)
@@ -1,5 +1,11 @@
 from django.contrib.auth.base_user import BaseUserManager
+from django.db import models
+from django.db.models.deletion import ProtectedError
+from django.db.models.functions import Substr
 from django.utils.translation import gettext_lazy as _
+import base64
+import binascii
+import hashlib
 
 
 # Adapted from: https://github.com/veryacademy/YT-Django-Theory-Create-Custom-User-Models-Admin-Testing/blob/master/users/models.py
@@ -33,3 +39,45 @@ class CustomAuthorManager(BaseUserManager):
         user.is_admin = True
         user.save()
         return user
+
+
+class ImageManager(models.Manager):
+    def store_base64(self, content, content_type):
+        """
+        Store base64 image content (with or without its data:...;base64, prefix) once, keyed by the sha256 of its bytes.
+        Returns the Image, or None if the content is not base64 (an image url sent back by a client)
+        """
+        if content.startswith("data:") and ";base64," in content:
+            content = content.split(";base64,", 1)[1]
+        try:
+            data = base64.b64decode("".join(content.split()), validate=True)
+        except (binascii.Error, ValueError):
+            return None
+        return self.store(data, content_type)
+
+    def store(self, data, content_type):
+        """
+        Store image bytes once, keyed by their sha256. Returns the Image
+        """
+        image, created = self.get_or_create(
+            hash=hashlib.sha256(data).hexdigest(),
+            defaults={"content_type": content_type.split(";")[0], "size": len(data), "data": data},
+        )
+        return image
+
+    def read_range(self, hash, start, end):
+        """
+        Bytes start to end (inclusive) of an image, sliced by the database so the rest of the image isn't sent
+        """
+        part = self.filter(hash=hash).values_list(Substr('data', start + 1, end - start + 1, output_field=models.BinaryField()), flat=True).get()
+        return bytes(part)
+
+    def delete_unused(self, hashes):
+        """
+        Delete the images of hashes that no post uses anymore
+        """
+        try:
+            self.filter(hash__in=hashes, posts__isnull=True).delete()
+        except ProtectedError:
+            # a post started using the image again in the meantime
+            pass
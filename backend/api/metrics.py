@@ -0,0 +1,310 @@
+import contextvars
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+
+# Request metrics: every request's latency by url name, the SQL it ran and its calls to other nodes.
+#   - each request gets a RequestMetrics in a context variable, the SQL is counted by an execute wrapper installed on
+#     every database connection (see api/signals.py) and the node calls by the federation clients (record_node_call)
+#   - the totals of a request are sent back in its Server-Timing header
+#   - each process adds them to its histograms, and a background thread writes them to the process's own file in
+#     METRICS_DIR every METRICS_FLUSH_INTERVAL seconds when they changed, so requests never wait on the disk
+#   - /api/metrics adds up the files of all the workers in the Prometheus text format, and removes the files of the
+#     processes that are gone
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# name: (help, label names, buckets)
+HISTOGRAMS = {
+    "snackoverflow_request_duration_seconds": ("Time spent answering a request", ("view", "method"), LATENCY_BUCKETS),
+    "snackoverflow_request_queries": ("SQL queries run by a request", ("view",), QUERY_BUCKETS),
+    "snackoverflow_request_query_duration_seconds": ("Time a request spent running SQL", ("view",), LATENCY_BUCKETS),
+    "snackoverflow_node_request_duration_seconds": ("Time spent on a call to another node", ("node", "status"), LATENCY_BUCKETS),
+}
+
+# name -> {label values: [bucket counts, sum, count]}, the totals of this process since it started
+_values = {}
+_values_lock = threading.Lock()
+# bumped by every observation, the flusher only writes when it moved since the last write
+_version = 0
+_flushed_version = None
+# the file of this process in METRICS_DIR, named when first written so forked workers each get their own
+_store = {"pid": None, "name": None}
+# the pid of the process the flusher thread was started in, a forked worker starts its own
+_flusher = {"pid": None}
+_flusher_lock = threading.Lock()
+
+_current = contextvars.ContextVar("request_metrics", default=None)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.node_calls = 0
+        self.node_seconds = 0.0
+        # node calls can come from the fan-out threads at the same time
+        self._lock = threading.Lock()
+
+    def add_query(self, seconds):
+        with self._lock:
+            self.queries += 1
+            self.query_seconds += seconds
+
+    def add_node_call(self, seconds):
+        with self._lock:
+            self.node_calls += 1
+            self.node_seconds += seconds
+
+    def server_timing(self, elapsed):
+        return (
+            f'app;dur={elapsed * 1000:.1f}, '
+            f'db;dur={self.query_seconds * 1000:.1f};desc="{self.queries} queries", '
+            f'nodes;dur={self.node_seconds * 1000:.1f};desc="{self.node_calls} calls"'
+        )
+
+
+def observe(name, value, *label_values):
+    """
+    Add a value to a histogram of this process
+    """
+    global _version
+    buckets = HISTOGRAMS[name][2]
+    with _values_lock:
+        _version += 1
+        series = _values.setdefault(name, {}).get(label_values)
+        if series is None:
+            series = _values[name][label_values] = [[0] * len(buckets), 0.0, 0]
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                series[0][i] += 1
+                break
+        series[1] += value
+        series[2] += 1
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Execute wrapper (see connection.execute_wrapper) that counts the SQL of the current request
+    """
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.add_query(time.perf_counter() - start)
+
+
+def install_query_wrapper(connection):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def record_node_call(node, seconds, status_code=None):
+    """
+    Record a call to a node, status_code is None if it failed before the node answered
+    """
+    observe("snackoverflow_node_request_duration_seconds", seconds, node.team_name, str(status_code) if status_code is not None else "error")
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.add_node_call(seconds)
+
+
+def _start_request():
+    metrics = RequestMetrics()
+    return metrics, _current.set(metrics)
+
+
+def _finish_request(request, response, metrics):
+    elapsed = time.perf_counter() - metrics.started
+    match = getattr(request, "resolver_match", None)
+    view = match.view_name if match is not None else "unmatched"
+    observe("snackoverflow_request_duration_seconds", elapsed, view, request.method)
+    observe("snackoverflow_request_queries", metrics.queries, view)
+    observe("snackoverflow_request_query_duration_seconds", metrics.query_seconds, view)
+    response["Server-Timing"] = metrics.server_timing(elapsed)
+    start_flusher()
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    """
+    Measure every request, it has to come first in MIDDLEWARE to see the whole request
+    """
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            metrics, token = _start_request()
+            try:
+                response = await get_response(request)
+            finally:
+                _current.reset(token)
+            _finish_request(request, response, metrics)
+            return response
+    else:
+        def middleware(request):
+            metrics, token = _start_request()
+            try:
+                response = get_response(request)
+            finally:
+                _current.reset(token)
+            _finish_request(request, response, metrics)
+            return response
+    return middleware
+
+
+def _get_pid(file_name):
+    """
+    The pid of the process that wrote a file of METRICS_DIR ("{pid}-..."), None if it isn't one of ours
+    """
+    pid = file_name.split("-", 1)[0]
+    return int(pid) if pid.isdigit() else None
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # alive, but someone else's
+        return True
+    return True
+
+
+def _get_store_path():
+    if _store["pid"] != os.getpid():
+        pid = os.getpid()
+        _store["pid"] = pid
+        _store["name"] = f"{pid}-{time.time_ns()}.json"
+        # files with our pid were left by a process that is gone and had the same pid
+        if os.path.isdir(settings.METRICS_DIR):
+            for file_name in os.listdir(settings.METRICS_DIR):
+                if _get_pid(file_name) == pid:
+                    _remove(file_name)
+    return os.path.join(settings.METRICS_DIR, _store["name"])
+
+
+def _remove(file_name):
+    try:
+        os.unlink(os.path.join(settings.METRICS_DIR, file_name))
+    except FileNotFoundError:
+        pass
+
+
+def flush_metrics(force=False):
+    """
+    Write this process's histograms to its file, if they changed since the last write unless forced
+    """
+    global _flushed_version
+    with _values_lock:
+        if not force and _version == _flushed_version:
+            return
+        version = _version
+        data = {name: [[list(labels), list(counts), total, count] for labels, (counts, total, count) in values.items()] for name, values in _values.items()}
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    path = _get_store_path()
+    # written next to the final file and moved over it, so readers never see half a file
+    fd, tmp_path = tempfile.mkstemp(dir=settings.METRICS_DIR, prefix=f"{os.getpid()}-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as file:
+            json.dump(data, file)
+        os.replace(tmp_path, path)
+    finally:
+        # still there if the write failed
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+    _flushed_version = version
+
+
+def _flush_loop():
+    while True:
+        time.sleep(settings.METRICS_FLUSH_INTERVAL)
+        try:
+            flush_metrics()
+        except Exception:
+            logger.warning("Could not write the metrics to %s", settings.METRICS_DIR, exc_info=True)
+
+
+def start_flusher():
+    """
+    Start this process's flusher thread, if it isn't running yet
+    """
+    if _flusher["pid"] == os.getpid():
+        return
+    with _flusher_lock:
+        if _flusher["pid"] != os.getpid():
+            _flusher["pid"] = os.getpid()
+            threading.Thread(target=_flush_loop, daemon=True, name="metrics flusher").start()
+
+
+def _load_all():
+    merged = {}
+    for file_name in os.listdir(settings.METRICS_DIR):
+        pid = _get_pid(file_name)
+        if pid is not None and pid != os.getpid() and not _is_alive(pid):
+            # a worker that exited (or a write it didn't finish), its totals go with it
+            _remove(file_name)
+            continue
+        if not file_name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(settings.METRICS_DIR, file_name)) as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            continue
+        for name, rows in data.items():
+            if name not in HISTOGRAMS:
+                continue
+            for labels, counts, total, count in rows:
+                series = merged.setdefault(name, {}).get(tuple(labels))
+                if series is None:
+                    merged[name][tuple(labels)] = [list(counts), total, count]
+                else:
+                    series[0] = [a + b for a, b in zip(series[0], counts)]
+                    series[1] += total
+                    series[2] += count
+    return merged
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, le=None):
+    labels = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if le is not None:
+        labels.append(f'le="{le}"')
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+def render_metrics():
+    """
+    Get the histograms of all the workers in the Prometheus text format
+    """
+    flush_metrics(force=True)
+    merged = _load_all()
+    lines = []
+    for name, (help_text, label_names, buckets) in HISTOGRAMS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        for label_values, (counts, total, count) in sorted(merged.get(name, {}).items()):
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_format_labels(label_names, label_values, f'{bound:g}')} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(label_names, label_values, '+Inf')} {count}")
+            lines.append(f"{name}_sum{_format_labels(label_names, label_values)} {total}")
+            lines.append(f"{name}_count{_format_labels(label_names, label_values)} {count}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.9 on 2026-10-18 17:57
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_outbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Timeline',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('published', models.DateTimeField()),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline', to=settings.AUTH_USER_MODEL)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='api.post')),
+            ],
+            options={
+                'ordering': ['-published'],
+                'indexes': [models.Index(fields=['owner', '-published'], name='timeline_owner_published_idx')],
+                'unique_together': {('owner', 'post')},
+            },
+        ),
+    ]
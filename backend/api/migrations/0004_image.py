@@ -0,0 +1,54 @@
+# Generated by Django 4.2.9 on 2026-10-18 18:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+import base64
+import binascii
+import hashlib
+
+
+def move_image_content(apps, schema_editor):
+    """
+    Move the base64 content of the existing image posts into the Image table
+    """
+    Image = apps.get_model('api', 'Image')
+    Post = apps.get_model('api', 'Post')
+    for post in Post.objects.filter(contentType__startswith="image/").exclude(content="").exclude(content=None).iterator():
+        content = post.content
+        if content.startswith("data:") and ";base64," in content:
+            content = content.split(";base64,", 1)[1]
+        try:
+            data = base64.b64decode(content)
+        except (binascii.Error, ValueError):
+            continue
+        image, created = Image.objects.get_or_create(
+            hash=hashlib.sha256(data).hexdigest(),
+            defaults={"content_type": post.contentType.split(";")[0], "size": len(data), "data": data},
+        )
+        Post.objects.filter(id=post.id).update(image=image, content="")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_timeline'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Image',
+            fields=[
+                ('hash', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('content_type', models.CharField(max_length=50)),
+                ('size', models.IntegerField()),
+                ('data', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='image',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='posts', to='api.image'),
+        ),
+        migrations.RunPython(move_image_content, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.9 on 2026-10-18 18:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='node',
+            name='breaker_opened_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='node',
+            name='breaker_state',
+            field=models.CharField(choices=[('CLOSED', 'CLOSED'), ('OPEN', 'OPEN'), ('HALF_OPEN', 'HALF_OPEN')], default='CLOSED', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='node',
+            name='consecutive_failures',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='node',
+            name='health_checked_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='node',
+            name='last_error',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='node',
+            name='recent_failures',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='node',
+            name='recent_requests',
+            field=models.IntegerField(default=0),
+        ),
+    ]
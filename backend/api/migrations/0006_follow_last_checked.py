@@ -0,0 +1,23 @@
+# Generated by Django 4.2.9 on 2026-10-18 18:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_node_breaker'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='follower',
+            name='last_checked_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='followrequest',
+            name='last_checked_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
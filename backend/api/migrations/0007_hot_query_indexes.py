@@ -0,0 +1,37 @@
+# Generated by Django 4.2.9 on 2026-10-18 18:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_follow_last_checked'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='author',
+            index=models.Index(condition=models.Q(('is_remote', False), ('is_staff', False)), fields=['created_at', 'id'], name='author_local_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', '-published', '-id'], name='comment_post_published_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inbox',
+            index=models.Index(fields=['author', '-published'], name='inbox_author_published_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='like',
+            index=models.Index(fields=['author', 'post'], name='like_author_post_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['visibility', '-published', '-id'], name='post_visibility_published_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['author', 'visibility', '-published', '-id'], name='post_author_vis_published_idx'),
+        ),
+    ]
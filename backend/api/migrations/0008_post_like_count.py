@@ -0,0 +1,37 @@
+# Generated by Django 4.2.9 on 2026-10-18 18:33
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_comments_and_likes(apps, schema_editor):
+    """
+    Fill the counters of the existing local posts, only the comments sent through the inbox were counted before
+    """
+    Post = apps.get_model('api', 'Post')
+    Comment = apps.get_model('api', 'Comment')
+    Like = apps.get_model('api', 'Like')
+
+    def counted(model):
+        return Coalesce(Subquery(
+            model.objects.filter(post=OuterRef('pk')).order_by().values('post').annotate(total=Count('pk')).values('total')
+        ), 0)
+
+    Post.objects.filter(author__is_remote=False).update(count=counted(Comment), likeCount=counted(Like))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='likeCount',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(count_comments_and_likes, migrations.RunPython.noop),
+    ]
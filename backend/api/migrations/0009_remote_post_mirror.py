@@ -0,0 +1,43 @@
+# Generated by Django 4.2.9 on 2026-10-18 18:44
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_post_like_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RemotePostSync',
+            fields=[
+                ('author', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='post_sync', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('etag', models.CharField(blank=True, default='', max_length=200)),
+                ('last_modified', models.CharField(blank=True, default='', max_length=100)),
+                ('last_seen_published', models.DateTimeField(blank=True, null=True)),
+                ('last_checked_at', models.DateTimeField(blank=True, null=True)),
+                ('last_synced_at', models.DateTimeField(blank=True, null=True)),
+                ('last_status_code', models.IntegerField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RemotePost',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.URLField(max_length=500, unique=True)),
+                ('visibility', models.CharField(max_length=50)),
+                ('published', models.DateTimeField()),
+                ('data', models.JSONField()),
+                ('synced_at', models.DateTimeField(auto_now=True)),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='remote_posts', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-published'],
+                'indexes': [models.Index(fields=['author', '-published'], name='remote_post_author_pub_idx')],
+            },
+        ),
+    ]
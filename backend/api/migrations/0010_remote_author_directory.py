@@ -0,0 +1,41 @@
+# Generated by Django 4.2.9 on 2026-10-18 19:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_remote_post_mirror'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RemoteAuthorSync',
+            fields=[
+                ('node', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='author_sync', serialize=False, to='api.node')),
+                ('etag', models.CharField(blank=True, default='', max_length=200)),
+                ('last_modified', models.CharField(blank=True, default='', max_length=100)),
+                ('last_checked_at', models.DateTimeField(blank=True, null=True)),
+                ('last_synced_at', models.DateTimeField(blank=True, null=True)),
+                ('last_status_code', models.IntegerField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RemoteAuthor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.URLField(max_length=500, unique=True)),
+                ('host', models.URLField(max_length=500)),
+                ('display_name', models.CharField(blank=True, default='', max_length=200)),
+                ('data', models.JSONField()),
+                ('first_seen_at', models.DateTimeField(auto_now_add=True)),
+                ('seen_at', models.DateTimeField()),
+                ('node', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='remote_authors', to='api.node')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['first_seen_at', 'id'], name='remote_author_seen_idx')],
+            },
+        ),
+    ]
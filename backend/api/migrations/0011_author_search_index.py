@@ -0,0 +1,66 @@
+# Generated by Django 4.2.9 on 2026-10-18 19:08
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def index_existing_authors(apps, schema_editor):
+    """
+    Index the authors that exist already, later ones are indexed when they are saved
+    """
+    from api.search import TRIGRAM, WORD, get_github_username, get_search_terms
+    Author = apps.get_model('api', 'Author')
+    RemoteAuthor = apps.get_model('api', 'RemoteAuthor')
+    AuthorSearchEntry = apps.get_model('api', 'AuthorSearchEntry')
+    AuthorSearchTerm = apps.get_model('api', 'AuthorSearchTerm')
+
+    def index(field, objects, get_values):
+        for obj in objects:
+            display_name, github_username = get_values(obj)
+            words, trigrams = get_search_terms(display_name, github_username)
+            entry = AuthorSearchEntry.objects.create(**{field: obj}, display_name=display_name[:200], github_username=github_username[:100],
+                                                     trigram_count=len(trigrams))
+            AuthorSearchTerm.objects.bulk_create(
+                [AuthorSearchTerm(entry=entry, kind=WORD, term=term) for term in words]
+                + [AuthorSearchTerm(entry=entry, kind=TRIGRAM, term=term) for term in trigrams]
+            )
+
+    index('author', Author.objects.filter(is_remote=False, is_staff=False).iterator(),
+          lambda author: (author.display_name or "", get_github_username(author.github)))
+    index('remote_author', RemoteAuthor.objects.iterator(),
+          lambda author: (author.display_name or "", get_github_username(author.data.get('github'))))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_remote_author_directory'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthorSearchEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('display_name', models.CharField(blank=True, default='', max_length=200)),
+                ('github_username', models.CharField(blank=True, default='', max_length=100)),
+                ('trigram_count', models.IntegerField(default=0)),
+                ('author', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='search_entry', to=settings.AUTH_USER_MODEL)),
+                ('remote_author', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='search_entry', to='api.remoteauthor')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='AuthorSearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('w', 'word'), ('t', 'trigram')], max_length=1)),
+                ('term', models.CharField(max_length=100)),
+                ('entry', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='terms', to='api.authorsearchentry')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'term'], name='author_search_term_idx')],
+            },
+        ),
+        migrations.RunPython(index_existing_authors, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+import re
+from django.db import migrations
+
+
+def rewrite_mirrored_images(apps, schema_editor):
+    """
+    Point the images of the posts mirrored so far at the placeholder api url, like the sync now stores them
+    """
+    Node = apps.get_model('api', 'Node')
+    RemotePost = apps.get_model('api', 'RemotePost')
+    api_urls = sorted({url for url in Node.objects.values_list('api_url', flat=True) if url}, key=len, reverse=True)
+    if not api_urls:
+        return
+    pattern = re.compile(r"!\[image\]\((?:" + "|".join(map(re.escape, api_urls)) + ")")
+    changed = []
+    for post in RemotePost.objects.only('data').iterator():
+        if not isinstance(post.data, dict) or post.data.get('contentType') != 'text/markdown' or not post.data.get('content'):
+            continue
+        content = post.data['content']
+        rewritten = pattern.sub("![image](mirror:api/", content)
+        if rewritten != content:
+            post.data['content'] = rewritten
+            changed.append(post)
+    RemotePost.objects.bulk_update(changed, ['data'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_author_search_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(rewrite_mirrored_images, migrations.RunPython.noop),
+    ]
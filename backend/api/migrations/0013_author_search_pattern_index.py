@@ -0,0 +1,21 @@
+# Generated by Django 4.2.9 on 2026-10-18 19:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_remote_post_image_placeholder'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='authorsearchterm',
+            name='author_search_term_idx',
+        ),
+        migrations.AddIndex(
+            model_name='authorsearchterm',
+            index=models.Index(fields=['kind', 'term'], name='author_search_term_like_idx', opclasses=['varchar_pattern_ops', 'varchar_pattern_ops']),
+        ),
+    ]
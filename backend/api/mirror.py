@@ -0,0 +1,198 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import Author, Follower, RemotePost, RemotePostSync
+from .utils import get_request_remote_many, get_our_host, rewrite_image_urls
+
+# The posts of the remote authors that local authors follow are mirrored in the RemotePost table by a background
+# worker (manage.py sync_remote_posts), the feed and the remote profiles read them from there instead of asking the nodes.
+# Each round syncs the authors that are due, least recently checked first:
+#   - the first page of an author's posts is asked for with the ETag / Last-Modified of the last sync, so an
+#     unchanged author costs a 304
+#   - pages are read newest first and paging stops at the first page that reaches the newest post already mirrored
+#   - when the first page holds all of the author's posts, the mirrored posts missing from it were deleted on the node
+# The markdown images of a post are rewritten when it is stored, to MIRRORED_API_URL, which reads swap for our api url
+# (it depends on the host the request came in on) with a plain string replace.
+
+MIRRORED_API_URL = "mirror:api/"
+_MIRRORED_IMAGE = f"![image]({MIRRORED_API_URL}"
+
+
+def get_mirrored_authors():
+    """
+    The remote authors whose posts are mirrored: the ones followed by a local author
+    """
+    followed_ids = Follower.objects.filter(follower__is_remote=False).values('followed_user')
+    return Author.objects.filter(is_remote=True, id__in=followed_ids)
+
+
+def get_synced_author_ids(author_ids):
+    """
+    Get which of the authors have been mirrored at least once
+    """
+    if not author_ids:
+        return set()
+    return {str(author_id) for author_id in RemotePostSync.objects.filter(
+        author_id__in=author_ids, last_synced_at__isnull=False
+    ).values_list('author_id', flat=True)}
+
+
+def get_mirrored_posts(request, author_ids, visibility=None):
+    """
+    Get the mirrored posts of the authors (with the given visibility), newest first, as the node served them
+    with their image urls pointing at our api
+    """
+    posts = RemotePost.objects.filter(author_id__in=author_ids)
+    if visibility is not None:
+        posts = posts.filter(visibility=visibility)
+    image = f"![image]({get_our_host(request)}"
+    result = []
+    for post in posts.only('data').order_by('-published', '-id'):
+        data = post.data
+        content = data.get('content')
+        if isinstance(content, str) and _MIRRORED_IMAGE in content:
+            data['content'] = content.replace(_MIRRORED_IMAGE, image)
+        result.append(data)
+    return result
+
+
+def _get_published(post):
+    published = parse_datetime(post.get('published') or "")
+    if published is None:
+        return None
+    if timezone.is_naive(published):
+        published = timezone.make_aware(published, timezone.utc)
+    return published
+
+
+def _store_posts(author, state, posts):
+    """
+    Upsert a page of an author's posts into the mirror.
+    Returns True if the page reached the posts that were already mirrored
+    """
+    rows = {}
+    for post in posts:
+        if not isinstance(post, dict) or not post.get('id'):
+            continue
+        rows[post['id']] = RemotePost(
+            author=author, url=post['id'], visibility=(post.get('visibility') or "").upper(),
+            published=_get_published(post) or timezone.now(), data=rewrite_image_urls(dict(post), MIRRORED_API_URL),
+        )
+    if not rows:
+        return False
+
+    known = set(RemotePost.objects.filter(url__in=rows).values_list('url', flat=True))
+    reached = state.last_seen_published is not None and any(
+        url in known and row.published <= state.last_seen_published for url, row in rows.items()
+    )
+
+    RemotePost.objects.bulk_create(
+        list(rows.values()), update_conflicts=True, unique_fields=['url'],
+        update_fields=['author', 'visibility', 'published', 'data', 'synced_at'],
+    )
+    newest = max(row.published for row in rows.values())
+    if state.last_seen_published is None or newest > state.last_seen_published:
+        state.last_seen_published = newest
+    return reached
+
+
+def _pick_due(batch_size):
+    due_before = timezone.now() - timedelta(seconds=settings.REMOTE_POST_SYNC_INTERVAL)
+    authors = get_mirrored_authors().filter(
+        Q(post_sync__isnull=True) | Q(post_sync__last_checked_at__isnull=True) | Q(post_sync__last_checked_at__lt=due_before)
+    ).order_by(F('post_sync__last_checked_at').asc(nulls_first=True), 'id')
+    return list(authors[:batch_size])
+
+
+def sync_remote_posts(batch_size=None):
+    """
+    Sync one round of due remote authors' posts into the mirror.
+    Returns {"checked": ..., "unchanged": ..., "posts": ..., "failed": ...}
+    """
+    if batch_size is None:
+        batch_size = settings.REMOTE_POST_SYNC_BATCH_SIZE
+    size = settings.REMOTE_POST_SYNC_PAGE_SIZE
+
+    # authors nobody here follows anymore aren't kept
+    RemotePost.objects.exclude(author__in=get_mirrored_authors()).delete()
+    RemotePostSync.objects.exclude(author__in=get_mirrored_authors()).delete()
+
+    authors = _pick_due(batch_size)
+    states = {state.author_id: state for state in RemotePostSync.objects.filter(author__in=authors)}
+    for author in authors:
+        if author.id not in states:
+            states[author.id] = RemotePostSync(author=author)
+
+    result = {"checked": 0, "unchanged": 0, "posts": 0, "failed": 0}
+    now = timezone.now()
+    pending = {author.id: author for author in authors}
+    page = 1
+    while pending and page <= settings.REMOTE_POST_SYNC_MAX_PAGES:
+        targets = {author.id: (author.host, f"authors/{author.id}/posts/?page={page}&size={size}") for author in pending.values()}
+        headers = {}
+        for author_id in pending:
+            state = states[author_id]
+            headers[author_id] = {}
+            # only the first page is revalidated, the later ones are only asked for when it changed
+            if page == 1 and state.last_synced_at is not None:
+                if state.etag:
+                    headers[author_id]["If-None-Match"] = state.etag
+                if state.last_modified:
+                    headers[author_id]["If-Modified-Since"] = state.last_modified
+
+        responses, _ = get_request_remote_many(targets, deadline=settings.REMOTE_POST_SYNC_DEADLINE, headers=headers)
+
+        next_pending = {}
+        for author_id, author in pending.items():
+            state = states[author_id]
+            if author_id not in responses:
+                # missed the deadline, the author stays due for the next round
+                continue
+            response = responses[author_id]
+            state.last_checked_at = now
+            if page == 1:
+                result["checked"] += 1
+
+            if response is None or response.status_code not in (200, 304):
+                state.last_status_code = response.status_code if response is not None else None
+                if page > 1:
+                    # the walk didn't finish, the first page has to be read again next round
+                    state.etag = state.last_modified = ""
+                result["failed"] += 1
+                continue
+
+            state.last_status_code = response.status_code
+            if response.status_code == 304:
+                state.last_synced_at = now
+                result["unchanged"] += 1
+                continue
+
+            try:
+                payload = response.json()
+            except ValueError:
+                result["failed"] += 1
+                continue
+            posts = (payload.get('items') or []) if isinstance(payload, dict) else payload
+            reached = _store_posts(author, state, posts)
+            result["posts"] += len(posts)
+            state.last_synced_at = now
+
+            if page == 1:
+                state.etag = response.headers.get("ETag", "")
+                state.last_modified = response.headers.get("Last-Modified", "")
+                if len(posts) != size:
+                    # fewer than a page (or a node that doesn't page): that's all of the author's posts
+                    RemotePost.objects.filter(author=author).exclude(url__in=[post.get('id') for post in posts if isinstance(post, dict)]).delete()
+                    continue
+            if not reached and len(posts) == size:
+                next_pending[author_id] = author
+
+        pending = next_pending
+        page += 1
+
+    for state in states.values():
+        if state.last_checked_at is not None:
+            state.save()
+    return result
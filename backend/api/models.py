@@ -1,8 +1,9 @@
 from typing import Iterable
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
 from django.contrib.auth.models import User
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin
-from .managers import CustomAuthorManager
+from .managers import CustomAuthorManager, ImageManager
 import uuid
 import os
 
@@ -27,6 +28,13 @@ class Author(AbstractBaseUser, PermissionsMixin):
 
     EMAIL_FIELD = 'email'
     USERNAME_FIELD = 'email'
+
+    class Meta:
+        indexes = [
+            # the local authors list. Partial because the ORM filters booleans as NOT is_remote on SQLite,
+            # which a plain (is_remote, is_staff) index can't be searched with
+            models.Index(fields=['created_at', 'id'], condition=models.Q(is_remote=False, is_staff=False), name='author_local_created_idx'),
+        ]
     REQUIRED_FIELDS = ['display_name']
 
     def __str__(self):
@@ -65,6 +73,8 @@ class Follower(models.Model):
     follower = models.ForeignKey(Author, related_name='following', on_delete=models.CASCADE)
     followed_user = models.ForeignKey(Author, related_name='followers', on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
+    # for remote followers, when the reconcile_follows worker last checked the follow still exists on their node
+    last_checked_at = models.DateTimeField(blank=True, null=True)
 
     class Meta:
         # to ensure that a user can only follow another user once
@@ -81,6 +91,8 @@ class FollowRequest(models.Model):
     from_user = models.ForeignKey(Author, related_name='sent_follow_requests', on_delete=models.CASCADE)
     to_user = models.ForeignKey(Author, related_name='received_follow_requests', on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
+    # for requests to remote authors, when the reconcile_follows worker last checked if they were accepted
+    last_checked_at = models.DateTimeField(blank=True, null=True)
 
     class Meta:
         unique_together = ('from_user', 'to_user')
@@ -90,6 +102,20 @@ class FollowRequest(models.Model):
         return f'{self.from_user.display_name} sent a follow request to {self.to_user.display_name}'
     
 # #posts
+# the bytes of an image post, stored once per distinct image under the sha256 of the bytes
+class Image(models.Model):
+    hash = models.CharField(max_length=64, primary_key=True)
+    content_type = models.CharField(max_length=50)
+    size = models.IntegerField()
+    data = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = ImageManager()
+
+    def __str__(self):
+        return f"{self.hash} ({self.content_type}, {self.size} bytes)"
+
+
 class Post(models.Model):
     CONTENT_TYPES = (
         ('text/markdown', 'text/markdown'),
@@ -107,13 +133,102 @@ class Post(models.Model):
     contentType = models.CharField(max_length=50, choices=CONTENT_TYPES, default="text/markdown")
     content = models.TextField(default="",blank=True, null=True)
     author = models.ForeignKey(Author, related_name='posts_author', on_delete=models.CASCADE)
+    # number of comments and of likes, kept up to date by api/counters.py
     count = models.IntegerField(default=0)
+    likeCount = models.IntegerField(default=0)
     comments = models.CharField(max_length=100)
     published = models.DateTimeField(auto_now_add=True)
     visibility = models.CharField(max_length=50, choices=(('PUBLIC','PUBLIC'),('FRIENDS', 'FRIENDS'),('UNLISTED','UNLISTED')))
     # image_base64 = models.TextField(blank=True, null=True)  # Store base64 encoded images
     # image_url = models.URLField(max_length=200, blank=True, null=True)  
     sharedBy = models.CharField(max_length=100, default="")
+    # image posts keep their bytes in the Image table and an empty content
+    image = models.ForeignKey(Image, related_name='posts', on_delete=models.PROTECT, blank=True, null=True)
+
+    def save(self, *args, **kwargs):
+        # move base64 image content into the Image table, PostSerializer turns it back into base64 for the API
+        previous_image_id = self.image_id
+        if self.contentType.startswith("image/") and self.content:
+            image = Image.objects.store_base64(self.content, self.contentType)
+            if image is not None:
+                self.image = image
+                self.content = ""
+        elif not self.contentType.startswith("image/"):
+            self.image = None
+        super().save(*args, **kwargs)
+        if previous_image_id and previous_image_id != self.image_id:
+            # the image the post had is deleted if no other post uses it
+            Image.objects.delete_unused([previous_image_id])
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        post = super().from_db(db, field_names, values)
+        # the home feeds only change when the visibility does (see api/signals.py)
+        post._saved_visibility = post.__dict__.get('visibility')
+        return post
+
+    class Meta:
+        indexes = [
+            # the explore feed (public posts, newest first) and the profile pages (an author's posts by visibility),
+            # id breaks the ties of the cursor pagination
+            models.Index(fields=['visibility', '-published', '-id'], name='post_visibility_published_idx'),
+            models.Index(fields=['author', 'visibility', '-published', '-id'], name='post_author_vis_published_idx'),
+        ]
+
+# home feed entries, filled when a post is created so reading the feed is a single range scan per author
+class Timeline(models.Model):
+    owner = models.ForeignKey(Author, related_name='timeline', on_delete=models.CASCADE)
+    post = models.ForeignKey(Post, related_name='timeline_entries', on_delete=models.CASCADE)
+    # copied from the post so the feed can be read in order without joining the posts
+    published = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('owner', 'post')
+        ordering = ['-published']
+        indexes = [
+            models.Index(fields=['owner', '-published'], name='timeline_owner_published_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.post.title} in the feed of {self.owner.display_name}'
+
+# the posts of the remote authors that local authors follow, mirrored from their nodes by `manage.py sync_remote_posts`
+# (see api/mirror.py) so the feed and the remote profiles don't wait on the nodes
+class RemotePost(models.Model):
+    author = models.ForeignKey(Author, related_name='remote_posts', on_delete=models.CASCADE)
+    # the post's id on its node
+    url = models.URLField(max_length=500, unique=True)
+    visibility = models.CharField(max_length=50)
+    published = models.DateTimeField()
+    # the post as the node serves it
+    data = models.JSONField()
+    synced_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-published']
+        indexes = [
+            models.Index(fields=['author', '-published'], name='remote_post_author_pub_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.url} by {self.author.display_name}'
+
+# how far the mirror of a remote author's posts got
+class RemotePostSync(models.Model):
+    author = models.OneToOneField(Author, related_name='post_sync', on_delete=models.CASCADE, primary_key=True)
+    # validators of the author's first page of posts, sent back so an unchanged page costs a 304
+    etag = models.CharField(max_length=200, blank=True, default="")
+    last_modified = models.CharField(max_length=100, blank=True, default="")
+    # the newest post mirrored, paging stops at the first page that reaches it
+    last_seen_published = models.DateTimeField(blank=True, null=True)
+    # when the node was last asked, and when it last answered
+    last_checked_at = models.DateTimeField(blank=True, null=True)
+    last_synced_at = models.DateTimeField(blank=True, null=True)
+    last_status_code = models.IntegerField(blank=True, null=True)
+
+    def __str__(self):
+        return f'posts of {self.author.display_name} synced at {self.last_synced_at}'
+
 # #comments
 class Comment(models.Model):
     type = models.CharField(max_length=50, default="comment")
@@ -124,6 +239,16 @@ class Comment(models.Model):
     published = models.DateTimeField(auto_now_add=True)
     post = models.ForeignKey(Post, on_delete=models.CASCADE)
 
+    def save(self, *args, **kwargs):
+        # the post's comment count is changed by the post_save signal, in the same transaction as the insert
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', '-published', '-id'], name='comment_post_published_idx'),
+        ]
+
 # #likes
 class Like(models.Model):
     type = models.CharField(max_length=20, default="Like")
@@ -132,6 +257,17 @@ class Like(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="like_post", null=True)
     object = models.CharField(max_length=250, null=False, blank=False, default="")
 
+    def save(self, *args, **kwargs):
+        # the post's like count is changed by the post_save signal, in the same transaction as the insert
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    class Meta:
+        indexes = [
+            # the likes of a post use the post foreign key index, this one is for "did this author already like it"
+            models.Index(fields=['author', 'post'], name='like_author_post_idx'),
+        ]
+
 # #inbox
 class Inbox(models.Model):
     type = models.CharField(max_length=50, default="inbox")
@@ -139,6 +275,11 @@ class Inbox(models.Model):
     item = models.JSONField()
     published = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['author', '-published'], name='inbox_author_published_idx'),
+        ]
+
 
 class Node(models.Model):
     team_name = models.CharField(max_length=100)
@@ -146,6 +287,110 @@ class Node(models.Model):
     base64_authorization = models.CharField(max_length=100)
     is_active = models.BooleanField(default=True)
     host_url = models.URLField(max_length=200, blank=True, null=True)
+    # circuit breaker health, kept up to date by the federation client (see api/breaker.py)
+    breaker_state = models.CharField(max_length=10, choices=(('CLOSED', 'CLOSED'), ('OPEN', 'OPEN'), ('HALF_OPEN', 'HALF_OPEN')), default='CLOSED')
+    breaker_opened_at = models.DateTimeField(blank=True, null=True)
+    consecutive_failures = models.IntegerField(default=0)
+    recent_requests = models.IntegerField(default=0)
+    recent_failures = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True, default="")
+    health_checked_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f'{self.team_name}: {self.api_url}'
+
+# the directory of the other nodes' authors, refreshed in the background from their authors/ lists (see api/directory.py)
+class RemoteAuthor(models.Model):
+    node = models.ForeignKey(Node, related_name='remote_authors', on_delete=models.CASCADE)
+    # the author's id on its node
+    url = models.URLField(max_length=500, unique=True)
+    host = models.URLField(max_length=500)
+    display_name = models.CharField(max_length=200, blank=True, default="")
+    # the author as the node serves it
+    data = models.JSONField()
+    first_seen_at = models.DateTimeField(auto_now_add=True)
+    # when the author was last in its node's list, the ones that drop out of a complete list are removed
+    seen_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            # the directory, newest first with cursor pagination
+            models.Index(fields=['first_seen_at', 'id'], name='remote_author_seen_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.display_name} on {self.node.team_name}'
+
+# how far the refresh of a node's authors got
+class RemoteAuthorSync(models.Model):
+    node = models.OneToOneField(Node, related_name='author_sync', on_delete=models.CASCADE, primary_key=True)
+    # validators of the node's first page of authors, sent back so an unchanged list costs a 304
+    etag = models.CharField(max_length=200, blank=True, default="")
+    last_modified = models.CharField(max_length=100, blank=True, default="")
+    # when the node was last asked, and when its whole list was last read
+    last_checked_at = models.DateTimeField(blank=True, null=True)
+    last_synced_at = models.DateTimeField(blank=True, null=True)
+    last_status_code = models.IntegerField(blank=True, null=True)
+
+    def __str__(self):
+        return f'authors of {self.node.team_name} synced at {self.last_synced_at}'
+
+# the author search index (see api/search.py): one entry per local author and per author of the remote author directory
+class AuthorSearchEntry(models.Model):
+    author = models.OneToOneField(Author, related_name='search_entry', on_delete=models.CASCADE, blank=True, null=True)
+    remote_author = models.OneToOneField(RemoteAuthor, related_name='search_entry', on_delete=models.CASCADE, blank=True, null=True)
+    display_name = models.CharField(max_length=200, blank=True, default="")
+    github_username = models.CharField(max_length=100, blank=True, default="")
+    # how many trigrams the entry has, for the similarity of the fuzzy matches
+    trigram_count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return self.display_name
+
+# the words (for prefix matches) and trigrams (for fuzzy matches) of the display name and github username of an entry
+class AuthorSearchTerm(models.Model):
+    KINDS = (
+        ('w', 'word'),
+        ('t', 'trigram'),
+    )
+    entry = models.ForeignKey(AuthorSearchEntry, related_name='terms', on_delete=models.CASCADE)
+    kind = models.CharField(max_length=1, choices=KINDS)
+    term = models.CharField(max_length=100)
+
+    class Meta:
+        indexes = [
+            # prefixes (LIKE 'q%') are a range scan of the words, trigrams an equality lookup. PostgreSQL only uses
+            # an index for LIKE with the pattern operators, unless the database's collation is C
+            models.Index(fields=['kind', 'term'], name='author_search_term_like_idx', opclasses=['varchar_pattern_ops', 'varchar_pattern_ops']),
+        ]
+
+    def __str__(self):
+        return f'{self.kind}:{self.term}'
+
+# activities (posts, likes, comments, follow requests) waiting to be delivered to a remote node's inbox
+class Outbox(models.Model):
+    STATUSES = (
+        ('PENDING', 'PENDING'),
+        ('SENT', 'SENT'),
+        ('FAILED', 'FAILED')
+    )
+    node = models.ForeignKey(Node, related_name='outbox', on_delete=models.CASCADE)
+    request_url = models.URLField(max_length=500)
+    payload = models.JSONField()
+    status = models.CharField(max_length=20, choices=STATUSES, default="PENDING")
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_status_code = models.IntegerField(blank=True, null=True)
+    last_error = models.TextField(default="", blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            # the worker only ever looks for pending deliveries that are due
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_status_due_idx'),
+        ]
 
     def __str__(self):
-        return f'{self.team_name}: {self.api_url}'
\ No newline at end of file
+        return f'{self.status} delivery to {self.request_url}'
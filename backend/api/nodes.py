@@ -0,0 +1,115 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+import re
+import threading
+import time
+import uuid
+from .models import Node
+
+# Process-local registry of the Nodes, indexed by host_url and api_url, so the federation hot paths look nodes up
+# in memory instead of querying the Node table on every remote call.
+# Saving or deleting a Node (post_save/post_delete, see api/signals.py) drops this process's registry right away and
+# changes the version stamp in the cache once the transaction commits. Other processes compare their version with the
+# stamp at most every NODE_REGISTRY_CHECK_INTERVAL seconds, and reload after NODE_REGISTRY_MAX_AGE seconds regardless
+# (with a per-process cache such as LocMemCache the stamp can't be seen by the other processes).
+
+NODE_REGISTRY_VERSION_KEY = "nodes:version"
+
+_registry = None
+# changes on every invalidation, a registry loaded while it changed is not kept
+_generation = 0
+_registry_lock = threading.Lock()
+
+
+class NodeRegistry:
+    def __init__(self, nodes, version):
+        self.nodes = nodes
+        self.version = version
+        self.loaded_at = self.checked_at = time.time()
+        self.by_host_url = {}
+        self.by_api_url = {}
+        for node in nodes:
+            if node.host_url:
+                self.by_host_url.setdefault(node.host_url, []).append(node)
+            self.by_api_url.setdefault(node.api_url, []).append(node)
+        # markdown images linking to any node's api, so remote posts are rewritten in one pass (see utils.rewrite_image_urls).
+        # longest first so a node whose api_url is a prefix of another's doesn't cut it short
+        api_urls = sorted({node.api_url for node in nodes if node.api_url}, key=len, reverse=True)
+        self.image_url_pattern = re.compile(r"!\[image\]\((?:" + "|".join(map(re.escape, api_urls)) + ")") if api_urls else None
+
+
+def get_node_registry():
+    """
+    Get the current registry, loading it if it was invalidated
+    """
+    global _registry
+    registry = _registry
+    now = time.time()
+    if registry is not None and now - registry.checked_at >= settings.NODE_REGISTRY_CHECK_INTERVAL:
+        if cache.get(NODE_REGISTRY_VERSION_KEY) != registry.version or now - registry.loaded_at >= settings.NODE_REGISTRY_MAX_AGE:
+            registry = None
+        else:
+            registry.checked_at = now
+
+    if registry is None:
+        generation = _generation
+        registry = NodeRegistry(list(Node.objects.order_by('id')), cache.get(NODE_REGISTRY_VERSION_KEY))
+        # a registry read inside a transaction may hold rows that get rolled back, so it is only used for this lookup
+        if not transaction.get_connection().in_atomic_block:
+            with _registry_lock:
+                if generation == _generation:
+                    _registry = registry
+    return registry
+
+
+def invalidate_node_registry():
+    """
+    Drop the registry of this process now, and of the other processes once the transaction commits
+    """
+    _invalidate_local()
+
+    def bump_version():
+        cache.set(NODE_REGISTRY_VERSION_KEY, uuid.uuid4().hex, None)
+        _invalidate_local()
+
+    transaction.on_commit(bump_version)
+
+
+def _invalidate_local():
+    global _registry, _generation
+    with _registry_lock:
+        _registry = None
+        _generation += 1
+
+
+def get_nodes(active=None):
+    """
+    Get all the nodes, or only the active (active=True) or inactive (active=False) ones
+    """
+    nodes = get_node_registry().nodes
+    if active is None:
+        return list(nodes)
+    return [node for node in nodes if node.is_active == active]
+
+
+def _first_node(nodes, active):
+    # same as .first() on the id ordered table
+    for node in nodes:
+        if active is None or node.is_active == active:
+            return node
+    return None
+
+
+def get_node_by_host(host_url, active=None):
+    """
+    Get the node with the given host_url (like Node.objects.filter(host_url=host_url).first()), None if there is none
+    """
+    return _first_node(get_node_registry().by_host_url.get(host_url, []), active)
+
+
+def get_node_by_api_url(api_url, active=None):
+    """
+    Get the node with the given api_url, None if there is none
+    """
+    return _first_node(get_node_registry().by_api_url.get(api_url, []), active)
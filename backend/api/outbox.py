@@ -0,0 +1,123 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+import requests
+from .models import Outbox
+from .breaker import OPEN, NodeUnavailable, get_breaker, save_breaker_states
+from .utils import node_request
+
+# deliveries to different nodes go out in parallel, deliveries to the same node go out one after another
+_delivery_executor = ThreadPoolExecutor(max_workers=settings.OUTBOX_WORKERS, thread_name_prefix="outbox")
+
+
+def queue_remote_delivery(node, request_url, payload):
+    """
+    Queue an activity for delivery to a remote inbox, the outbox worker (manage.py deliver_outbox) sends it
+    """
+    return Outbox.objects.create(node=node, request_url=request_url, payload=payload)
+
+
+def get_retry_delay(attempts):
+    """
+    Exponential backoff between delivery attempts, capped at OUTBOX_RETRY_MAX_DELAY seconds
+    """
+    delay = settings.OUTBOX_RETRY_BASE_DELAY * (2 ** (attempts - 1))
+    return timedelta(seconds=min(delay, settings.OUTBOX_RETRY_MAX_DELAY))
+
+
+def _deliver_node_batch(node, deliveries):
+    """
+    Send a node's deliveries in order through its pooled session.
+    Returns {delivery id: (status code, error)}, deliveries after a connection failure or while the node's circuit
+    breaker is open are left unattempted.
+    """
+    results = {}
+    for delivery in deliveries:
+        try:
+            response = node_request(node, "post", delivery.request_url, json=delivery.payload)
+        except NodeUnavailable:
+            # the node's circuit is open, the rest of the batch waits for it without using up attempts
+            break
+        except requests.exceptions.RequestException as e:
+            # the node is unreachable, the rest of its batch would fail the same way
+            results[delivery.id] = (None, str(e))
+            break
+        results[delivery.id] = (response.status_code, "" if response.ok else response.text[:1000])
+    return results
+
+
+def claim_deliveries(batch_size):
+    """
+    Claim the pending outbox items that are due, so other workers don't send them too.
+    The claim moves next_attempt_at OUTBOX_CLAIM_TIMEOUT seconds ahead, the items of a worker that dies while
+    sending are due again after that.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        # rows another worker is claiming are skipped instead of waited for
+        due = list(
+            Outbox.objects.select_for_update(skip_locked=True, of=('self',))
+            .filter(status="PENDING", next_attempt_at__lte=now).select_related('node')[:batch_size]
+        )
+        Outbox.objects.filter(id__in=[delivery.id for delivery in due]).update(next_attempt_at=now + timedelta(seconds=settings.OUTBOX_CLAIM_TIMEOUT))
+    return due
+
+
+def deliver_outbox(batch_size=None):
+    """
+    Deliver the pending outbox items that are due, grouped per node.
+    Returns the number of deliveries that were attempted.
+    """
+    if batch_size is None:
+        batch_size = settings.OUTBOX_BATCH_SIZE
+
+    due = claim_deliveries(batch_size)
+
+    batches = {}
+    for delivery in due:
+        batches.setdefault(delivery.node_id, []).append(delivery)
+
+    futures = [_delivery_executor.submit(_deliver_node_batch, deliveries[0].node, deliveries) for deliveries in batches.values()]
+    results = {}
+    for future in futures:
+        results.update(future.result())
+
+    # the database is only touched from this thread
+    now = timezone.now()
+    deferred = []
+    unattempted = []
+    for deliveries in batches.values():
+        for delivery in deliveries:
+            if delivery.id not in results:
+                if get_breaker(delivery.node).state == OPEN:
+                    deferred.append(delivery.id)
+                else:
+                    unattempted.append(delivery.id)
+                continue
+            status_code, error = results[delivery.id]
+            delivery.attempts += 1
+            delivery.last_status_code = status_code
+            delivery.last_error = error
+            if status_code is not None and 200 <= status_code < 300:
+                delivery.status = "SENT"
+                delivery.sent_at = now
+            elif status_code is not None and 400 <= status_code < 500 and status_code not in (408, 429):
+                # the node rejected the activity, sending it again won't change that
+                delivery.status = "FAILED"
+            elif delivery.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+                delivery.status = "FAILED"
+            else:
+                delivery.next_attempt_at = now + get_retry_delay(delivery.attempts)
+            delivery.save(update_fields=['attempts', 'last_status_code', 'last_error', 'status', 'sent_at', 'next_attempt_at'])
+
+    # wait for the node's breaker to let a probe through, so a dead node doesn't fill every batch
+    if deferred:
+        Outbox.objects.filter(id__in=deferred).update(next_attempt_at=now + timedelta(seconds=settings.FEDERATION_BREAKER_COOLDOWN))
+    # the claim on the deliveries that weren't attempted is given back
+    if unattempted:
+        Outbox.objects.filter(id__in=unattempted).update(next_attempt_at=now)
+
+    save_breaker_states()
+    return len(results)
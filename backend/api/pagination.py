@@ -0,0 +1,95 @@
+import base64
+import json
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+
+# Cursor (keyset) pagination: a page is "the next size rows after the last row of the previous page",
+# ordered newest first by (field, pk). The cursor is an opaque base64 string holding that last (field, pk),
+# so every page is an indexed range scan instead of an OFFSET scan plus a COUNT.
+# Rankings (e.g. search results) have no such key, their cursor holds the position of the next page instead.
+
+DEFAULT_CURSOR_PAGE_SIZE = 10
+
+
+def encode_cursor(value, pk):
+    return base64.urlsafe_b64encode(json.dumps([value.isoformat(), str(pk)]).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Get the (datetime, pk) the cursor points after, a cursor that is not one of ours is a 400
+    """
+    try:
+        value, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        value = parse_datetime(value)
+    except Exception:
+        value = None
+    if value is None:
+        raise ValidationError({"cursor": "invalid cursor"})
+    return value, pk
+
+
+def get_cursor_page_size(request):
+    try:
+        size = int(request.query_params.get('size', DEFAULT_CURSOR_PAGE_SIZE))
+    except ValueError:
+        size = DEFAULT_CURSOR_PAGE_SIZE
+    return size if size > 0 else DEFAULT_CURSOR_PAGE_SIZE
+
+
+def keyset_condition(before, field='published'):
+    """
+    The condition on the rows that come after before = (value, pk) in (field, pk) descending order.
+    A field across a multi-valued relation has to be filtered in the same filter() call as the rest of the
+    conditions on that relation, or it is checked against another join (e.g. any author's timeline row)
+    """
+    value, pk = before
+    return Q(**{f'{field}__lt': value}) | Q(**{field: value, 'pk__lt': pk})
+
+
+def keyset_filter(queryset, before, field='published'):
+    """
+    Keep the rows that come after before = (value, pk) in (field, pk) descending order
+    """
+    if before is None:
+        return queryset
+    return queryset.filter(keyset_condition(before, field))
+
+
+def split_page(rows, size, attr='published'):
+    """
+    rows holds up to size + 1 rows, returns (the page, the cursor of the next page or None)
+    """
+    rows = list(rows)
+    if len(rows) <= size:
+        return rows, None
+    rows = rows[:size]
+    return rows, encode_cursor(getattr(rows[-1], attr), rows[-1].pk)
+
+
+def paginate_by_cursor(queryset, cursor, size, field='published', attr='published'):
+    """
+    Get one page of queryset, newest first. Returns (the page, the cursor of the next page or None)
+    """
+    before = decode_cursor(cursor) if cursor else None
+    queryset = keyset_filter(queryset, before, field).order_by(f'-{field}', '-pk')
+    return split_page(queryset[:size + 1], size, attr)
+
+
+def paginate_by_offset_cursor(queryset, cursor, size):
+    """
+    Get one page of an ordered queryset. Returns (the page, the cursor of the next page or None)
+    """
+    start = 0
+    if cursor:
+        try:
+            start = json.loads(base64.urlsafe_b64decode(cursor.encode()))["offset"]
+        except Exception:
+            start = None
+        if not isinstance(start, int) or start < 0:
+            raise ValidationError({"cursor": "invalid cursor"})
+    rows = list(queryset[start:start + size + 1])
+    if len(rows) <= size:
+        return rows, None
+    return rows[:size], base64.urlsafe_b64encode(json.dumps({"offset": start + size}).encode()).decode()
@@ -0,0 +1,106 @@
+import logging
+from datetime import timedelta
+from urllib.parse import quote
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import Follower, FollowRequest
+from .utils import get_request_remote_many
+
+logger = logging.getLogger(__name__)
+
+# Remote follow state is kept in sync by a background worker (manage.py reconcile_follows) instead of the browsers:
+#   - a follow request to a remote author becomes a Follower once their node says it was accepted
+#   - a remote follower is removed once their node says they no longer follow
+# Each relationship is checked once every FOLLOW_RECONCILE_INTERVAL seconds, the least recently checked first,
+# with at most FOLLOW_RECONCILE_PER_NODE checks per node per round so one big node doesn't hold up the others.
+
+
+def _pick_due(queryset, get_host, batch_size, per_node, per_host):
+    """
+    Pick up to batch_size due rows, least recently checked first, spread over the nodes.
+    per_host counts the rows picked per node so far, and is updated.
+    """
+    due_before = timezone.now() - timedelta(seconds=settings.FOLLOW_RECONCILE_INTERVAL)
+    queryset = queryset.filter(Q(last_checked_at__isnull=True) | Q(last_checked_at__lt=due_before))
+    queryset = queryset.order_by(F('last_checked_at').asc(nulls_first=True), 'id')
+
+    picked = []
+    if batch_size <= 0:
+        return picked
+    # bounded scan, a node over its share only delays its own rows to the next round
+    for row in queryset[:batch_size * 4]:
+        host = get_host(row)
+        if per_host.get(host, 0) >= per_node:
+            continue
+        per_host[host] = per_host.get(host, 0) + 1
+        picked.append(row)
+        if len(picked) >= batch_size:
+            break
+    return picked
+
+
+def reconcile_follow_state(batch_size=None):
+    """
+    Check one round of due remote follow requests and remote followers against their nodes and store the results.
+    Returns {"checked": ..., "accepted": ..., "removed": ...}
+    """
+    if batch_size is None:
+        batch_size = settings.FOLLOW_RECONCILE_BATCH_SIZE
+    per_node = settings.FOLLOW_RECONCILE_PER_NODE
+    per_host = {}
+
+    follow_requests = _pick_due(
+        FollowRequest.objects.filter(to_user__is_remote=True).select_related('from_user', 'to_user'),
+        lambda follow_request: follow_request.to_user.host, batch_size, per_node, per_host,
+    )
+    followers = _pick_due(
+        Follower.objects.filter(follower__is_remote=True).select_related('follower', 'followed_user'),
+        lambda follower: follower.follower.host, batch_size - len(follow_requests), per_node, per_host,
+    )
+
+    targets = {}
+    for follow_request in follow_requests:
+        # the request was accepted if the local author is now one of the remote author's followers
+        targets[("request", follow_request.id)] = (follow_request.to_user.host, f"authors/{follow_request.to_user.id}/followers/{quote(follow_request.from_user.url)}")
+    for follower in followers:
+        targets[("follower", follower.id)] = (follower.follower.host, f"authors/{follower.followed_user.id}/followers/{quote(follower.follower.url)}")
+
+    responses, partial = get_request_remote_many(targets, deadline=settings.FOLLOW_RECONCILE_DEADLINE)
+
+    # the database is only touched from this thread, checks that missed the deadline are left for the next round
+    accepted = 0
+    removed = 0
+    checked_requests = []
+    checked_followers = []
+    for follow_request in follow_requests:
+        key = ("request", follow_request.id)
+        if key not in responses:
+            continue
+        response = responses[key]
+        if response is not None and response.status_code == 200:
+            logger.info("Follow request was approved")
+            # local user is now a follower of the remote user
+            Follower.objects.get_or_create(follower=follow_request.from_user, followed_user=follow_request.to_user)
+            follow_request.delete()
+            accepted += 1
+        else:
+            checked_requests.append(follow_request.id)
+
+    for follower in followers:
+        key = ("follower", follower.id)
+        if key not in responses:
+            continue
+        response = responses[key]
+        if response is not None and response.status_code == 404:
+            # no longer a follower
+            follower.delete()
+            removed += 1
+        else:
+            checked_followers.append(follower.id)
+
+    now = timezone.now()
+    FollowRequest.objects.filter(id__in=checked_requests).update(last_checked_at=now)
+    Follower.objects.filter(id__in=checked_followers).update(last_checked_at=now)
+
+    return {"checked": len(responses), "accepted": accepted, "removed": removed}
@@ -0,0 +1,95 @@
+from django.db.models import Q
+from .models import Author, Follower
+
+# Follow/friend visibility checks for one viewer. The resolver loads the viewer's relationships with any number of
+# authors in one query and remembers them, get_relationships keeps one resolver per request so a view never asks
+# the database twice about the same pair.
+
+
+class RelationshipResolver:
+    def __init__(self, viewer_id, viewer_is_remote=False):
+        self.viewer_id = viewer_id
+        self.viewer_is_remote = viewer_is_remote
+        # authors the viewer follows, and authors that follow the viewer, among the loaded ones
+        self._following = set()
+        self._followed_by = set()
+        self._loaded = set()
+
+    def load(self, author_ids):
+        """
+        Load the viewer's relationships with all of author_ids at once, the ones already loaded are skipped
+        """
+        missing = {str(author_id) for author_id in author_ids} - self._loaded
+        if self.viewer_id is None or not missing:
+            return
+        rows = Follower.objects.filter(
+            Q(follower_id=self.viewer_id, followed_user_id__in=missing) | Q(followed_user_id=self.viewer_id, follower_id__in=missing)
+        ).values_list('follower_id', 'followed_user_id')
+        for follower_id, followed_user_id in rows:
+            if str(follower_id) == str(self.viewer_id):
+                self._following.add(str(followed_user_id))
+            if str(followed_user_id) == str(self.viewer_id):
+                self._followed_by.add(str(follower_id))
+        self._loaded |= missing
+
+    def follows(self, author_id):
+        """
+        Does the viewer follow author_id
+        """
+        self.load([author_id])
+        return str(author_id) in self._following
+
+    def followed_by(self, author_id):
+        """
+        Does author_id follow the viewer
+        """
+        self.load([author_id])
+        return str(author_id) in self._followed_by
+
+    def is_friend(self, author_id):
+        """
+        Do the viewer and author_id follow each other
+        """
+        return self.follows(author_id) and self.followed_by(author_id)
+
+    def is_self(self, author_id):
+        return self.viewer_id is not None and str(author_id) == str(self.viewer_id)
+
+    def can_see_friends_posts(self, author_id):
+        """
+        Can the viewer see author_id's friends only posts: their own, a friend's, or any as a remote node
+        (the remote node does its own filtering)
+        """
+        if self.viewer_id is None:
+            return False
+        return self.is_self(author_id) or self.viewer_is_remote or self.is_friend(author_id)
+
+    def can_see(self, author_id, visibility):
+        """
+        Can the viewer open a post of author_id with the given visibility
+        """
+        visibility = (visibility or "").upper()
+        if visibility in ("PUBLIC", "UNLISTED"):
+            return True
+        if visibility == "FRIENDS":
+            return self.can_see_friends_posts(author_id)
+        return self.is_self(author_id)
+
+
+def get_relationships(request, viewer_id=None):
+    """
+    Get the resolver of the request's user (or of viewer_id), made once per request
+    """
+    resolvers = getattr(request, "_relationships", None)
+    if resolvers is None:
+        resolvers = request._relationships = {}
+
+    user = request.user
+    if viewer_id is None and isinstance(user, Author):
+        viewer_id = user.id
+
+    key = str(viewer_id) if viewer_id is not None else None
+    if key not in resolvers:
+        viewer_is_remote = isinstance(user, Author) and key == str(user.id) and user.is_remote
+        resolvers[key] = RelationshipResolver(viewer_id, viewer_is_remote)
+    return resolvers[key]
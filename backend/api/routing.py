@@ -0,0 +1,6 @@
+from django.urls import path
+from . import consumers
+
+websocket_urlpatterns = [
+    path("ws/authors/<uuid:id_author>/inbox", consumers.InboxConsumer.as_asgi(), name="inbox_socket"),
+]
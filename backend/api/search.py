@@ -0,0 +1,157 @@
+import re
+from urllib.parse import urlsplit
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, Max, Q, Value, When
+from django.db.models.functions import Lower
+from .models import Author, AuthorSearchEntry, AuthorSearchTerm, RemoteAuthor
+
+# Author search (/api/authors/search?q=) over the local authors and the remote author directory (api/directory.py),
+# on their display names and github usernames. Every author has an AuthorSearchEntry with its terms in AuthorSearchTerm:
+#   - its words, a query word matches the words it starts (LIKE 'q%', a range scan of the (kind, term) index, which uses
+#     varchar_pattern_ops on PostgreSQL so it works whatever the database's collation, never a LIKE '%q%' scan)
+#   - its trigrams (of each word padded like pg_trgm: "  bob " -> "  b", " bo", "bob", "ob "), a typo still shares
+#     most of them. An author matches when it has at least MIN_SIMILARITY of the query's trigrams (like pg_trgm's
+#     word_similarity, a long name isn't penalized for the words that weren't searched)
+# The rank is the share of query words matched as a prefix (a whole word counts more) plus the trigram similarity,
+# which also counts how close the whole name is (shared / (query trigrams + entry trigrams - shared)).
+# It is worked out by the database over a bounded set of candidates, so the views only read the page they serve.
+# Local authors are indexed when saved (see api/signals.py), the directory's authors when it stores them,
+# `manage.py rebuild_author_search` rebuilds the whole index.
+
+WORD = 'w'
+TRIGRAM = 't'
+MIN_SIMILARITY = 0.5
+# at most this many authors are ranked per query, per kind of match
+MAX_CANDIDATES = 500
+BATCH_SIZE = 1000
+
+_WORD_PATTERN = re.compile(r"\w+")
+
+
+def get_words(text):
+    return [word[:100] for word in _WORD_PATTERN.findall((text or "").lower())]
+
+
+def get_trigrams(text):
+    trigrams = set()
+    for word in get_words(text):
+        padded = f"  {word} "
+        trigrams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return trigrams
+
+
+def get_github_username(github):
+    """
+    The username of a github profile url
+    """
+    path = urlsplit(github or "").path.strip("/")
+    return path.split("/")[0] if path else ""
+
+
+def get_search_terms(display_name, github_username):
+    """
+    Returns (words, trigrams) of an author
+    """
+    text = f"{display_name} {github_username}"
+    return set(get_words(text)), get_trigrams(text)
+
+
+def _replace_entries(field, objects, get_values):
+    """
+    Index objects (the field of the entry they go in), replacing their entries
+    """
+    with transaction.atomic():
+        AuthorSearchEntry.objects.filter(**{f"{field}__in": [obj.pk for obj in objects]}).delete()
+        entries = []
+        for obj in objects:
+            display_name, github_username = get_values(obj)
+            words, trigrams = get_search_terms(display_name, github_username)
+            entry = AuthorSearchEntry(display_name=display_name[:200], github_username=github_username[:100], trigram_count=len(trigrams))
+            setattr(entry, field, obj)
+            entries.append((entry, words, trigrams))
+        AuthorSearchEntry.objects.bulk_create([entry for entry, _, _ in entries], batch_size=BATCH_SIZE)
+        AuthorSearchTerm.objects.bulk_create([
+            AuthorSearchTerm(entry=entry, kind=kind, term=term)
+            for entry, words, trigrams in entries
+            for kind, terms in ((WORD, words), (TRIGRAM, trigrams))
+            for term in terms
+        ], batch_size=BATCH_SIZE)
+
+
+def index_authors(authors):
+    """
+    Index local authors, remote and staff authors are taken out of the index
+    """
+    authors = list(authors)
+    searchable = [author for author in authors if not author.is_remote and not author.is_staff]
+    AuthorSearchEntry.objects.filter(author__in=[author.pk for author in authors if author not in searchable]).delete()
+    _replace_entries('author', searchable, lambda author: (author.display_name or "", get_github_username(author.github)))
+
+
+def index_remote_authors(remote_authors):
+    """
+    Index authors of the remote author directory
+    """
+    _replace_entries('remote_author', list(remote_authors), lambda author: (author.display_name or "", get_github_username(author.data.get('github'))))
+
+
+def rebuild_author_search():
+    """
+    Index every local author and every author of the directory again, returns how many were indexed
+    """
+    AuthorSearchEntry.objects.all().delete()
+    count = 0
+    authors = Author.objects.filter(is_remote=False, is_staff=False).order_by('pk')
+    for start in range(0, authors.count(), BATCH_SIZE):
+        batch = list(authors[start:start + BATCH_SIZE])
+        index_authors(batch)
+        count += len(batch)
+    remote_authors = RemoteAuthor.objects.order_by('pk')
+    for start in range(0, remote_authors.count(), BATCH_SIZE):
+        batch = list(remote_authors[start:start + BATCH_SIZE])
+        index_remote_authors(batch)
+        count += len(batch)
+    return count
+
+
+def find_authors(query):
+    """
+    Get the entries matching the query, best first, annotated with their score
+    """
+    words = list(dict.fromkeys(get_words(query)))
+    if not words:
+        return AuthorSearchEntry.objects.none()
+    trigrams = get_trigrams(query)
+
+    # the candidates: for each query word the entries with a word it starts (whole words sort first),
+    # and the entries sharing the most trigrams with the query
+    candidates = set()
+    for word in words:
+        candidates.update(AuthorSearchTerm.objects.filter(kind=WORD, term__startswith=word).order_by(
+            'term', 'entry_id').values_list('entry_id', flat=True)[:MAX_CANDIDATES])
+    candidates.update(entry_id for entry_id, _ in AuthorSearchTerm.objects.filter(kind=TRIGRAM, term__in=trigrams).values('entry_id').annotate(
+        shared=Count('id')).order_by('-shared', 'entry_id').values_list('entry_id', 'shared')[:MAX_CANDIDATES])
+    if not candidates:
+        return AuthorSearchEntry.objects.none()
+
+    # only the terms that match are joined: each query word counts for the best word of the entry it starts,
+    # and the trigrams count when the entry has at least MIN_SIMILARITY of them
+    matching = Q(terms__kind=TRIGRAM, terms__term__in=trigrams)
+    prefix = Value(0.0)
+    for word in words:
+        matching |= Q(terms__kind=WORD, terms__term__startswith=word)
+        prefix += Max(Case(
+            When(terms__kind=WORD, terms__term=word, then=Value(1.0)),
+            When(terms__kind=WORD, terms__term__startswith=word, then=Value(0.75)),
+            default=Value(0.0),
+        ))
+    # the counts are integers, the float constants keep the divisions from rounding down
+    count = float(len(trigrams))
+    similarity = (F('shared') / count + F('shared') / (count + F('trigram_count') - F('shared'))) / 2.0
+    return AuthorSearchEntry.objects.filter(id__in=candidates).filter(matching).annotate(
+        shared=Count('terms', filter=Q(terms__kind=TRIGRAM)),
+    ).annotate(
+        score=prefix / float(len(words)) + Case(When(shared__gte=MIN_SIMILARITY * count, then=similarity), default=Value(0.0), output_field=FloatField()),
+    ).filter(score__gt=0).filter(
+        Q(author__isnull=False) | Q(remote_author__node__is_active=True)
+    ).select_related('author', 'remote_author').order_by('-score', Lower('display_name'), 'id')
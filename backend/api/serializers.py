@@ -1,5 +1,8 @@
 from rest_framework import serializers
 from django.contrib.auth import authenticate
+from django.db.models import prefetch_related_objects
+from django.db.models.manager import BaseManager
+import base64
 from .models import Author, Post, Comment, Like, Inbox, FollowRequest
 
 
@@ -41,6 +44,17 @@ class UserRegisterSerializer(serializers.ModelSerializer):
         return author
 
 
+class PrefetchListSerializer(serializers.ListSerializer):
+    """
+    Loads the relations listed in the child's Meta.prefetch_related for the whole list at once,
+    so serializing a page costs one query per relation instead of one query per item
+    """
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, BaseManager) else data)
+        prefetch_related_objects(items, *getattr(self.child.Meta, 'prefetch_related', ()))
+        return super().to_representation(items)
+
+
 class AuthorSerializer(serializers.ModelSerializer):
     displayName = serializers.CharField(source='display_name')
     profileImage = serializers.URLField(source='profile_image', required=False, allow_null=True, allow_blank=True)
@@ -64,6 +78,8 @@ class FollowRequestSerializer(serializers.Serializer):
 
     class Meta:
         fields = ['type', 'summary', 'actor', 'object']
+        list_serializer_class = PrefetchListSerializer
+        prefetch_related = ['from_user', 'to_user']
 
     def get_actor(self, obj):
         actor = AuthorSerializer(obj.from_user, context=self.context).data
@@ -92,19 +108,29 @@ class PostSerializer(serializers.ModelSerializer):
         model = Post
         fields = [
             'type', 'id', 'title', 'source', 'origin', 'description', 'contentType',
-            'content', 'author', 'count', 'comments', 'published',
+            'content', 'author', 'count', 'likeCount', 'comments', 'published',
             'visibility', 'sharedBy'
 
         ]
-        read_only_fields = ['type', 'id', 'author', 'count', 'comments', 'published']
-    
+        read_only_fields = ['type', 'id', 'author', 'count', 'likeCount', 'comments', 'published']
+        list_serializer_class = PrefetchListSerializer
+        # the image bytes are never prefetched, lists link to the image endpoint
+        prefetch_related = ['author']
+
     def to_representation(self, instance):
         data = super().to_representation(instance)
         request = self.context.get('request')
         data["author"] = AuthorSerializer(instance.author, context=self.context).data
-        current_url = f"{request.build_absolute_uri('/')}api/authors/{instance.author.id}/posts"
+        current_url = f"{request.build_absolute_uri('/')}api/authors/{instance.author_id}/posts"
         data['id'] = f"{current_url}/{instance.id}"
         data["comments"] = f"{data['id']}/comments"
+        if instance.image_id and instance.contentType.startswith("image/"):
+            if self.parent is not None or self.context.get('image_urls'):
+                # lists and the posts of comments and likes link to the image, only that endpoint reads its bytes
+                data["content"] = f"{data['id']}/image"
+            else:
+                # the image bytes are stored in binary, a single post still sends them as base64 content
+                data["content"] = base64.b64encode(instance.image.data).decode()
         return data
     
 class CommentSerializer(serializers.ModelSerializer):
@@ -113,14 +139,16 @@ class CommentSerializer(serializers.ModelSerializer):
         model = Comment
         fields = ['type', 'id', 'author', 'comment', 'contentType', 'published', 'post']
         read_only_fields = ['type', 'id', 'published']
+        list_serializer_class = PrefetchListSerializer
+        prefetch_related = ['author', 'post__author']
     
     def to_representation(self, instance):
         data = super().to_representation(instance)
         request = self.context.get('request')
-        current_url = f"{request.build_absolute_uri('/')}api/authors/{instance.post.author.id}/posts/{instance.post.id}/comments"
+        current_url = f"{request.build_absolute_uri('/')}api/authors/{instance.post.author_id}/posts/{instance.post_id}/comments"
         data["author"] = AuthorSerializer(instance.author, context=self.context).data
         data["id"] = f"{current_url}/{instance.id}"
-        data["post"] = PostSerializer(instance.post, context=self.context).data
+        data["post"] = PostSerializer(instance.post, context={**self.context, 'image_urls': True}).data
         return data
 
 class LikeSerializer(serializers.ModelSerializer):
@@ -128,6 +156,8 @@ class LikeSerializer(serializers.ModelSerializer):
         model = Like
         fields = [ 'type', 'summary', 'author', 'post', 'object']
         read_only_fields = ['type']
+        list_serializer_class = PrefetchListSerializer
+        prefetch_related = ['author', 'post__author']
     
     def to_representation(self, instance):
         data = super().to_representation(instance)
@@ -135,10 +165,10 @@ class LikeSerializer(serializers.ModelSerializer):
         request = self.context.get('request')
         if instance.post:
             if data['object'] == None or data['object'] == '':
-                data["object"] = f"{request.build_absolute_uri('/')}api/authors/{instance.post.author.id}/posts/{instance.post.id}"
+                data["object"] = f"{request.build_absolute_uri('/')}api/authors/{instance.post.author_id}/posts/{instance.post_id}"
             if data['summary'] == None or data['summary'] == '':
-                data['summary'] = f"{instance.author.displayName} liked the post"
-            data["post"] = PostSerializer(instance.post, context=self.context).data
+                data['summary'] = f"{instance.author.display_name} liked the post"
+            data["post"] = PostSerializer(instance.post, context={**self.context, 'image_urls': True}).data
         else:
             data["object"] = None
         return data
@@ -0,0 +1,108 @@
+import logging
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models import QuerySet
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .consumers import get_inbox_group
+from .counters import change_post_counter
+from .metrics import install_query_wrapper
+from .models import Author, Comment, Follower, Image, Inbox, Like, Node, Post
+from .nodes import invalidate_node_registry
+from .search import index_authors
+from .timeline import fan_out_post, follow_added, follow_removed
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(connection_created)
+def database_connected(sender, connection, **kwargs):
+    # the SQL of every request is counted for the metrics (see api/metrics.py)
+    install_query_wrapper(connection)
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, **kwargs):
+    # new posts are written into their readers' home feeds, edited posts only change them with their visibility
+    if created or instance.visibility != getattr(instance, '_saved_visibility', None):
+        fan_out_post(instance)
+    instance._saved_visibility = instance.visibility
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    # the image of a deleted post goes with it, unless another post has the same image
+    if instance.image_id:
+        Image.objects.delete_unused([instance.image_id])
+
+
+@receiver(post_save, sender=Author)
+def author_saved(sender, instance, update_fields=None, **kwargs):
+    # the search index only changes with the name, github or kind of author, a login only saves last_login
+    if update_fields is not None and not {'display_name', 'github', 'is_remote', 'is_staff'} & set(update_fields):
+        return
+    index_authors([instance])
+
+
+@receiver(post_save, sender=Follower)
+def follower_saved(sender, instance, created, **kwargs):
+    if created:
+        follow_added(instance.follower, instance.followed_user)
+
+
+@receiver(post_delete, sender=Follower)
+def follower_deleted(sender, instance, **kwargs):
+    follow_removed(instance.follower, instance.followed_user)
+
+
+@receiver(post_save, sender=Node)
+@receiver(post_delete, sender=Node)
+def node_changed(sender, instance, **kwargs):
+    # every process reloads its node registry
+    invalidate_node_registry()
+
+
+@receiver(post_save, sender=Inbox)
+def inbox_saved(sender, instance, created, **kwargs):
+    if not created:
+        return
+
+    def push():
+        # push the new item to the author's open websockets (see api/consumers.py)
+        try:
+            async_to_sync(get_channel_layer().group_send)(get_inbox_group(instance.author_id), {"type": "inbox.item", "item": instance.item})
+        except Exception as e:
+            logger.warning("Inbox push failed: %s", e)
+
+    transaction.on_commit(push)
+
+
+def _deleting_post(origin):
+    # the comments and likes of a deleted post go with it, there is no counter left to change
+    return isinstance(origin, Post) or (isinstance(origin, QuerySet) and origin.model is Post)
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, **kwargs):
+    if created:
+        change_post_counter(instance.post_id, "count", 1)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, origin=None, **kwargs):
+    if not _deleting_post(origin):
+        change_post_counter(instance.post_id, "count", -1)
+
+
+@receiver(post_save, sender=Like)
+def like_saved(sender, instance, created, **kwargs):
+    if created:
+        change_post_counter(instance.post_id, "likeCount", 1)
+
+
+@receiver(post_delete, sender=Like)
+def like_deleted(sender, instance, origin=None, **kwargs):
+    if not _deleting_post(origin):
+        change_post_counter(instance.post_id, "likeCount", -1)
@@ -0,0 +1,320 @@
+import base64
+import hashlib
+import io
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta, timezone as dt_timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+from PIL import Image as PILImage
+from .models import Node
+
+# A stand-in federation node for benchmarks (manage.py stub_node, manage.py bench_federation).
+# It answers the same api as the other teams' nodes (authors, posts, comments, likes, followers, inbox, image)
+# from a generated set of authors and posts, so how the federation paths behave with slow or failing peers can be
+# measured without them:
+#   - every answer waits for a delay drawn from a latency spec: "fixed:MS", "uniform:MIN_MS,MAX_MS",
+#     "lognormal:MEDIAN_MS,SIGMA" or "exp:MEAN_MS"
+#   - error_rate of the requests get a 500, drop_rate of them have their connection closed without an answer
+#   - pagination is "paged" (page and size are honoured), "ignored" (every page is the whole list, like the nodes that
+#     don't page) or "strict" (a page past the end is a 404, like Django's Paginator)
+#   - GETs have an ETag and are answered with a 304 when it matches, like a node behind a caching proxy
+
+STUB_USERNAME = "stub"
+STUB_PASSWORD = "stub"
+PAGINATIONS = ("paged", "ignored", "strict")
+
+_LATENCY_SPEC = re.compile(r"^(fixed|uniform|lognormal|exp):([\d.]+)(?:,([\d.]+))?$")
+
+
+def parse_latency(spec):
+    """
+    Turn a latency spec into a function that draws a delay in seconds from a random.Random
+    """
+    match = _LATENCY_SPEC.match(spec.strip())
+    if match is None:
+        raise ValueError(f"Invalid latency {spec!r}, expected fixed:MS, uniform:MIN_MS,MAX_MS, lognormal:MEDIAN_MS,SIGMA or exp:MEAN_MS")
+    kind, first, second = match.group(1), float(match.group(2)), match.group(3)
+    if kind in ("uniform", "lognormal") and second is None:
+        raise ValueError(f"Invalid latency {spec!r}, {kind} takes two values")
+    if kind == "fixed":
+        return lambda rng: first / 1000
+    if kind == "uniform":
+        return lambda rng: rng.uniform(first, float(second)) / 1000
+    if kind == "lognormal":
+        # lognormvariate's mu is the log of the median
+        mu = math.log(first) if first > 0 else 0
+        return lambda rng: (rng.lognormvariate(mu, float(second)) if first > 0 else 0) / 1000
+    return lambda rng: (rng.expovariate(1 / first) if first > 0 else 0) / 1000
+
+
+class StubNode:
+    """
+    A node serving generated authors and posts on a local port, in a background thread
+    """
+    def __init__(self, team_name="stub node", authors=10, posts_per_author=20, latency="fixed:0", error_rate=0.0, drop_rate=0.0,
+                 content_bytes=500, image_bytes=20000, pagination="paged", bind="127.0.0.1", port=0, seed=0):
+        if pagination not in PAGINATIONS:
+            raise ValueError(f"Invalid pagination {pagination!r}, expected one of {', '.join(PAGINATIONS)}")
+        self.team_name = team_name
+        self.latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.pagination = pagination
+        self.bind = bind
+        self.port = port
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self._server = None
+        self.url = None
+        # requests served, by kind of answer
+        self.stats = {"requests": 0, "ok": 0, "not_modified": 0, "errors": 0, "dropped": 0, "not_found": 0, "inbox": 0}
+        self._stats_lock = threading.Lock()
+        # the latest activities posted to the inboxes
+        self.inbox = deque(maxlen=1000)
+
+        self._author_count = authors
+        self._posts_per_author = posts_per_author
+        self._content_bytes = content_bytes
+        self._image_bytes = image_bytes
+        self._image = None
+
+    # data
+
+    def _generate(self):
+        rng = random.Random(self._rng.random())
+        api_url = self.api_url
+        now = datetime.now(dt_timezone.utc)
+        self.authors = {}
+        self.posts = {}
+        for i in range(self._author_count):
+            author_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+            self.authors[author_id] = {
+                "type": "author", "id": f"{api_url}authors/{author_id}", "url": f"{api_url}authors/{author_id}",
+                "host": self.url, "displayName": f"{self.team_name} author {i}", "github": "https://github.com", "profileImage": "",
+            }
+            posts = []
+            for j in range(self._posts_per_author):
+                post_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+                post_url = f"{api_url}authors/{author_id}/posts/{post_id}"
+                posts.append({
+                    "type": "post", "id": post_url, "title": f"stub post {j}", "source": post_url, "origin": post_url,
+                    "description": "a post from a stub node", "contentType": "text/plain",
+                    "content": ("stub " * (self._content_bytes // 5 + 1))[:self._content_bytes],
+                    "author": self.authors[author_id], "count": 0, "comments": f"{post_url}/comments",
+                    "published": (now - timedelta(hours=j, seconds=i)).isoformat(),
+                    "visibility": "FRIENDS" if rng.random() < 0.2 else "PUBLIC",
+                })
+            # newest first, like the posts lists of the nodes
+            self.posts[author_id] = posts
+
+    def _get_image(self):
+        if self._image is None:
+            # random pixels don't compress, so the PNG is about image_bytes
+            side = max(int((self._image_bytes / 3) ** 0.5), 1)
+            buffer = io.BytesIO()
+            PILImage.frombytes("RGB", (side, side), random.Random(0).randbytes(side * side * 3)).save(buffer, format="PNG")
+            self._image = buffer.getvalue()
+        return self._image
+
+    def set_latency(self, latency):
+        self.latency = parse_latency(latency)
+
+    def get_author_ids(self):
+        return list(self.authors)
+
+    # server
+
+    @property
+    def api_url(self):
+        return f"{self.url}api/"
+
+    @property
+    def authorization(self):
+        return base64.b64encode(f"{STUB_USERNAME}:{STUB_PASSWORD}".encode()).decode()
+
+    def start(self):
+        self._server = ThreadingHTTPServer((self.bind, self.port), _StubNodeHandler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        host = "127.0.0.1" if self.bind in ("", "0.0.0.0") else self.bind
+        self.url = f"http://{host}:{self._server.server_address[1]}/"
+        self._generate()
+        threading.Thread(target=self._server.serve_forever, daemon=True, name=f"stub node {self.team_name}").start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def register(self):
+        """
+        Register the stub as a Node, returns it
+        """
+        node, _ = Node.objects.update_or_create(
+            team_name=self.team_name,
+            defaults={"api_url": self.api_url, "host_url": self.url, "base64_authorization": self.authorization, "is_active": True},
+        )
+        return node
+
+    def count(self, kind):
+        with self._stats_lock:
+            self.stats[kind] += 1
+
+    def draw(self):
+        """
+        Draw (delay in seconds, what goes wrong) for a request
+        """
+        with self._rng_lock:
+            delay = self.latency(self._rng)
+            failure = self._rng.random()
+        if failure < self.drop_rate:
+            return delay, "dropped"
+        if failure < self.drop_rate + self.error_rate:
+            return delay, "errors"
+        return delay, None
+
+    def page(self, items, query):
+        """
+        Page a list the way the stub is set to, returns None for a page that doesn't exist
+        """
+        try:
+            page, size = int(query.get("page", ["0"])[0]), int(query.get("size", ["0"])[0])
+        except ValueError:
+            page, size = 0, 0
+        if self.pagination == "ignored" or not (page and size):
+            return items
+        start = (page - 1) * size
+        if self.pagination == "strict" and page > 1 and start >= len(items):
+            return None
+        return items[start:start + size]
+
+    def answer_get(self, path, query):
+        """
+        Returns (status, JSON body or bytes) for a GET of an api path
+        """
+        parts = [unquote(part) for part in path.strip("/").split("/")]
+        if parts[:1] != ["api"]:
+            return 404, {"detail": "not found"}
+        parts = parts[1:]
+        if parts == ["authors"]:
+            items = self.page(list(self.authors.values()), query)
+            return (200, {"type": "authors", "items": items}) if items is not None else (404, {"detail": "invalid page"})
+        if len(parts) < 2 or parts[0] != "authors" or parts[1] not in self.authors:
+            return 404, {"detail": "not found"}
+        author_id, rest = parts[1], parts[2:]
+        if not rest:
+            return 200, self.authors[author_id]
+        if rest == ["followers"]:
+            return 200, {"type": "followers", "items": []}
+        if rest[0] == "followers" and len(rest) >= 2:
+            # every follow sent to the stub is accepted
+            return 200, {"type": "author", "id": rest[1]}
+        if rest == ["liked"]:
+            return 200, {"type": "liked", "items": []}
+        if rest[0] != "posts":
+            return 404, {"detail": "not found"}
+        posts = self.posts[author_id]
+        if len(rest) == 1:
+            items = self.page(posts, query)
+            return (200, {"type": "posts", "items": items}) if items is not None else (404, {"detail": "invalid page"})
+        post = next((post for post in posts if post["id"].endswith(f"/{rest[1]}")), None)
+        if post is None:
+            return 404, {"detail": "not found"}
+        if len(rest) == 2:
+            return 200, post
+        if rest[2:] == ["comments"]:
+            return 200, {"type": "comments", "page": 1, "size": 0, "post": post["id"], "id": post["comments"], "comments": []}
+        if rest[2:] == ["likes"]:
+            return 200, {"type": "likes", "items": []}
+        if rest[2:] == ["image"]:
+            return 200, self._get_image()
+        return 404, {"detail": "not found"}
+
+
+class _StubNodeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _respond(self, status, body, content_type="application/json", etag=None):
+        content = body if isinstance(body, bytes) else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        if etag:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _start(self):
+        """
+        Wait out the request's delay, returns False if the request was answered with a failure
+        """
+        stub = self.server.stub
+        stub.count("requests")
+        delay, failure = stub.draw()
+        if delay:
+            time.sleep(delay)
+        if failure == "dropped":
+            stub.count("dropped")
+            self.close_connection = True
+            self.connection.close()
+            return False
+        if failure == "errors":
+            stub.count("errors")
+            self._respond(500, {"detail": "stub node error"})
+            return False
+        if self.headers.get("Authorization") != f"Basic {stub.authorization}":
+            stub.count("errors")
+            self._respond(401, {"detail": "Authentication credentials were not provided."})
+            return False
+        return True
+
+    def do_GET(self):
+        if not self._start():
+            return
+        stub = self.server.stub
+        url = urlsplit(self.path)
+        status, body = stub.answer_get(url.path, parse_qs(url.query))
+        if status != 200:
+            stub.count("not_found")
+            self._respond(status, body)
+            return
+        content = body if isinstance(body, bytes) else json.dumps(body).encode()
+        etag = f'"{hashlib.sha1(content).hexdigest()}"'
+        if self.headers.get("If-None-Match") == etag:
+            stub.count("not_modified")
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        stub.count("ok")
+        self._respond(200, body, "image/png" if isinstance(body, bytes) else "application/json", etag)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = self.rfile.read(length)
+        if not self._start():
+            return
+        stub = self.server.stub
+        if urlsplit(self.path).path.rstrip("/").endswith("/inbox"):
+            stub.count("inbox")
+            try:
+                stub.inbox.append(json.loads(payload or b"null"))
+            except ValueError:
+                pass
+            self._respond(201, {"detail": "received"})
+            return
+        stub.count("ok")
+        self._respond(201, json.loads(payload or b"{}") if payload else {})
+
+    def log_message(self, *args):
+        pass
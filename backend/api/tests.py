@@ -1,8 +1,33 @@
-from django.test import TestCase
+from django.test import RequestFactory, TestCase, TransactionTestCase
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.routing import URLRouter
+from asgiref.testing import ApplicationCommunicator
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-import json, base64
-
-from .models import Author, Post, Comment, Like, FollowRequest, Follower
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json, base64, hashlib, io, logging, os, random, requests, subprocess, sys, tempfile, threading, time, unittest.mock, uuid
+from PIL import Image as PILImage
+from urllib.parse import quote
+
+from .models import Author, Post, Comment, Like, FollowRequest, Follower, Inbox, Node, Outbox, Timeline, Image, RemotePost, RemotePostSync, RemoteAuthor, RemoteAuthorSync
+from .routing import websocket_urlpatterns
+from . import async_views, benchmark, breaker, metrics, nodes, outbox, utils, views
+from .outbox import deliver_outbox
+from .reconcile import reconcile_follow_state
+from .mirror import sync_remote_posts, get_mirrored_posts, MIRRORED_API_URL
+from .directory import refresh_remote_authors
+from .log import SAMPLED, QueueLogHandler, StructuredFormatter
+from .pagination import keyset_filter
+from .stubnode import StubNode, parse_latency
+from .search import rebuild_author_search
+from .relationships import RelationshipResolver, get_relationships
 
 # Create your tests here.
 
@@ -54,6 +79,62 @@ def create_follower(follower, followee):
     """
     return Follower.objects.create(follower=follower, followed_user=followee)
 
+def start_remote_node(routes):
+    """
+    starts a local http server that plays the part of a remote node.
+    routes maps a path to a (status, body) or (status, body, delay in seconds) tuple, a bytes body is sent as a png,
+    every request is recorded in server.received
+    """
+    class RemoteNodeHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            self.server.received.append(("GET", self.path, dict(self.headers)))
+            status, body, *delay = routes.get(self.path, (404, {"detail": "not found"}))
+            if delay:
+                time.sleep(delay[0])
+            content = body if isinstance(body, bytes) else json.dumps(body).encode()
+            etag = f'"{hashlib.sha1(content).hexdigest()}"'
+            if status == 200 and self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(status)
+            self.send_header("Content-Type", "image/png" if isinstance(body, bytes) else "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.send_header("ETag", etag)
+            self.end_headers()
+            self.wfile.write(content)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            self.server.received.append(("POST", self.path, json.loads(self.rfile.read(length) or b"null")))
+            status, body = routes.get(self.path, (201, {}))
+            content = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RemoteNodeHandler)
+    server.received = []
+    server.url = f"http://127.0.0.1:{server.server_address[1]}/"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def create_node(server, team_name="remote team"):
+    """
+    registers the given local server as a remote node
+    """
+    return Node.objects.create(team_name=team_name, api_url=f"{server.url}api/", host_url=server.url,
+                               base64_authorization=base64.b64encode(b"user:pass").decode())
+
 class UserCreation(TestCase):
     def test_create_a_user(self):
         """
@@ -1352,4 +1433,1914 @@ class CommentTests(TestCase):
         item0 = items[0]
 
         assert item0["author"]["displayName"] == comment1.author.display_name
-        assert item0["comment"] == comment1.comment
\ No newline at end of file
+        assert item0["comment"] == comment1.comment
+
+
+class FederationClientTests(TestCase):
+    def setUp(self):
+        utils._sessions.clear()
+        breaker._breakers.clear()
+        cache.clear()
+        self.server = start_remote_node({"/api/authors/": (200, {"type": "authors", "items": []})})
+        self.node = create_node(self.server)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_remote_calls_reuse_pooled_connection(self):
+        """
+            tests that repeated calls to the same node go through one kept-alive connection
+        """
+        with self.settings(FEDERATION_CACHE_TTLS=[]):
+            for i in range(3):
+                response = utils.get_request_remote(host_url=self.server.url, path="authors/")
+                self.assertEqual(response.status_code, 200)
+
+        method, path, headers = self.server.received[0]
+        assert headers["Authorization"] == f"Basic {self.node.base64_authorization}"
+        assert "gzip" in headers["Accept-Encoding"]
+
+        stats = utils.get_session_stats()[str(self.node.id)]
+        self.assertEqual(stats["requests"], 3)
+        self.assertEqual(stats["connections"], 1)
+        self.assertEqual(stats["reused"], 2)
+
+    def test_remote_calls_time_out(self):
+        """
+            tests that a node that never answers does not block the request forever
+        """
+        with self.settings(FEDERATION_READ_TIMEOUT=0.2):
+            with unittest.mock.patch.object(self.server.RequestHandlerClass, "do_GET", lambda handler: threading.Event().wait(1)):
+                response = utils.get_request_remote(host_url=self.server.url, path="authors/")
+        self.assertIsNone(response)
+
+
+class RemoteCacheTests(TestCase):
+    def setUp(self):
+        utils._sessions.clear()
+        breaker._breakers.clear()
+        cache.clear()
+        self.routes = {"/api/authors/": (200, {"type": "authors", "items": [{"displayName": "remote author"}]})}
+        self.server = start_remote_node(self.routes)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        create_node(self.server)
+
+    def test_fresh_response_served_from_cache(self):
+        """
+            tests that a fresh cached response is served without asking the node again
+        """
+        first = utils.get_request_remote(host_url=self.server.url, path="authors/")
+        second = utils.get_request_remote(host_url=self.server.url, path="authors/")
+        self.assertEqual(len(self.server.received), 1)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.json(), first.json())
+
+    def test_expired_response_revalidated_with_etag(self):
+        """
+            tests that an expired response is revalidated with If-None-Match and reused on a 304
+        """
+        with self.settings(FEDERATION_CACHE_TTLS=[(r'^authors/$', 0.05)], FEDERATION_CACHE_STALE_TTL=0):
+            first = utils.get_request_remote(host_url=self.server.url, path="authors/")
+            time.sleep(0.1)
+            second = utils.get_request_remote(host_url=self.server.url, path="authors/")
+
+        self.assertEqual(len(self.server.received), 2)
+        method, path, headers = self.server.received[1]
+        self.assertEqual(headers["If-None-Match"], first.headers["ETag"])
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.json(), first.json())
+
+    def test_large_response_not_cached(self):
+        """
+            tests that a response bigger than the per entry limit is fetched every time instead of kept in memory
+        """
+        with self.settings(FEDERATION_CACHE_MAX_ENTRY_BYTES=10):
+            for i in range(2):
+                response = utils.get_request_remote(host_url=self.server.url, path="authors/")
+                self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.server.received), 2)
+
+    def test_not_found_is_cached_briefly(self):
+        """
+            tests that 404s are remembered so a missing path is not requested over and over
+        """
+        path = "authors/missing-author/posts/"
+        for i in range(3):
+            response = utils.get_request_remote(host_url=self.server.url, path=path)
+            self.assertEqual(response.status_code, 404)
+        self.assertEqual(len([request for request in self.server.received if request[1] == f"/api/{path}"]), 1)
+
+    def test_stale_response_refreshed_in_background(self):
+        """
+            tests that a stale response is served right away while a single refresh runs in the background
+        """
+        with self.settings(FEDERATION_CACHE_TTLS=[(r'^authors/$', 0.05)], FEDERATION_CACHE_STALE_TTL=60):
+            utils.get_request_remote(host_url=self.server.url, path="authors/")
+            time.sleep(0.1)
+            self.routes["/api/authors/"] = (200, {"type": "authors", "items": []}, 0.2)
+            stale = [utils.get_request_remote(host_url=self.server.url, path="authors/") for i in range(3)]
+            time.sleep(0.5)
+            refreshed = utils.get_request_remote(host_url=self.server.url, path="authors/")
+
+        for response in stale:
+            self.assertEqual(response.json()["items"], [{"displayName": "remote author"}])
+        self.assertEqual(refreshed.json()["items"], [])
+        self.assertEqual(len(self.server.received), 2)
+
+
+def create_remote_author(server, name):
+    """
+    creates a local copy of an author that lives on the given remote node
+    """
+    author_id = uuid.uuid4()
+    return Author.objects.create(id=author_id, host=server.url, url=f"{server.url}api/authors/{author_id}",
+                                 display_name=name, github="https://github.com", is_remote=True)
+
+def first_posts_page(author):
+    """
+    the path the mirror sync asks an author's node for first
+    """
+    return f"/api/authors/{author.id}/posts/?page=1&size={settings.REMOTE_POST_SYNC_PAGE_SIZE}"
+
+def remote_post(author, title, visibility):
+    """
+    creates the json of a post the way a remote node would serve it
+    """
+    post_id = f"{author.url}/posts/{uuid.uuid4()}"
+    return {"type": "post", "id": post_id, "source": post_id, "origin": post_id, "title": title, "description": "",
+            "contentType": "text/plain", "content": "remote content", "visibility": visibility,
+            "author": {"type": "author", "id": author.url, "host": author.host, "displayName": author.display_name}}
+
+
+class RemoteFeedTests(TestCase):
+    def setUp(self):
+        utils._sessions.clear()
+        breaker._breakers.clear()
+        cache.clear()
+        user = create_author("test@test.ca", "test user", "https://github.com", "", "12345")
+        self.client.post(reverse("api:register"), user)
+        self.author = Author.objects.get(display_name="test user")
+        set_active(self.author)
+        self.client.post(reverse("api:login"), user)
+
+    def start_node(self, routes):
+        server = start_remote_node(routes)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        create_node(server)
+        return server
+
+    def test_remote_posts_fetched_once_per_author(self):
+        """
+            tests that a remote friend's posts are mirrored once and split into public and friends only posts in the feed
+        """
+        routes = {}
+        server = self.start_node(routes)
+        friend = create_remote_author(server, "remote friend")
+        followed = create_remote_author(server, "remote followed")
+        create_follower(self.author, friend)
+        create_follower(friend, self.author)
+        create_follower(self.author, followed)
+        routes[first_posts_page(friend)] = (200, {"items": [remote_post(friend, "friend public", "PUBLIC"), remote_post(friend, "friend only", "FRIENDS")]})
+        routes[first_posts_page(followed)] = (200, {"items": [remote_post(followed, "followed public", "PUBLIC"), remote_post(followed, "not a friend", "FRIENDS")]})
+
+        sync_remote_posts()
+        fetched = sorted(path for method, path, headers in server.received)
+        self.assertEqual(fetched, sorted([first_posts_page(friend), first_posts_page(followed)]))
+
+        response = self.client.get(reverse("api:get_all_friends_follows_posts", kwargs={"id_author": self.author.id}))
+        self.assertEqual(response.status_code, 200)
+        result = json.loads(response.content)
+        titles = sorted(item["title"] for item in result["items"])
+        self.assertEqual(titles, ["followed public", "friend only", "friend public"])
+        assert "partial" not in result
+        # the feed itself never calls the node
+        self.assertEqual(len(server.received), 2)
+
+    def test_slow_remote_author_makes_feed_partial(self):
+        """
+            tests that an author whose node missed the sync deadline is left out of the feed, which is marked partial
+        """
+        routes = {}
+        server = self.start_node(routes)
+        fast = create_remote_author(server, "fast author")
+        slow = create_remote_author(server, "slow author")
+        create_follower(self.author, fast)
+        create_follower(self.author, slow)
+        routes[first_posts_page(fast)] = (200, {"items": [remote_post(fast, "fast post", "PUBLIC")]})
+        routes[first_posts_page(slow)] = (200, {"items": [remote_post(slow, "slow post", "PUBLIC")]}, 1)
+
+        with self.settings(REMOTE_POST_SYNC_DEADLINE=0.3):
+            sync_remote_posts()
+        response = self.client.get(reverse("api:get_all_friends_follows_posts", kwargs={"id_author": self.author.id}))
+        self.assertEqual(response.status_code, 200)
+        result = json.loads(response.content)
+        self.assertEqual([item["title"] for item in result["items"]], ["fast post"])
+        assert result["partial"] is True
+
+
+class RemotePostMirrorTests(TestCase):
+    def setUp(self):
+        utils._sessions.clear()
+        breaker._breakers.clear()
+        cache.clear()
+        self.author = Author.objects.create(email="author@test.ca", display_name="author", github="https://github.com", password="12345")
+        set_active(self.author)
+        self.routes = {}
+        self.server = start_remote_node(self.routes)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        create_node(self.server)
+        self.remote = create_remote_author(self.server, "remote author")
+        create_follower(self.author, self.remote)
+
+    def posts(self, *titles):
+        """
+            remote public posts, newest first
+        """
+        now = timezone.now()
+        return [dict(remote_post(self.remote, title, "PUBLIC"), published=(now - timezone.timedelta(minutes=i)).isoformat()) for i, title in enumerate(titles)]
+
+    def page(self, number):
+        return f"/api/authors/{self.remote.id}/posts/?page={number}&size=2"
+
+    def fetched(self):
+        paths = [path for method, path, headers in self.server.received]
+        self.server.received.clear()
+        return paths
+
+    def sync(self):
+        with self.settings(REMOTE_POST_SYNC_PAGE_SIZE=2, REMOTE_POST_SYNC_INTERVAL=0):
+            return sync_remote_posts()
+
+    def mirrored_titles(self):
+        return [post.data["title"] for post in RemotePost.objects.filter(author=self.remote)]
+
+    def test_incremental_sync(self):
+        """
+            tests that the first sync pages through everything, an unchanged author costs one 304,
+            and new posts are read newest first until the mirrored ones are reached
+        """
+        third, second, first = self.posts("third", "second", "first")
+        self.routes[self.page(1)] = (200, {"items": [third, second]})
+        self.routes[self.page(2)] = (200, {"items": [first]})
+        self.assertEqual(self.sync()["posts"], 3)
+        self.assertEqual(self.fetched(), [self.page(1), self.page(2)])
+        self.assertEqual(self.mirrored_titles(), ["third", "second", "first"])
+
+        result = self.sync()
+        self.assertEqual(result["unchanged"], 1)
+        self.assertEqual(self.fetched(), [self.page(1)])
+
+        newest = dict(remote_post(self.remote, "newest", "PUBLIC"), published=timezone.now().isoformat())
+        self.routes[self.page(1)] = (200, {"items": [newest, third]})
+        self.routes[self.page(2)] = (200, {"items": [second, first]})
+        self.sync()
+        # the first page reached "third", which was already mirrored, so the second page isn't read
+        self.assertEqual(self.fetched(), [self.page(1)])
+        self.assertEqual(self.mirrored_titles(), ["newest", "third", "second", "first"])
+
+    def test_deleted_posts_and_unfollowed_authors_are_dropped(self):
+        """
+            tests that a complete first page removes the posts deleted on the node, and that unfollowing drops the mirror
+        """
+        kept, deleted = self.posts("kept", "deleted")
+        self.routes[self.page(1)] = (200, {"items": [kept, deleted]})
+        self.routes[self.page(2)] = (200, {"items": []})
+        self.sync()
+        self.routes[self.page(1)] = (200, {"items": [kept]})
+        self.sync()
+        self.assertEqual(self.mirrored_titles(), ["kept"])
+
+        Follower.objects.filter(follower=self.author, followed_user=self.remote).delete()
+        self.sync()
+        self.assertEqual(RemotePost.objects.count(), 0)
+        self.assertEqual(RemotePostSync.objects.count(), 0)
+
+    def test_remote_profile_read_from_mirror(self):
+        """
+            tests that the posts of a mirrored author are served without calling their node, even when it is down
+        """
+        self.routes[self.page(1)] = (200, {"items": self.posts("mirrored")})
+        self.sync()
+        self.fetched()
+        self.server.shutdown()
+
+        request = RequestFactory().get(f"/api/authors/{self.remote.id}/posts/")
+        request._force_auth_user = self.author
+        for view in (views.get_and_create_post, async_to_sync(async_views.get_and_create_post)):
+            response = view(request, id_author=self.remote.id)
+            if hasattr(response, "render"):
+                response.render()
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([post["title"] for post in json.loads(response.content)["items"]], ["mirrored"])
+        self.assertEqual(self.fetched(), [])
+
+    def test_images_rewritten_when_stored(self):
+        """
+            tests that the markdown images of a mirrored post are rewritten once when it is stored, and read with the
+            api url of the host the request came in on
+        """
+        image = f"{self.remote.url}/posts/1/image"
+        post = dict(self.posts("with image")[0], contentType="text/markdown", content=f"![image]({image})")
+        self.routes[self.page(1)] = (200, {"items": [post]})
+        self.sync()
+        stored = RemotePost.objects.get(author=self.remote).data["content"]
+        self.assertEqual(stored, f"![image]({MIRRORED_API_URL}{image.split('/api/', 1)[1]})")
+
+        request = RequestFactory().get("/api/", HTTP_HOST="ours.example.com")
+        with unittest.mock.patch("api.mirror.rewrite_image_urls") as rewrite:
+            posts = get_mirrored_posts(request, [self.remote.id])
+        rewrite.assert_not_called()
+        self.assertEqual(posts[0]["content"], f"![image](http://ours.example.com/api/{image.split('/api/', 1)[1]})")
+
+
+class OutboxTests(TestCase):
+    def setUp(self):
+        utils._sessions.clear()
+        breaker._breakers.clear()
+        cache.clear()
+        self.routes = {}
+        self.server = start_remote_node(self.routes)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.node = create_node(self.server)
+
+        user = create_author("test@test.ca", "test user", "https://github.com", "", "12345")
+        self.client.post(reverse("api:register"), user)
+        self.author = Author.objects.get(display_name="test user")
+        set_active(self.author)
+        self.client.post(reverse("api:login"), user)
+
+    def test_post_queued_for_remote_followers(self):
+        """
+            tests that creating a public post queues it for remote followers instead of sending it right away
+        """
+        follower1 = create_remote_author(self.server, "remote follower 1")
+        follower2 = create_remote_author(self.server, "remote follower 2")
+        create_follower(follower1, self.author)
+        create_follower(follower2, self.author)
+        # the first follower's inbox is down, which must not stop the post from being created
+        self.routes[f"/api/authors/{follower1.id}/inbox"] = (500, {})
+
+        post = {"title": "queued post", "description": "queued", "contentType": "text/plain", "content": "content", "visibility": "PUBLIC"}
+        response = self.client.post(reverse("api:get_and_create_post", kwargs={"id_author": self.author.id}), json.dumps(post), content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.server.received, [])
+        self.assertEqual(Outbox.objects.filter(status="PENDING").count(), 2)
+
+        self.assertEqual(deliver_outbox(), 2)
+        sent = Outbox.objects.get(request_url=f"{self.node.api_url}authors/{follower2.id}/inbox")
+        self.assertEqual(sent.status, "SENT")
+        self.assertEqual(sent.payload["items"][0]["title"], "queued post")
+
+        # the failed delivery is retried later with backoff
+        failed = Outbox.objects.get(request_url=f"{self.node.api_url}authors/{follower1.id}/inbox")
+        self.assertEqual(failed.status, "PENDING")
+        self.assertEqual(failed.attempts, 1)
+        self.assertEqual(failed.last_status_code, 500)
+        assert failed.next_attempt_at > failed.created_at
+        self.assertEqual(deliver_outbox(), 0)
+
+    def test_rejected_delivery_not_retried(self):
+        """
+            tests that a delivery the remote node rejects is marked as failed instead of retried
+        """
+        follower = create_remote_author(self.server, "remote follower")
+        self.routes[f"/api/authors/{follower.id}/inbox"] = (400, {"detail": "bad item"})
+        delivery = Outbox.objects.create(node=self.node, request_url=f"{self.node.api_url}authors/{follower.id}/inbox", payload={"type": "like"})
+
+        deliver_outbox()
+        delivery.refresh_from_db()
+        self.assertEqual(delivery.status, "FAILED")
+        self.assertEqual(delivery.last_status_code, 400)
+
+    def test_delivery_claimed_by_one_worker(self):
+        """
+            tests that a delivery another worker claimed isn't sent again while the first worker sends it
+        """
+        follower = create_remote_author(self.server, "remote follower")
+        inbox = f"/api/authors/{follower.id}/inbox"
+        self.routes[inbox] = (200, {})
+        Outbox.objects.create(node=self.node, request_url=f"{self.node.api_url}{inbox[5:]}", payload={"type": "like"})
+
+        # a second worker runs between the first worker's claim and its sending
+        second_worker = []
+        claim_deliveries = outbox.claim_deliveries
+        def claim_then_run_second_worker(batch_size):
+            due = claim_deliveries(batch_size)
+            if not second_worker:
+                second_worker.append(None)
+                second_worker[0] = deliver_outbox()
+            return due
+
+        with unittest.mock.patch("api.outbox.claim_deliveries", claim_then_run_second_worker):
+            self.assertEqual(deliver_outbox(), 1)
+        self.assertEqual(second_worker, [0])
+        self.assertEqual([(method, path) for method, path, _ in self.server.received], [("POST", inbox)])
+        self.assertEqual(Outbox.objects.get().status, "SENT")
+
+
+class TimelineTests(TestCase):
+    def setUp(self):
+        self.authors = []
+        for i in range(3):
+            user = create_author(f"test{i}@test.ca", f"test user{i}", "https://github.com", "", "12345")
+            self.client.post(reverse("api:register"), user)
+            author = Author.objects.get(display_name=f"test user{i}")
+            set_active(author)
+            self.authors.append(author)
+        self.client.post(reverse("api:login"), create_author("test0@test.ca", "test user0", "https://github.com", "", "12345"))
+
+    def get_feed_titles(self, author):
+        response = self.client.get(reverse("api:get_all_friends_follows_posts", kwargs={"id_author": author.id}))
+        self.assertEqual(response.status_code, 200)
+        return [item["title"] for item in json.loads(response.content)["items"]]
+
+    def test_posts_fanned_out_by_visibility(self):
+        """
+            tests that followers get public posts and only friends get friends only posts, newest first
+        """
+        reader, friend, followed = self.authors
+        create_follower(reader, friend)
+        create_follower(friend, reader)
+        create_follower(reader, followed)
+
+        create_post("friend public", '', '', "1", "text/plain", "content", friend, "0", "", "PUBLIC")
+        create_post("friend only", '', '', "2", "text/plain", "content", friend, "0", "", "FRIENDS")
+        create_post("followed only", '', '', "3", "text/plain", "content", followed, "0", "", "FRIENDS")
+        create_post("followed unlisted", '', '', "4", "text/plain", "content", followed, "0", "", "UNLISTED")
+        create_post("followed public", '', '', "5", "text/plain", "content", followed, "0", "", "PUBLIC")
+        create_post("own friends only", '', '', "6", "text/plain", "content", reader, "0", "", "FRIENDS")
+
+        self.assertEqual(self.get_feed_titles(reader), ["own friends only", "followed public", "friend only", "friend public"])
+
+    def test_timeline_follows_graph_and_visibility_changes(self):
+        """
+            tests that the timeline is backfilled on follow and pruned on unfollow and visibility change
+        """
+        reader, friend, followed = self.authors
+        public_post = create_post("public", '', '', "1", "text/plain", "content", followed, "0", "", "PUBLIC")
+        create_post("friends only", '', '', "2", "text/plain", "content", followed, "0", "", "FRIENDS")
+
+        follow = create_follower(reader, followed)
+        self.assertEqual(self.get_feed_titles(reader), ["public"])
+
+        # becoming friends brings in the friends only posts
+        create_follower(followed, reader)
+        self.assertEqual(sorted(self.get_feed_titles(reader)), ["friends only", "public"])
+
+        public_post.visibility = "UNLISTED"
+        public_post.save()
+        self.assertEqual(self.get_feed_titles(reader), ["friends only"])
+
+        follow.delete()
+        self.assertEqual(self.get_feed_titles(reader), [])
+        self.assertFalse(Timeline.objects.filter(owner=reader).exists())
+
+    def test_fan_out_on_create_and_visibility_change(self):
+        """
+            tests that a post is only fanned out when it is created or its visibility changes, not on every edit
+        """
+        with unittest.mock.patch("api.signals.fan_out_post") as fan_out:
+            response = self.client.post(reverse("api:get_and_create_post", kwargs={"id_author": self.authors[0].id}), json.dumps({
+                "title": "post", "description": "post", "contentType": "text/plain", "content": "content", "visibility": "PUBLIC",
+            }), content_type="application/json")
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(fan_out.call_count, 1)
+
+            post = Post.objects.get(title="post")
+            post.title = "edited"
+            post.save()
+            self.assertEqual(fan_out.call_count, 1)
+
+            post = Post.objects.get(title="edited")
+            post.visibility = "FRIENDS"
+            post.save()
+            self.assertEqual(fan_out.call_count, 2)
+
+    def test_timeline_pages_with_several_followers(self):
+        """
+            tests that the cursor pages of a feed only hold the reader's entries, when the author has other followers
+        """
+        reader, friend, followed = self.authors
+        other = Author.objects.create(email="other@test.ca", display_name="other", github="https://github.com", password="12345")
+        for follower in (reader, friend, other):
+            create_follower(follower, followed)
+        for i in range(5):
+            create_post(f"p{i}", '', '', "", "text/plain", "content", followed, "0", "", "PUBLIC")
+
+        titles, cursor = [], ""
+        while cursor is not None:
+            response = self.client.get(reverse("api:get_all_friends_follows_posts", kwargs={"id_author": reader.id}), {"cursor": cursor, "size": 3})
+            self.assertEqual(response.status_code, 200)
+            titles.append([item["title"] for item in response.json()["items"]])
+            cursor = response.json()["next"]
+        self.assertEqual(titles, [["p4", "p3", "p2"], ["p1", "p0"]])
+
+    def test_popular_author_pulled_on_read(self):
+        """
+            tests that posts of authors with too many followers are read directly instead of fanned out
+        """
+        reader, friend, followed = self.authors
+        with self.settings(TIMELINE_FANOUT_LIMIT=1):
+            create_follower(reader, followed)
+            create_follower(friend, followed)
+            create_post("popular post", '', '', "1", "text/plain", "content", followed, "0", "", "PUBLIC")
+            self.assertFalse(Timeline.objects.filter(post__author=followed).exists())
+            self.assertEqual(self.get_feed_titles(reader), ["popular post"])
+
+
+class CursorPaginationTests(TestCase):
+    def setUp(self):
+        user = create_author("test@test.ca", "test user", "https://github.com", "", "12345")
+        self.client.post(reverse("api:register"), user)
+        self.author = Author.objects.get(display_name="test user")
+        set_active(self.author)
+        self.client.post(reverse("api:login"), user)
+
+    def walk_pages(self, url, size):
+        pages = []
+        cursor = ""
+        while cursor is not None:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, {"cursor": cursor, "size": size})
+            self.assertEqual(response.status_code, 200)
+            # keyset pages never skip rows with an OFFSET
+            for query in queries.captured_queries:
+                assert "OFFSET" not in query["sql"]
+            result = json.loads(response.content)
+            pages.append([item["title"] for item in result["items"]])
+            cursor = result["next"]
+        return pages
+
+    def test_public_posts_cursor_pages(self):
+        """
+            tests walking the public posts page by page, including posts published at the same time
+        """
+        posts = [create_post(f"post {i}", '', '', "description", "text/plain", "content", self.author, "0", "", "PUBLIC") for i in range(25)]
+        # give some posts the exact same published time so the id has to break the tie
+        Post.objects.filter(id__in=[post.id for post in posts[5:15]]).update(published=posts[5].published)
+
+        pages = self.walk_pages(reverse("api:get_all_public_posts"), 10)
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        titles = [title for page in pages for title in page]
+        expected = [post.title for post in Post.objects.filter(visibility="PUBLIC").order_by('-published', '-id')]
+        self.assertEqual(titles, expected)
+
+    def test_feed_cursor_pages(self):
+        """
+            tests walking the home feed page by page
+        """
+        followed = Author.objects.create(email="followed@test.ca", display_name="followed", github="https://github.com", password="12345")
+        create_follower(self.author, followed)
+        for i in range(7):
+            create_post(f"post {i}", '', '', "description", "text/plain", "content", followed, "0", "", "PUBLIC")
+
+        pages = self.walk_pages(reverse("api:get_all_friends_follows_posts", kwargs={"id_author": self.author.id}), 3)
+        self.assertEqual(pages, [["post 6", "post 5", "post 4"], ["post 3", "post 2", "post 1"], ["post 0"]])
+
+    def test_invalid_cursor(self):
+        """
+            tests that a cursor we did not make is rejected
+        """
+        response = self.client.get(reverse("api:get_all_public_posts"), {"cursor": "not a cursor"})
+        self.assertEqual(response.status_code, 400)
+
+
+class QueryBudgetTests(TestCase):
+    """
+        Every list endpoint has a fixed query budget: the number of queries may not grow with the number of items
+    """
+    # (url name, query budget)
+    # with ASYNC_FEDERATION_VIEWS the posts, comments and likes views look the author up once more to see if it is remote
+    ASYNC_LOOKUP = 1 if settings.ASYNC_FEDERATION_VIEWS else 0
+    BUDGETS = [
+        ("get_all_public_posts", 3),
+        ("get_and_create_post", 5 + ASYNC_LOOKUP),
+        ("get_all_friends_follows_posts", 7),
+        ("get_followers", 4),
+        ("get_followings", 4),
+        ("get_friends", 4),
+        ("get_received_follow_requests", 4),
+        ("get_sent_follow_requests", 4),
+        ("get_and_create_comment", 5 + ASYNC_LOOKUP),
+        ("get_post_likes", 5 + ASYNC_LOOKUP),
+        ("get_liked", 4),
+    ]
+
+    def setUp(self):
+        user = create_author("test@test.ca", "test user", "https://github.com", "", "12345")
+        self.client.post(reverse("api:register"), user)
+        self.author = Author.objects.get(display_name="test user")
+        set_active(self.author)
+        self.client.post(reverse("api:login"), user)
+        self.post = create_post("liked post", '', '', "description", "text/plain", "content", self.author, "0", "", "PUBLIC")
+        self.others = 0
+
+    def add_items(self, count):
+        """
+            adds count authors that each post, comment, like, follow and send follow requests
+        """
+        for _ in range(count):
+            self.others += 1
+            other = Author.objects.create(email=f"other{self.others}@test.ca", display_name=f"other {self.others}", github="https://github.com", password="12345")
+            create_post(f"post {self.others}", '', '', "description", "text/plain", "content", other, "0", "", "PUBLIC")
+            create_post(f"friends post {self.others}", '', '', "description", "text/plain", "content", other, "0", "", "FRIENDS")
+            create_comment(other, "a comment", self.post)
+            create_like("", other, self.post, "")
+            create_like("", self.author, Post.objects.filter(author=other).first(), "")
+            create_follower(self.author, other)
+            create_follower(other, self.author)
+            create_follow_request(other, self.author)
+            create_follow_request(self.author, other)
+
+    def url(self, name):
+        kwargs = {
+            "get_all_public_posts": {},
+            "get_and_create_post": {"id_author": self.author.id},
+            "get_all_friends_follows_posts": {"id_author": self.author.id},
+            "get_followers": {"id": self.author.id},
+            "get_followings": {"id_author": self.author.id},
+            "get_friends": {"id_author": self.author.id},
+            "get_received_follow_requests": {"id": self.author.id},
+            "get_sent_follow_requests": {"id": self.author.id},
+            "get_and_create_comment": {"id_author": self.author.id, "id_post": self.post.id},
+            "get_post_likes": {"id_author": self.author.id, "id_post": self.post.id},
+            "get_liked": {"id_author": self.author.id},
+        }[name]
+        return reverse(f"api:{name}", kwargs=kwargs)
+
+    def count_queries(self, name):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url(name))
+        self.assertEqual(response.status_code, 200)
+        return len(queries), [query["sql"] for query in queries.captured_queries]
+
+    def test_query_budgets(self):
+        """
+            tests that the list endpoints stay within their budget with few and with many items
+        """
+        self.add_items(2)
+        few = {name: self.count_queries(name)[0] for name, _ in self.BUDGETS}
+        self.add_items(20)
+        for name, budget in self.BUDGETS:
+            count, queries = self.count_queries(name)
+            self.assertLessEqual(count, budget, f"{name} ran {count} queries:\n" + "\n".join(queries))
+            self.assertEqual(count, few[name], f"{name} ran more queries with more items:\n" + "\n".join(queries))
+
+
+class ImageTests(TestCase):
+    IMAGE = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 4
+
+    def setUp(self):
+        user = create_author("test@test.ca", "test user", "https://github.com", "", "12345")
+        self.client.post(reverse("api:register"), user)
+        self.author = Author.objects.get(display_name="test user")
+        set_active(self.author)
+        self.client.post(reverse("api:login"), user)
+
+    def create_image_post(self):
+        post = {
+            "title": "image post",
+            "description": "an image",
+            "contentType": "image/png;base64",
+            "content": "data:image/png;base64," + base64.b64encode(self.IMAGE).decode(),
+            "visibility": "PUBLIC",
+        }
+        response = self.client.post(reverse("api:get_and_create_post", kwargs={"id_author": self.author.id}), json.dumps(post), content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+        return Post.objects.get(id=json.loads(response.content)["id"].split("/")[-1])
+
+    def image_url(self, post):
+        return reverse("api:get_image", kwargs={"id_author": self.author.id, "id_post": post.id})
+
+    def post_url(self, post):
+        return reverse("api:get_update_and_delete_specific_post", kwargs={"id_author": self.author.id, "id_post": post.id})
+
+    def test_image_stored_once_in_binary(self):
+        """
+            tests that image posts keep their bytes once in the image table, a post sends base64 content and lists
+            link to the image without reading it
+        """
+        post = self.create_image_post()
+        self.create_image_post()
+
+        assert post.content == ""
+        self.assertEqual(Image.objects.count(), 1)
+        self.assertEqual(bytes(post.image.data), self.IMAGE)
+
+        response = self.client.get(self.post_url(post))
+        self.assertEqual(base64.b64decode(json.loads(response.content)["content"]), self.IMAGE)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("api:get_and_create_post", kwargs={"id_author": self.author.id}))
+        self.assertFalse([query for query in queries if "api_image" in query["sql"]])
+        for item in json.loads(response.content)["items"]:
+            self.assertEqual(item["content"], f"{item['id']}/image")
+
+    def test_unused_images_deleted(self):
+        """
+            tests that an image is deleted with the last post using it, or when that post changes its image
+        """
+        post = self.create_image_post()
+        other = self.create_image_post()
+        self.client.delete(self.post_url(other))
+        self.assertTrue(Image.objects.filter(hash=post.image_id).exists())
+
+        image = b"\x89PNG\r\n\x1a\n" + bytes(16)
+        response = self.client.put(self.post_url(post), json.dumps({"content": base64.b64encode(image).decode()}), content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(Image.objects.values_list("hash", flat=True)), [hashlib.sha256(image).hexdigest()])
+
+        # a client sending back the image url keeps the image
+        response = self.client.put(self.post_url(post), json.dumps({"content": f"http://testserver{self.image_url(post)}"}), content_type="application/json")
+        self.assertEqual(Image.objects.count(), 1)
+
+        self.client.delete(self.post_url(post))
+        self.assertEqual(Image.objects.count(), 0)
+
+    def test_get_image(self):
+        """
+            tests the image is served with a strong ETag and revalidated with a 304
+        """
+        post = self.create_image_post()
+        response = self.client.get(self.image_url(post))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), self.IMAGE)
+        self.assertEqual(response["Content-Type"], "image/png")
+        self.assertEqual(response["Content-Length"], str(len(self.IMAGE)))
+        self.assertEqual(response["ETag"], f'"{post.image_id}"')
+        self.assertEqual(response["Cache-Control"], "public, no-cache")
+
+        response = self.client.get(self.image_url(post), HTTP_IF_NONE_MATCH=f'"{post.image_id}"')
+        self.assertEqual(response.status_code, 304)
+
+        # a url pinned to the image version can be cached forever
+        response = self.client.get(self.image_url(post), {"v": post.image_id})
+        self.assertEqual(response["Cache-Control"], "public, max-age=31536000, immutable")
+
+    def test_get_image_range(self):
+        """
+            tests partial image requests
+        """
+        post = self.create_image_post()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.image_url(post), HTTP_RANGE="bytes=8-15")
+        self.assertEqual(response.status_code, 206)
+        # only the range is read from the database
+        self.assertEqual([query["sql"] for query in queries if '"data"' in query["sql"] and "SUBSTR" not in query["sql"].upper()], [])
+        self.assertEqual(b"".join(response.streaming_content), self.IMAGE[8:16])
+        self.assertEqual(response["Content-Range"], f"bytes 8-15/{len(self.IMAGE)}")
+
+        response = self.client.get(self.image_url(post), HTTP_RANGE="bytes=-4")
+        self.assertEqual(b"".join(response.streaming_content), self.IMAGE[-4:])
+
+        response = self.client.get(self.image_url(post), HTTP_RANGE=f"bytes={len(self.IMAGE)}-")
+        self.assertEqual(response.status_code, 416)
+
+        # a range that ends before it starts is invalid and ignored
+        response = self.client.get(self.image_url(post), HTTP_RANGE="bytes=15-8")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), self.IMAGE)
+
+        # a range for another version of the image gets the whole image
+        response = self.client.get(self.image_url(post), HTTP_RANGE="bytes=8-15", HTTP_IF_RANGE='"old"')
+        self.assertEqual(response.status_code, 200)
+
+
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        user = create_author("test@test.ca", "test user", "https://github.com", "", "12345")
+        self.client.post(reverse("api:register"), user)
+        self.author = Author.objects.get(display_name="test user")
+        set_active(self.author)
+        self.client.post(reverse("api:login"), user)
+
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.cache_dir.cleanup)
+        settings_override = self.settings(IMAGE_VARIANT_CACHE_DIR=self.cache_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def create_image_post(self, color="red", size=(800, 400)):
+        buffer = io.BytesIO()
+        PILImage.new("RGB", size, color).save(buffer, format="PNG")
+        post = create_post("image post", '', '', "description", "image/png;base64", base64.b64encode(buffer.getvalue()).decode(), self.author, "0", "", "PUBLIC")
+        return post
+
+    def get_variant(self, post, **params):
+        return self.client.get(reverse("api:get_image", kwargs={"id_author": self.author.id, "id_post": post.id}), params)
+
+    def test_resized_variant(self):
+        """
+            tests a resized webp variant is made once and served from the cache with its own ETag
+        """
+        post = self.create_image_post()
+        response = self.get_variant(post, w=300, fmt="webp")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/webp")
+        self.assertEqual(response["ETag"], f'"{post.image_id}-320.webp"')
+        with PILImage.open(io.BytesIO(b"".join(response.streaming_content))) as image:
+            self.assertEqual((image.format, image.size), ("WEBP", (320, 160)))
+        self.assertEqual(os.listdir(self.cache_dir.name), [f"{post.image_id}-320.webp"])
+
+        # served from the cache, the original isn't read again
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get_variant(post, w=320, fmt="webp")
+        self.assertEqual(response.status_code, 200)
+        assert not any("api_image" in query["sql"] for query in queries.captured_queries)
+
+        response = self.client.get(reverse("api:get_image", kwargs={"id_author": self.author.id, "id_post": post.id}) + "?w=320&fmt=webp", HTTP_IF_NONE_MATCH=f'"{post.image_id}-320.webp"')
+        self.assertEqual(response.status_code, 304)
+
+    def test_invalid_variant(self):
+        """
+            tests invalid variant parameters are rejected
+        """
+        post = self.create_image_post()
+        self.assertEqual(self.get_variant(post, w="big").status_code, 400)
+        self.assertEqual(self.get_variant(post, fmt="gif").status_code, 400)
+
+    def test_jpg_and_jpeg_share_a_variant(self):
+        """
+            tests that fmt=jpg and fmt=jpeg are the same variant, and that a failed render leaves no temporary file
+        """
+        post = self.create_image_post()
+        self.assertEqual(self.get_variant(post, w=320, fmt="jpg")["ETag"], f'"{post.image_id}-320.jpeg"')
+        self.assertEqual(self.get_variant(post, w=320, fmt="jpeg")["ETag"], f'"{post.image_id}-320.jpeg"')
+        self.assertEqual(os.listdir(self.cache_dir.name), [f"{post.image_id}-320.jpeg"])
+
+        def fail_halfway(image, path, format=None):
+            with open(path, "wb") as file:
+                file.write(b"half a file")
+            raise OSError("disk full")
+
+        with unittest.mock.patch.object(PILImage.Image, "save", fail_halfway):
+            self.assertEqual(self.get_variant(post, w=640, fmt="webp").status_code, 200)
+        self.assertEqual(os.listdir(self.cache_dir.name), [f"{post.image_id}-320.jpeg"])
+
+    def test_variant_cache_eviction(self):
+        """
+            tests the least recently used variants are removed when the cache is full
+        """
+        posts = [self.create_image_post(color) for color in ("red", "green", "blue")]
+        first = self.get_variant(posts[0], w=64, fmt="png")
+        variant_size = int(first["Content-Length"])
+        with self.settings(IMAGE_VARIANT_CACHE_BYTES=variant_size * 2 + variant_size // 2):
+            # make the first variant older than the others
+            old = time.time() - 60
+            os.utime(os.path.join(self.cache_dir.name, f"{posts[0].image_id}-64.png"), (old, old))
+            self.get_variant(posts[1], w=64, fmt="png")
+            self.get_variant(posts[2], w=64, fmt="png")
+        self.assertEqual(sorted(os.listdir(self.cache_dir.name)), sorted(f"{post.image_id}-64.png" for post in posts[1:]))
+
+
+class CircuitBreakerTests(TestCase):
+    def setUp(self):
+        utils._sessions.clear()
+        breaker._breakers.clear()
+        cache.clear()
+        self.routes = {"/api/authors/": (500, {"detail": "down"})}
+        self.server = start_remote_node(self.routes)
+        self.node = create_node(self.server)
+        settings_override = self.settings(FEDERATION_CACHE_TTLS=[], FEDERATION_BREAKER_FAILURES=2, FEDERATION_BREAKER_COOLDOWN=0.3)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get_authors(self):
+        return utils.get_request_remote(host_url=self.server.url, path="authors/")
+
+    def test_breaker_opens_and_closes(self):
+        """
+            tests that a failing node is skipped once its breaker opens, and used again after a successful probe
+        """
+        for i in range(2):
+            self.assertEqual(self.get_authors().status_code, 500)
+
+        # the breaker is open, the node isn't called
+        self.assertIsNone(self.get_authors())
+        self.assertEqual(len(self.server.received), 2)
+        self.node.refresh_from_db()
+        self.assertEqual(self.node.breaker_state, "OPEN")
+        self.assertEqual(self.node.consecutive_failures, 2)
+        self.assertEqual((self.node.recent_requests, self.node.recent_failures), (2, 2))
+        assert "500" in self.node.last_error
+
+        # after the cooldown a probe goes through and closes the breaker
+        self.routes["/api/authors/"] = (200, {"type": "authors", "items": []})
+        time.sleep(0.35)
+        self.assertEqual(self.get_authors().status_code, 200)
+        self.node.refresh_from_db()
+        self.assertEqual(self.node.breaker_state, "CLOSED")
+        self.assertEqual(self.node.consecutive_failures, 0)
+
+    def test_failed_probe_reopens(self):
+        """
+            tests that a failed probe opens the breaker again, and that only one probe is let through
+        """
+        for i in range(2):
+            self.get_authors()
+        time.sleep(0.35)
+
+        node_breaker = breaker.get_breaker(self.node)
+        self.assertTrue(node_breaker.allow_request())
+        self.assertFalse(node_breaker.allow_request())
+        node_breaker.record_failure("probe failed")
+        self.assertEqual(node_breaker.state, "OPEN")
+        self.assertIsNone(self.get_authors())
+        self.assertEqual(len(self.server.received), 2)
+
+    def test_outbox_waits_for_open_breaker(self):
+        """
+            tests that deliveries to a node with an open breaker are put off without using up attempts
+        """
+        for i in range(2):
+            self.get_authors()
+        delivery = Outbox.objects.create(node=self.node, request_url=f"{self.node.api_url}authors/1/inbox", payload={"type": "Like"})
+
+        deliver_outbox()
+        delivery.refresh_from_db()
+        self.assertEqual(delivery.status, "PENDING")
+        self.assertEqual(delivery.attempts, 0)
+        assert delivery.next_attempt_at > timezone.now()
+        assert not any(method == "POST" for method, *rest in self.server.received)
+
+
+class NodeRegistryTests(TransactionTestCase):
+    """
+        runs outside of a transaction, the registry isn't kept when it is read inside one
+    """
+    def setUp(self):
+        cache.clear()
+        nodes._invalidate_local()
+        self.node = Node.objects.create(team_name="remote team", api_url="http://remote.test/api/", host_url="http://remote.test/",
+                                        base64_authorization=base64.b64encode(b"user:pass").decode())
+
+    def tearDown(self):
+        nodes._invalidate_local()
+
+    def test_lookups_are_in_memory(self):
+        """
+            tests that once loaded, nodes are looked up without any query
+        """
+        nodes.get_node_by_host("http://remote.test/")
+        with self.assertNumQueries(0):
+            self.assertEqual(nodes.get_node_by_host("http://remote.test/", active=True).id, self.node.id)
+            self.assertEqual(nodes.get_node_by_api_url("http://remote.test/api/").id, self.node.id)
+            self.assertEqual([node.id for node in nodes.get_nodes(active=True)], [self.node.id])
+            self.assertIsNone(nodes.get_node_by_host("http://unknown.test/"))
+
+    def test_node_changes_invalidate(self):
+        """
+            tests that saving or deleting a node is seen by the next lookup
+        """
+        nodes.get_node_by_host("http://remote.test/")
+        self.node.is_active = False
+        self.node.save()
+        self.assertIsNone(nodes.get_node_by_host("http://remote.test/", active=True))
+        self.assertEqual(nodes.get_node_by_host("http://remote.test/").id, self.node.id)
+
+        self.node.delete()
+        self.assertIsNone(nodes.get_node_by_host("http://remote.test/"))
+
+    def test_version_stamp(self):
+        """
+            tests that a node change made by another process is picked up through the version stamp
+        """
+        registry = nodes.get_node_registry()
+        # another process changed the nodes: the row and the stamp changed, but this process got no signal
+        Node.objects.filter(id=self.node.id).update(team_name="renamed")
+        cache.set(nodes.NODE_REGISTRY_VERSION_KEY, "another version", None)
+        self.assertEqual(nodes.get_node_by_host("http://remote.test/").team_name, "remote team")
+
+        registry.checked_at -= settings.NODE_REGISTRY_CHECK_INTERVAL
+        self.assertEqual(nodes.get_node_by_host("http://remote.test/").team_name, "renamed")
+
+
+class FollowReconcileTests(TestCase):
+    def setUp(self):
+        utils._sessions.clear()
+        breaker._breakers.clear()
+        cache.clear()
+        user = create_author("test@test.ca", "test user", "https://github.com", "", "12345")
+        self.client.post(reverse("api:register"), user)
+        self.author = Author.objects.get(display_name="test user")
+        set_active(self.author)
+        self.client.post(reverse("api:login"), user)
+
+        self.routes = {}
+        self.server = start_remote_node(self.routes)
+        create_node(self.server)
+        self.accepting = create_remote_author(self.server, "accepting")
+        self.pending = create_remote_author(self.server, "pending")
+        self.leaving = create_remote_author(self.server, "leaving")
+        self.staying = create_remote_author(self.server, "staying")
+
+        # the remote node's answers: is <follower url> one of <author id>'s followers
+        self.routes[f"/api/authors/{self.accepting.id}/followers/{quote(self.author.url)}"] = (200, {})
+        self.routes[f"/api/authors/{self.author.id}/followers/{quote(self.staying.url)}"] = (200, {})
+        create_follow_request(self.author, self.accepting)
+        create_follow_request(self.author, self.pending)
+        create_follower(self.leaving, self.author)
+        create_follower(self.staying, self.author)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_reconcile_follow_state(self):
+        """
+            tests that accepted remote follow requests become follows and remote followers that left are removed
+        """
+        result = reconcile_follow_state()
+        self.assertEqual(result, {"checked": 4, "accepted": 1, "removed": 1})
+        assert Follower.objects.filter(follower=self.author, followed_user=self.accepting).exists()
+        self.assertEqual(list(FollowRequest.objects.filter(from_user=self.author).values_list('to_user', flat=True)), [self.pending.id])
+        self.assertEqual(set(Follower.objects.filter(followed_user=self.author).values_list('follower', flat=True)), {self.staying.id})
+
+        # everything left was just checked, nothing is due yet
+        self.assertEqual(reconcile_follow_state()["checked"], 0)
+        self.assertEqual(len(self.server.received), 4)
+
+    def test_reconcile_spreads_over_nodes(self):
+        """
+            tests that one round checks at most FOLLOW_RECONCILE_PER_NODE relationships per node
+        """
+        with self.settings(FOLLOW_RECONCILE_PER_NODE=1):
+            self.assertEqual(reconcile_follow_state()["checked"], 1)
+
+    def test_endpoints_return_stored_state(self):
+        """
+            tests that the check endpoints answer from the database without calling the remote node
+        """
+        response = self.client.get(reverse("api:check_remote_follow_requests_approved", kwargs={"id_author": self.author.id}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.content)["items"]), 2)
+
+        response = self.client.get(reverse("api:check_remote_follower_still_exists", kwargs={"id_author": self.author.id}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({item["displayName"] for item in json.loads(response.content)["items"]}, {"leaving", "staying"})
+        self.assertEqual(self.server.received, [])
+
+
+class InboxSocketTests(TestCase):
+    def setUp(self):
+        self.author = Author.objects.create(email="author@test.ca", display_name="author", github="https://github.com", password="12345")
+        self.other = Author.objects.create(email="other@test.ca", display_name="other", github="https://github.com", password="12345")
+
+    async def connect(self, user, author):
+        """
+            opens the inbox websocket of author as user, returns (communicator, accepted)
+        """
+        path = f"/ws/authors/{author.id}/inbox"
+        communicator = ApplicationCommunicator(URLRouter(websocket_urlpatterns), {
+            "type": "websocket", "path": path, "raw_path": path.encode(), "query_string": b"", "headers": [], "subprotocols": [], "user": user,
+        })
+        await communicator.send_input({"type": "websocket.connect"})
+        response = await communicator.receive_output(timeout=1)
+        return communicator, response["type"] == "websocket.accept"
+
+    def create_inbox_item(self, item):
+        # the push happens once the inbox row is committed
+        with self.captureOnCommitCallbacks(execute=True):
+            Inbox.objects.create(author=self.author, item=item)
+
+    async def test_new_inbox_items_are_pushed(self):
+        """
+            tests that a new inbox item is sent to the author's websocket
+        """
+        communicator, connected = await self.connect(self.author, self.author)
+        self.assertTrue(connected)
+
+        item = {"type": "Like", "summary": "other liked your post"}
+        await sync_to_async(self.create_inbox_item)(item)
+        message = await communicator.receive_output(timeout=1)
+        self.assertEqual(json.loads(message["text"]), {"type": "inbox", "item": item})
+        await communicator.send_input({"type": "websocket.disconnect", "code": 1000})
+        await communicator.wait(timeout=1)
+
+    async def test_only_author_can_listen(self):
+        """
+            tests that an author can't listen to someone else's inbox
+        """
+        communicator, connected = await self.connect(self.other, self.author)
+        self.assertFalse(connected)
+        communicator, connected = await self.connect(AnonymousUser(), self.author)
+        self.assertFalse(connected)
+
+
+class AsyncFederationViewTests(TestCase):
+    def setUp(self):
+        utils._sessions.clear()
+        breaker._breakers.clear()
+        cache.clear()
+        self.author = Author.objects.create(email="author@test.ca", display_name="author", github="https://github.com", password="12345")
+        set_active(self.author)
+        self.factory = RequestFactory()
+
+    def start_node(self, routes, team_name="remote team"):
+        server = start_remote_node(routes)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        create_node(server, team_name)
+        return server
+
+    def call(self, view, path, **kwargs):
+        """
+            calls a view directly as self.author, returns (status, json)
+        """
+        request = self.factory.get(path)
+        request._force_auth_user = self.author
+        response = view(request, **kwargs)
+        if hasattr(response, "render"):
+            response.render()
+        return response.status_code, json.loads(response.content)
+
+    def test_async_views_answer_like_the_sync_views(self):
+        """
+            tests that the async remote posts view returns what the DRF view returns
+        """
+        routes = {}
+        server = self.start_node(routes)
+        friend = create_remote_author(server, "remote friend")
+        create_follower(self.author, friend)
+        create_follower(friend, self.author)
+        routes[f"/api/authors/{friend.id}/posts/"] = (200, {"items": [remote_post(friend, "friend public", "PUBLIC"), remote_post(friend, "friend only", "FRIENDS")]})
+
+        posts_path = f"/api/authors/{friend.id}/posts/"
+        sync_posts = self.call(views.get_and_create_post, posts_path, id_author=friend.id)
+        async_posts = self.call(async_to_sync(async_views.get_and_create_post), posts_path, id_author=friend.id)
+        self.assertEqual(async_posts, sync_posts)
+        self.assertEqual([post["title"] for post in async_posts[1]["items"]], ["friend public", "friend only"])
+
+    def test_remote_images_are_served_async(self):
+        """
+            tests that the async image view serves a remote image, and asks the node only once when it fails
+        """
+        routes = {}
+        server = self.start_node(routes)
+        friend = create_remote_author(server, "remote friend")
+        post_id = uuid.uuid4()
+        image_path = f"/api/authors/{friend.id}/posts/{post_id}/image"
+        routes[image_path] = (200, b"\x89PNG")
+
+        request = self.factory.get(image_path)
+        request._force_auth_user = self.author
+        response = async_to_sync(async_views.get_image)(request, id_author=friend.id, id_post=post_id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/png")
+        self.assertEqual(response.content, b"\x89PNG")
+
+        server.received.clear()
+        other_post = uuid.uuid4()
+        request = self.factory.get(f"/api/authors/{friend.id}/posts/{other_post}/image")
+        request._force_auth_user = self.author
+        response = async_to_sync(async_views.get_image)(request, id_author=friend.id, id_post=other_post)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(len(server.received), 1)
+
+    def test_async_client_shares_breaker(self):
+        """
+            tests that the async client doesn't call a node whose circuit breaker is open
+        """
+        routes = {}
+        server = self.start_node(routes)
+        friend = create_remote_author(server, "remote friend")
+        node = Node.objects.get(host_url=server.url)
+        node_breaker = breaker.get_breaker(node)
+        for i in range(settings.FEDERATION_BREAKER_FAILURES):
+            node_breaker.record_failure("down")
+
+        status_code, result = self.call(async_to_sync(async_views.get_post_likes), f"/api/authors/{friend.id}/posts/{uuid.uuid4()}/likes", id_author=friend.id, id_post=uuid.uuid4())
+        self.assertEqual(status_code, 400)
+        self.assertEqual(server.received, [])
+
+    def test_async_views_require_authentication(self):
+        """
+            tests that the async views reject unauthenticated requests like the DRF views
+        """
+        server = self.start_node({})
+        friend = create_remote_author(server, "remote friend")
+        post_id = uuid.uuid4()
+        request = self.factory.get(f"/api/authors/{friend.id}/posts/{post_id}/likes")
+        request.user = AnonymousUser()
+        response = async_to_sync(async_views.get_post_likes)(request, id_author=friend.id, id_post=post_id)
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(server.received, [])
+
+        # bad basic credentials get DRF's own answer
+        credentials = {"HTTP_AUTHORIZATION": "Basic " + base64.b64encode(b"nobody:wrong").decode()}
+        sync_response = views.get_post_likes(self.factory.get(f"/api/authors/{friend.id}/posts/{post_id}/likes", **credentials), id_author=friend.id, id_post=post_id)
+        request = self.factory.get(f"/api/authors/{friend.id}/posts/{post_id}/likes", **credentials)
+        response = async_to_sync(async_views.get_post_likes)(request, id_author=friend.id, id_post=post_id)
+        sync_response.render()
+        self.assertEqual((response.status_code, response.get("WWW-Authenticate"), json.loads(response.content)),
+                         (sync_response.status_code, sync_response.get("WWW-Authenticate"), json.loads(sync_response.content)))
+        self.assertEqual(json.loads(response.content)["detail"], "Invalid username/password.")
+
+    def test_middleware_chain_is_async(self):
+        """
+            tests that no middleware is adapted to run under ASGI, which would hold a thread for every async view
+        """
+        for path in settings.MIDDLEWARE:
+            assert getattr(import_string(path), "async_capable", False), path
+
+
+def paginated(queryset, before, field='published'):
+    """
+        the query of one page of cursor pagination (see api/pagination.py)
+    """
+    return keyset_filter(queryset, before, field).order_by(f'-{field}', '-pk')[:11]
+
+
+class QueryPlanTests(TestCase):
+    """
+        Runs EXPLAIN QUERY PLAN on the hot queries against a seeded database, each one has to keep using its index
+    """
+    def setUp(self):
+        self.authors = [Author.objects.create(email=f"author{i}@test.ca", display_name=f"author {i}", github="https://github.com", password="12345") for i in range(10)]
+        Author.objects.create(email="remote@test.ca", display_name="remote", github="https://github.com", is_remote=True)
+        self.posts = []
+        for author in self.authors:
+            for visibility in ["PUBLIC", "FRIENDS", "UNLISTED"]:
+                self.posts.append(create_post(f"{visibility} post", '', '', "description", "text/plain", "content", author, "0", "", visibility))
+        for author in self.authors:
+            for post in self.posts[:5]:
+                create_comment(author, "a comment", post)
+                create_like("", author, post, "")
+            Inbox.objects.create(author=author, item={"type": "Like"})
+            create_follower(self.authors[0], author)
+        self.before = (timezone.now(), uuid.uuid4())
+
+    def hot_queries(self):
+        """
+            (name, queryset shaped like the view's, index it has to use, whether it may sort in a temp b-tree)
+        """
+        author = self.authors[0]
+        post = self.posts[0]
+        return [
+            ("explore feed", Post.objects.filter(visibility="PUBLIC").select_related('author').order_by('-published'), "post_visibility_published_idx", False),
+            ("explore feed cursor", paginated(Post.objects.filter(visibility="PUBLIC"), self.before), "post_visibility_published_idx", False),
+            ("profile public posts", Post.objects.filter(author=author, visibility="PUBLIC").order_by('-published'), "post_author_vis_published_idx", False),
+            # an IN list can't be read in published order from the index
+            ("profile friend posts", Post.objects.filter(author=author, visibility__in=["PUBLIC", "FRIENDS"]).order_by('-published'), "post_author_vis_published_idx", True),
+            ("inbox", Inbox.objects.filter(author=author).order_by('-published'), "inbox_author_published_idx", False),
+            ("comments", Comment.objects.filter(post=post).order_by('-published'), "comment_post_published_idx", False),
+            ("comments cursor", paginated(Comment.objects.filter(post=post), self.before), "comment_post_published_idx", False),
+            ("likes of a post", Like.objects.filter(post=post), "api_like_post_id", False),
+            ("already liked", Like.objects.filter(author=author, post=post), "like_author_post_idx", False),
+            ("local authors", Author.objects.filter(is_remote=False, is_staff=False), "author_local_created_idx", False),
+            ("local authors cursor", paginated(Author.objects.filter(is_remote=False, is_staff=False), self.before, 'created_at'), "author_local_created_idx", False),
+            ("home timeline", Timeline.objects.filter(owner=author).order_by('-published'), "timeline_owner_published_idx", False),
+        ]
+
+    def test_hot_queries_use_their_index(self):
+        """
+            tests that each hot query searches its index and, unless expected, doesn't sort in a temp b-tree
+        """
+        for name, queryset, index, may_sort in self.hot_queries():
+            plan = queryset.explain()
+            self.assertIn(f"USING INDEX {index}", plan, f"{name} doesn't use {index}:\n{plan}")
+            if not may_sort:
+                self.assertNotIn("TEMP B-TREE", plan, f"{name} sorts its rows:\n{plan}")
+
+
+class PostCounterTests(TestCase):
+    def setUp(self):
+        self.author = Author.objects.create(email="author@test.ca", display_name="author", github="https://github.com", password="12345")
+        self.other = Author.objects.create(email="other@test.ca", display_name="other", github="https://github.com", password="12345")
+        self.post = create_post("a post", '', '', "description", "text/plain", "content", self.author, "0", "", "PUBLIC")
+
+    def test_counters_follow_comments_and_likes(self):
+        """
+            tests that adding and removing comments and likes changes the post's counters with single column updates
+        """
+        with CaptureQueriesContext(connection) as queries:
+            comment = create_comment(self.other, "a comment", self.post)
+        updates = [query["sql"] for query in queries.captured_queries if query["sql"].startswith('UPDATE "api_post"')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('SET "count" = ("api_post"."count" + 1)', updates[0])
+        self.assertNotIn('"content"', updates[0])
+
+        create_comment(self.author, "another comment", self.post)
+        like = create_like("", self.other, self.post, "")
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.count, self.post.likeCount), (2, 1))
+
+        comment.delete()
+        like.delete()
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.count, self.post.likeCount), (1, 0))
+
+    def test_counters_are_served(self):
+        """
+            tests that the post json has the comment and like counts
+        """
+        create_comment(self.other, "a comment", self.post)
+        create_like("", self.other, self.post, "")
+        self.client.force_login(self.author)
+        response = self.client.get(reverse("api:get_update_and_delete_specific_post", kwargs={"id_author": self.author.id, "id_post": self.post.id}))
+        result = json.loads(response.content)
+        self.assertEqual((result["count"], result["likeCount"]), (1, 1))
+
+    def test_rebuild_fixes_drift(self):
+        """
+            tests that rebuild_post_counters recounts the drifted posts only
+        """
+        create_comment(self.other, "a comment", self.post)
+        create_like("", self.other, self.post, "")
+        untouched = create_post("other post", '', '', "description", "text/plain", "content", self.other, "0", "", "PUBLIC")
+        Post.objects.filter(id=self.post.id).update(count=7, likeCount=0)
+
+        out = io.StringIO()
+        call_command("rebuild_post_counters", stdout=out)
+        self.assertIn("Fixed the counters of 1 posts", out.getvalue())
+        self.post.refresh_from_db()
+        untouched.refresh_from_db()
+        self.assertEqual((self.post.count, self.post.likeCount), (1, 1))
+        self.assertEqual((untouched.count, untouched.likeCount), (0, 0))
+
+
+class RelationshipResolverTests(TestCase):
+    def setUp(self):
+        self.viewer = Author.objects.create(email="viewer@test.ca", display_name="viewer", github="https://github.com", password="12345")
+        self.authors = [Author.objects.create(email=f"author{i}@test.ca", display_name=f"author {i}", github="https://github.com", password="12345") for i in range(4)]
+        friend, followed, follower, stranger = self.authors
+        create_follower(self.viewer, friend)
+        create_follower(friend, self.viewer)
+        create_follower(self.viewer, followed)
+        create_follower(follower, self.viewer)
+
+    def test_one_query_for_many_authors(self):
+        """
+            tests that the relationships with many authors are loaded with one query and then remembered
+        """
+        friend, followed, follower, stranger = self.authors
+        resolver = RelationshipResolver(self.viewer.id)
+        with self.assertNumQueries(1):
+            resolver.load([author.id for author in self.authors])
+            self.assertEqual([resolver.is_friend(author.id) for author in self.authors], [True, False, False, False])
+            self.assertEqual([resolver.follows(author.id) for author in self.authors], [True, True, False, False])
+            self.assertEqual([resolver.followed_by(author.id) for author in self.authors], [True, False, True, False])
+            self.assertEqual([resolver.can_see(author.id, "FRIENDS") for author in self.authors], [True, False, False, False])
+            self.assertTrue(resolver.can_see(self.viewer.id, "FRIENDS"))
+            self.assertTrue(resolver.can_see(stranger.id, "PUBLIC"))
+
+    def test_resolver_is_kept_for_the_request(self):
+        """
+            tests that a request reuses its resolver, and an anonymous viewer never queries
+        """
+        request = RequestFactory().get("/")
+        request.user = self.viewer
+        resolver = get_relationships(request)
+        self.assertIs(get_relationships(request), resolver)
+        self.assertIsNot(get_relationships(request, self.authors[0].id), resolver)
+
+        anonymous = RequestFactory().get("/")
+        anonymous.user = AnonymousUser()
+        with self.assertNumQueries(0):
+            self.assertFalse(get_relationships(anonymous).can_see(self.authors[0].id, "FRIENDS"))
+
+    def test_friends_only_posts_checked_once(self):
+        """
+            tests that a friend's profile and friends only post are checked with one follow query each
+        """
+        friend, followed, follower, stranger = self.authors
+        friends_post = create_post("friends post", '', '', "description", "text/plain", "content", friend, "0", "", "FRIENDS")
+        create_post("public post", '', '', "description", "text/plain", "content", friend, "0", "", "PUBLIC")
+        self.client.force_login(self.viewer)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("api:get_and_create_post", kwargs={"id_author": friend.id}))
+        self.assertEqual(len(json.loads(response.content)["items"]), 2)
+        self.assertEqual(len([query for query in queries.captured_queries if 'FROM "api_follower"' in query["sql"]]), 1)
+
+        response = self.client.get(reverse("api:get_update_and_delete_specific_post", kwargs={"id_author": friend.id, "id_post": friends_post.id}))
+        self.assertEqual(response.status_code, 200)
+        self.client.force_login(stranger)
+        response = self.client.get(reverse("api:get_update_and_delete_specific_post", kwargs={"id_author": friend.id, "id_post": friends_post.id}))
+        self.assertEqual(response.status_code, 404)
+
+
+class ImageUrlRewriteTests(TestCase):
+    def setUp(self):
+        utils._ingested_posts.clear()
+        utils._ingested_sizes.clear()
+        utils._ingested_bytes = 0
+        self.request = RequestFactory().get("/")
+        self.request.user = AnonymousUser()
+        self.our_api = "http://testserver/api/"
+        Node.objects.create(team_name="team a", api_url="https://a.example.com/api/", host_url="https://a.example.com/", base64_authorization="")
+        Node.objects.create(team_name="team b", api_url="https://b.example.com/service/api/", host_url="https://b.example.com/", base64_authorization="")
+
+    def response(self, posts):
+        response = requests.Response()
+        response.status_code = 200
+        response._content = json.dumps({"type": "posts", "items": posts}).encode()
+        return response
+
+    def markdown_post(self, content):
+        return {"type": "post", "contentType": "text/markdown", "content": content, "visibility": "PUBLIC"}
+
+    def test_images_of_every_node_rewritten_in_one_pass(self):
+        """
+            tests that the markdown images pointing at any node are pointed at our api, and nothing else is touched
+        """
+        content = ("![image](https://a.example.com/api/authors/1/posts/2/image) and "
+                   "![image](https://b.example.com/service/api/authors/3/posts/4/image) but not "
+                   "![image](https://elsewhere.com/api/x.png) or [a link](https://a.example.com/api/authors/1)")
+        plain = {"type": "post", "contentType": "text/plain", "content": "![image](https://a.example.com/api/x)"}
+        posts = utils.get_remote_posts(self.response([self.markdown_post(content), plain]), self.request)
+        self.assertEqual(posts[0]["content"], (
+            f"![image]({self.our_api}authors/1/posts/2/image) and "
+            f"![image]({self.our_api}authors/3/posts/4/image) but not "
+            "![image](https://elsewhere.com/api/x.png) or [a link](https://a.example.com/api/authors/1)"))
+        self.assertEqual(posts[1], plain)
+
+    def test_posts_rewritten_once_per_response(self):
+        """
+            tests that the same response content is only parsed and rewritten once, until the nodes change
+        """
+        response = self.response([self.markdown_post("![image](https://c.example.com/api/image)")])
+        with unittest.mock.patch.object(utils, "rewrite_image_urls", wraps=utils.rewrite_image_urls) as rewrite:
+            first = utils.get_remote_posts(response, self.request)
+            first[0]["content"] = "changed by a view"
+            second = utils.get_remote_posts(response, self.request)
+            self.assertEqual(rewrite.call_count, 1)
+            self.assertEqual(second[0]["content"], "![image](https://c.example.com/api/image)")
+
+            # a new node rebuilds the registry and its pattern
+            Node.objects.create(team_name="team c", api_url="https://c.example.com/api/", host_url="https://c.example.com/", base64_authorization="")
+            third = utils.get_remote_posts(response, self.request)
+            self.assertEqual(rewrite.call_count, 2)
+            self.assertEqual(third[0]["content"], f"![image]({self.our_api}image)")
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        utils._sessions.clear()
+        breaker._breakers.clear()
+        cache.clear()
+        metrics._values.clear()
+        metrics_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(metrics_dir.cleanup)
+        settings_override = self.settings(METRICS_DIR=metrics_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.metrics_dir = metrics_dir.name
+        self.staff = Author.objects.create_superuser("staff@test.ca", "staff", "12345")
+        self.author = Author.objects.create(email="author@test.ca", display_name="author", github="https://github.com", password="12345")
+        set_active(self.author)
+
+    def scrape(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse("api:get_metrics"))
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_requests_are_measured(self):
+        """
+            tests that a request gets a Server-Timing header and shows up in the view's histograms
+        """
+        self.client.force_login(self.author)
+        response = self.client.get(reverse("api:get_authors"))
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response["Server-Timing"], r'^app;dur=[\d.]+, db;dur=[\d.]+;desc="[1-9]\d* queries", nodes;dur=0.0;desc="0 calls"$')
+
+        body = self.scrape()
+        assert "# TYPE snackoverflow_request_duration_seconds histogram" in body
+        assert 'snackoverflow_request_duration_seconds_count{view="api:get_authors",method="GET"} 1' in body
+        assert 'snackoverflow_request_queries_bucket{view="api:get_authors",le="+Inf"} 1' in body
+
+    def test_node_calls_are_measured(self):
+        """
+            tests that the calls to other nodes are counted by node and status, and in the request's Server-Timing
+        """
+        routes = {}
+        server = start_remote_node(routes)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        create_node(server, "metrics team")
+        remote = create_remote_author(server, "remote author")
+        routes[f"/api/authors/{remote.id}/liked"] = (200, {"type": "liked", "items": []})
+
+        self.client.force_login(self.author)
+        response = self.client.get(reverse("api:get_liked", args=[remote.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response["Server-Timing"], r'nodes;dur=[\d.]+;desc="1 calls"$')
+
+        body = self.scrape()
+        assert 'snackoverflow_node_request_duration_seconds_count{node="metrics team",status="200"} 1' in body
+
+    def test_workers_are_added_up(self):
+        """
+            tests that the histograms written by other workers are added to this one's
+        """
+        self.client.force_login(self.author)
+        self.client.get(reverse("api:get_authors"))
+        metrics.flush_metrics(force=True)
+        with open(os.path.join(self.metrics_dir, "other-worker.json"), "w") as file:
+            json.dump({"snackoverflow_request_queries": [[["api:get_authors"], [0, 0, 1, 0, 0, 0, 0, 0, 0], 3, 1]]}, file)
+
+        body = self.scrape()
+        assert 'snackoverflow_request_queries_count{view="api:get_authors"} 2' in body
+
+    def test_files_of_exited_workers_are_removed(self):
+        """
+            tests that the files of workers that exited, and the temporary files of their unfinished writes, are removed when scraped
+        """
+        exited = subprocess.Popen([sys.executable, "-c", ""])
+        exited.wait()
+        for file_name in (f"{exited.pid}-1.json", f"{exited.pid}-abc.tmp"):
+            with open(os.path.join(self.metrics_dir, file_name), "w") as file:
+                json.dump({"snackoverflow_request_queries": [[["api:get_authors"], [0, 0, 1, 0, 0, 0, 0, 0, 0], 3, 1]]}, file)
+
+        body = self.scrape()
+        assert 'view="api:get_authors"' not in body
+        self.assertEqual(os.listdir(self.metrics_dir), [metrics._store["name"]])
+
+    def test_failed_write_leaves_no_temporary_file(self):
+        """
+            tests that a flush that fails while writing removes its temporary file, and that requests don't write
+        """
+        self.client.force_login(self.author)
+        self.client.get(reverse("api:get_authors"))
+        self.assertEqual(os.listdir(self.metrics_dir), [])
+        with unittest.mock.patch.object(metrics.json, "dump", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                metrics.flush_metrics(force=True)
+        self.assertEqual(os.listdir(self.metrics_dir), [])
+
+
+class LoggingTests(TestCase):
+    def setUp(self):
+        self.stream = io.StringIO()
+        self.handler = QueueLogHandler(stream=self.stream, sample_every=10)
+        self.handler.setFormatter(StructuredFormatter(max_length=50))
+        self.logger = logging.getLogger(f"api.tests.{uuid.uuid4()}")
+        self.logger.addHandler(self.handler)
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.propagate = False
+
+    def lines(self, count):
+        """
+            waits for the listener thread to write count lines
+        """
+        deadline = time.time() + 5
+        while self.stream.getvalue().count("\n") < count and time.time() < deadline:
+            time.sleep(0.01)
+        return [json.loads(line) for line in self.stream.getvalue().splitlines()]
+
+    def test_records_are_structured_and_truncated(self):
+        """
+            tests that records are written as JSON lines with their extra fields, and long values are cut
+        """
+        self.logger.warning("post: %s", {"content": "a" * 5000}, extra={"node": "remote team", "status": 500})
+        entry = self.lines(1)[0]
+        self.assertEqual(entry["level"], "WARNING")
+        self.assertEqual(entry["node"], "remote team")
+        self.assertEqual(entry["status"], 500)
+        assert entry["message"].startswith("post: {'content': 'aaa")
+        assert entry["message"].endswith("... (5021 characters)")
+        self.assertLess(len(entry["message"]), 100)
+
+    def test_per_item_events_are_sampled(self):
+        """
+            tests that only 1 in sample_every of each sampled event is kept, and the other events are all kept
+        """
+        for i in range(25):
+            self.logger.debug("queued for %s", i, extra=SAMPLED)
+        self.logger.info("done")
+        entries = self.lines(4)
+        self.assertEqual([entry["message"] for entry in entries], ["queued for 0", "queued for 10", "queued for 20", "done"])
+        self.assertEqual(entries[0]["sample_rate"], 10)
+
+
+class BenchmarkTests(TransactionTestCase):
+    """
+        runs outside of a transaction, the load test's threads read the dataset on their own connections
+    """
+
+    def test_seed_and_load_test(self):
+        """
+            tests that a seeded dataset is served to the load test, with the latency and SQL queries of each endpoint
+        """
+        counts = benchmark.seed_dataset(authors=12, posts_per_author=3, average_following=4, seed=3)
+        self.assertEqual(counts["authors"], 12)
+        self.assertEqual(Post.objects.count(), counts["posts"])
+        self.assertEqual(Follower.objects.count(), counts["follows"])
+        for image in Image.objects.all():
+            self.assertEqual(image.hash, hashlib.sha256(image.data).hexdigest())
+
+        results = benchmark.run_load_test(duration=30, concurrency=2, max_requests=12, page_size=5)
+        self.assertEqual(results["total"]["requests"], 12)
+        self.assertEqual(results["total"]["errors"], 0)
+        self.assertEqual(sum(summary["requests"] for summary in results["endpoints"].values()), 12)
+        self.assertGreater(results["total"]["queries"]["mean"], 0)
+        assert {"p50", "p95", "p99"} <= set(results["total"]["latency_ms"])
+        json.dumps(results)
+
+        self.assertEqual(benchmark.clear_dataset(), 12)
+        self.assertEqual(Author.objects.count(), 0)
+        self.assertEqual(Image.objects.count(), 0)
+
+    def test_federation_benchmark(self):
+        """
+            tests that every scenario is measured against the stub peers, and that they are removed afterwards
+        """
+        results = benchmark.run_federation_benchmark(followees=(2, 4), slow_fractions=(0, 0.5), peers=2, slow_latency="fixed:50",
+                                                     posts_per_author=3, feed_requests=2)
+        self.assertEqual([(row["followees"], row["slow_peers"]) for row in results["scenarios"]], [(2, 0), (4, 0), (2, 1), (4, 1)])
+        for row in results["scenarios"]:
+            self.assertEqual(row["synced"], row["followees"])
+            self.assertEqual(row["delivered"], row["followees"])
+            self.assertEqual(row["remote_authors_status"], 200)
+        self.assertGreaterEqual(results["scenarios"][2]["directory_seconds"], 0.05)
+        self.assertEqual(Node.objects.count(), 0)
+        self.assertEqual(Author.objects.count(), 0)
+
+    def test_percentile(self):
+        """
+            tests the nearest-rank percentiles
+        """
+        values = list(range(1, 101))
+        self.assertEqual(benchmark.percentile(values, 0.50), 50)
+        self.assertEqual(benchmark.percentile(values, 0.99), 99)
+        self.assertEqual(benchmark.percentile([7], 0.95), 7)
+        self.assertIsNone(benchmark.percentile([], 0.5))
+
+
+class StubNodeTests(TestCase):
+    def setUp(self):
+        utils._sessions.clear()
+        breaker._breakers.clear()
+        cache.clear()
+        self.author = Author.objects.create(email="author@test.ca", display_name="author", github="https://github.com", password="12345")
+
+    def start_stub(self, **kwargs):
+        stub = StubNode(authors=2, posts_per_author=5, **kwargs).start()
+        self.addCleanup(stub.stop)
+        node = stub.register()
+        for author_id in stub.get_author_ids():
+            remote = Author.objects.create(id=author_id, email=f"{author_id}@remote.test", display_name="remote author",
+                                           github="https://github.com", host=stub.url, url=stub.authors[author_id]["url"], is_remote=True)
+            create_follower(self.author, remote)
+        return stub, node
+
+    def test_posts_are_mirrored_from_the_stub(self):
+        """
+            tests that the stub answers the federation client like a node, pages and revalidations included
+        """
+        stub, node = self.start_stub(pagination="strict")
+        with self.settings(REMOTE_POST_SYNC_PAGE_SIZE=2):
+            result = sync_remote_posts()
+        self.assertEqual(result["failed"], 0)
+        self.assertEqual(RemotePost.objects.count(), 10)
+
+        RemotePostSync.objects.update(last_checked_at=timezone.now() - timezone.timedelta(days=1))
+        with self.settings(REMOTE_POST_SYNC_PAGE_SIZE=2):
+            result = sync_remote_posts()
+        self.assertEqual(result["unchanged"], 2)
+        self.assertEqual(stub.stats["not_modified"], 2)
+
+        response = utils.get_request_remote(node.host_url, "authors/")
+        self.assertEqual(len(response.json()["items"]), 2)
+
+    def test_failures_and_latency(self):
+        """
+            tests that the stub fails the share of requests it is set to, after its latency
+        """
+        stub, node = self.start_stub(latency="fixed:50", error_rate=1.0)
+        start = time.perf_counter()
+        response = utils.get_request_remote(node.host_url, f"authors/{stub.get_author_ids()[0]}")
+        self.assertGreaterEqual(time.perf_counter() - start, 0.05)
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(stub.stats["errors"], 1)
+
+    def test_parse_latency(self):
+        """
+            tests the latency specs
+        """
+        self.assertEqual(parse_latency("fixed:250")(None), 0.25)
+        self.assertTrue(0.01 <= parse_latency("uniform:10,20")(random.Random(0)) <= 0.02)
+        self.assertGreater(parse_latency("lognormal:100,0.5")(random.Random(0)), 0)
+        with self.assertRaises(ValueError):
+            parse_latency("normal:100")
+
+
+class RemoteAuthorDirectoryTests(TestCase):
+    def setUp(self):
+        utils._sessions.clear()
+        breaker._breakers.clear()
+        cache.clear()
+        self.author = Author.objects.create(email="author@test.ca", display_name="author", github="https://github.com", password="12345")
+        set_active(self.author)
+        self.client.force_login(self.author)
+
+    def start_node(self, routes, team_name="remote team"):
+        server = start_remote_node(routes)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        create_node(server, team_name)
+        return server
+
+    def remote_authors(self, server, *names):
+        return [{"type": "author", "id": f"{server.url}api/authors/{name}", "host": server.url, "displayName": name} for name in names]
+
+    def make_due(self):
+        RemoteAuthorSync.objects.update(last_checked_at=timezone.now() - timezone.timedelta(days=1))
+
+    def test_directory_is_paged_and_searched(self):
+        """
+            tests that the directory is read from every page of the node and served with cursor pagination and search
+        """
+        stub = StubNode(authors=5, posts_per_author=0, pagination="strict").start()
+        self.addCleanup(stub.stop)
+        stub.register()
+        with self.settings(REMOTE_AUTHOR_DIRECTORY_PAGE_SIZE=2):
+            result = refresh_remote_authors()
+        self.assertEqual(result, {"checked": 1, "unchanged": 0, "authors": 5, "failed": 0})
+
+        names, cursor = [], ""
+        while cursor is not None:
+            response = self.client.get(reverse("api:get_remote_authors"), {"cursor": cursor, "size": 2})
+            self.assertEqual(response.status_code, 200)
+            names += [author["displayName"] for author in response.json()["items"]]
+            cursor = response.json()["next"]
+        self.assertEqual(sorted(names), [f"stub node author {i}" for i in range(5)])
+        assert "partial" not in response.json()
+
+        # the search ranks the other authors, which match "author", after author 3
+        response = self.client.get(reverse("api:get_remote_authors"), {"q": "AUTHOR 3", "cursor": "", "size": 2})
+        self.assertEqual(response.json()["items"][0]["displayName"], "stub node author 3")
+        names = [author["displayName"] for author in response.json()["items"]]
+        response = self.client.get(reverse("api:get_remote_authors"), {"q": "AUTHOR 3", "cursor": response.json()["next"], "size": 10})
+        names += [author["displayName"] for author in response.json()["items"]]
+        self.assertEqual(sorted(names), [f"stub node author {i}" for i in range(5)])
+        self.assertIsNone(response.json()["next"])
+        response = self.client.get(reverse("api:get_remote_authors"), {"q": "zzz"})
+        self.assertEqual(response.json()["items"], [])
+
+        # an unchanged list costs a 304 on its first page
+        self.make_due()
+        with self.settings(REMOTE_AUTHOR_DIRECTORY_PAGE_SIZE=2):
+            result = refresh_remote_authors()
+        self.assertEqual(result["unchanged"], 1)
+        self.assertEqual(stub.stats["not_modified"], 1)
+
+    def test_directory_follows_the_node(self):
+        """
+            tests that authors that left the node's list are removed, and invalid or local authors are not listed
+        """
+        routes = {}
+        server = self.start_node(routes)
+        first_page = "/api/authors/?page=1&size=10"
+        local = {"type": "author", "id": "http://testserver/api/authors/local", "host": "http://testserver/", "displayName": "local"}
+        invalid = {"type": "author", "id": f"{server.url}api/authors/invalid", "host": "not a url", "displayName": "invalid"}
+        routes[first_page] = (200, {"type": "authors", "items": self.remote_authors(server, "stays", "leaves") + [local, invalid]})
+        with self.settings(REMOTE_AUTHOR_DIRECTORY_PAGE_SIZE=10):
+            refresh_remote_authors()
+            response = self.client.get(reverse("api:get_remote_authors"))
+            self.assertEqual(sorted(author["displayName"] for author in response.json()["items"]), ["leaves", "stays"])
+
+            routes[first_page] = (200, {"type": "authors", "items": self.remote_authors(server, "stays", "joins")})
+            self.make_due()
+            refresh_remote_authors()
+        response = self.client.get(reverse("api:get_remote_authors"))
+        self.assertEqual([author["displayName"] for author in response.json()["items"]], ["joins", "stays"])
+
+    def test_unfinished_walk_rereads_the_first_page(self):
+        """
+            tests that a node whose pages stopped at the page limit or the deadline has its first page read again, not a 304
+        """
+        routes = {}
+        server = self.start_node(routes)
+        routes["/api/authors/?page=1&size=2"] = (200, {"type": "authors", "items": self.remote_authors(server, "first", "second")})
+        routes["/api/authors/?page=2&size=2"] = (200, {"type": "authors", "items": self.remote_authors(server, "third")}, 0.5)
+
+        for limits in ({"REMOTE_AUTHOR_DIRECTORY_MAX_PAGES": 1}, {"REMOTE_AUTHOR_DIRECTORY_DEADLINE": 0.2}):
+            self.make_due()
+            with self.settings(REMOTE_AUTHOR_DIRECTORY_PAGE_SIZE=2, **limits):
+                refresh_remote_authors()
+            state = RemoteAuthorSync.objects.get()
+            self.assertEqual((state.etag, state.last_modified), ("", ""))
+
+        self.make_due()
+        server.received.clear()
+        with self.settings(REMOTE_AUTHOR_DIRECTORY_PAGE_SIZE=2):
+            result = refresh_remote_authors()
+        self.assertEqual(result["unchanged"], 0)
+        assert "If-None-Match" not in server.received[0][2]
+        self.assertEqual(RemoteAuthor.objects.count(), 3)
+
+    def test_nodes_are_refreshed_at_once(self):
+        """
+            tests that the slow nodes are refreshed concurrently, and the nodes never refreshed make the list partial
+        """
+        for i in range(3):
+            routes = {}
+            server = self.start_node(routes, f"team {i}")
+            routes["/api/authors/?page=1&size=10"] = (200, {"type": "authors", "items": self.remote_authors(server, f"author {i}")}, 0.5)
+
+        response = self.client.get(reverse("api:get_remote_authors"))
+        self.assertEqual(response.json()["items"], [])
+        self.assertTrue(response.json()["partial"])
+
+        start = time.time()
+        with self.settings(REMOTE_AUTHOR_DIRECTORY_PAGE_SIZE=10):
+            result = refresh_remote_authors()
+        self.assertLess(time.time() - start, 1.2)
+        self.assertEqual(result["authors"], 3)
+        # the session and its user, then the directory and the nodes never refreshed, whatever the number of nodes
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse("api:get_remote_authors"))
+        self.assertEqual(len(response.json()["items"]), 3)
+        assert "partial" not in response.json()
+
+
+class AuthorSearchTests(TestCase):
+    def setUp(self):
+        utils._sessions.clear()
+        breaker._breakers.clear()
+        cache.clear()
+        self.author = Author.objects.create(email="author@test.ca", display_name="searching author", github="https://github.com/searcher", password="12345")
+        set_active(self.author)
+        self.client.force_login(self.author)
+        for email, name, github in [("bob@test.ca", "Bob Marley", "https://github.com/bobm"), ("bobby@test.ca", "Bobby Tables", "https://github.com/xkcd"),
+                                    ("alice@test.ca", "Alice Smith", "https://github.com/robertson")]:
+            Author.objects.create(email=email, display_name=name, github=github, password="12345")
+
+    def search(self, q, **params):
+        response = self.client.get(reverse("api:search_authors"), {"q": q, **params})
+        self.assertEqual(response.status_code, 200)
+        return [author["displayName"] for author in response.json()["items"]]
+
+    def test_prefix_and_fuzzy_matches(self):
+        """
+            tests that whole words rank before prefixes, typos still match and github usernames are searched, without LIKE scans
+        """
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.search("bob"), ["Bob Marley", "Bobby Tables"])
+        # prefixes only, never a LIKE '%q%' scan
+        assert not any("%bob" in query["sql"] for query in queries.captured_queries)
+        self.assertEqual(self.search("marly"), ["Bob Marley"])
+        self.assertEqual(self.search("robertson"), ["Alice Smith"])
+        self.assertEqual(self.search("zzz"), [])
+        self.assertEqual(self.search("bob", page=2, size=1), ["Bobby Tables"])
+        self.assertEqual(self.client.get(reverse("api:search_authors"), {"q": "bob", "size": 1}).json()["next"], 2)
+        self.assertIsNone(self.client.get(reverse("api:search_authors"), {"q": "bob", "page": 2, "size": 1}).json()["next"])
+        # a page is a single search query, the matches aren't counted
+        with CaptureQueriesContext(connection) as queries:
+            self.search("bob")
+        assert not any("COUNT(*)" in query["sql"] for query in queries.captured_queries)
+        self.assertEqual(self.client.get(reverse("api:search_authors")).status_code, 400)
+
+    def test_index_follows_the_authors(self):
+        """
+            tests that the index is updated when authors are saved or deleted, staff authors are left out
+        """
+        bob = Author.objects.get(email="bob@test.ca")
+        bob.display_name = "Robert Nesta"
+        bob.save()
+        self.assertEqual(self.search("nesta"), ["Robert Nesta"])
+        self.assertEqual(self.search("marley"), [])
+        bob.delete()
+        self.assertEqual(self.search("nesta"), [])
+        Author.objects.create_superuser(email="staff@test.ca", display_name="staff bob", password="12345")
+        self.assertEqual(self.search("staff"), [])
+
+        # a login only saves last_login, the author isn't indexed again
+        with self.assertNumQueries(1):
+            self.author.save(update_fields=["last_login"])
+
+    def test_remote_authors_are_searched(self):
+        """
+            tests that the authors of the remote author directory are found, and removed with it
+        """
+        routes = {}
+        server = start_remote_node(routes)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        create_node(server)
+        first_page = "/api/authors/?page=1&size=10"
+        remote = {"type": "author", "id": f"{server.url}api/authors/1", "host": server.url, "displayName": "Bob Remote", "github": "https://github.com/remotebob"}
+        routes[first_page] = (200, {"type": "authors", "items": [remote]})
+        with self.settings(REMOTE_AUTHOR_DIRECTORY_PAGE_SIZE=10):
+            refresh_remote_authors()
+            self.assertEqual(self.search("bob"), ["Bob Marley", "Bob Remote", "Bobby Tables"])
+            self.assertEqual(self.search("remotebob"), ["Bob Remote"])
+
+            routes[first_page] = (200, {"type": "authors", "items": []})
+            RemoteAuthorSync.objects.update(last_checked_at=timezone.now() - timezone.timedelta(days=1))
+            refresh_remote_authors()
+        self.assertEqual(self.search("bob"), ["Bob Marley", "Bobby Tables"])
+
+        self.assertEqual(rebuild_author_search(), 4)
+        self.assertEqual(self.search("bob"), ["Bob Marley", "Bobby Tables"])
@@ -0,0 +1,147 @@
+from django.conf import settings
+from django.db.models import Count, Q
+from .models import Author, Follower, Post, Timeline
+from .pagination import keyset_condition, keyset_filter
+
+# The home feed of an author holds:
+#   - the PUBLIC posts of the people they follow
+#   - the FRIENDS posts of their friends (they follow each other)
+#   - their own FRIENDS posts
+# Posts are written into the feeds of their readers when they are created (fan-out on write), except for
+# authors with more than TIMELINE_FANOUT_LIMIT followers, whose posts are pulled in when the feed is read.
+
+
+def get_friend_ids(author_id):
+    """
+    Get the ids of the local authors that follow author_id and that author_id follows back
+    """
+    followed_ids = Follower.objects.filter(follower_id=author_id).values_list('followed_user', flat=True)
+    return set(Follower.objects.filter(
+        followed_user_id=author_id, follower_id__in=followed_ids, follower__is_remote=False
+    ).values_list('follower_id', flat=True))
+
+
+def is_pulled_on_read(author_id):
+    """
+    Authors with too many followers are not fanned out on write
+    """
+    return Follower.objects.filter(followed_user_id=author_id).count() > settings.TIMELINE_FANOUT_LIMIT
+
+
+def get_timeline_readers(post):
+    """
+    Get the ids of the local authors whose home feed should have the post
+    """
+    if post.visibility == "PUBLIC":
+        if is_pulled_on_read(post.author_id):
+            return set()
+        return set(Follower.objects.filter(
+            followed_user_id=post.author_id, follower__is_remote=False
+        ).values_list('follower_id', flat=True))
+
+    if post.visibility == "FRIENDS":
+        readers = {post.author_id}
+        if not is_pulled_on_read(post.author_id):
+            readers |= get_friend_ids(post.author_id)
+        return readers
+
+    return set()
+
+
+def _add_entries(owner_ids, posts):
+    Timeline.objects.bulk_create(
+        [Timeline(owner_id=owner_id, post_id=post.id, published=post.published) for owner_id in owner_ids for post in posts],
+        ignore_conflicts=True,
+    )
+
+
+def fan_out_post(post):
+    """
+    Make the home feeds match the post's current visibility, called whenever a post is saved
+    """
+    if post.author.is_remote:
+        return
+    readers = get_timeline_readers(post)
+    Timeline.objects.filter(post=post).exclude(owner_id__in=readers).delete()
+    _add_entries(readers, [post])
+
+
+def follow_added(follower, followed_user):
+    """
+    Backfill the home feeds after follower starts following followed_user
+    """
+    friends = Follower.objects.filter(follower=followed_user, followed_user=follower).exists()
+
+    if not follower.is_remote and not followed_user.is_remote and not is_pulled_on_read(followed_user.id):
+        visibility = ["PUBLIC", "FRIENDS"] if friends else ["PUBLIC"]
+        _add_entries([follower.id], Post.objects.filter(author=followed_user, visibility__in=visibility).only('id', 'published'))
+
+    # they are now friends, so followed_user also gets follower's friends only posts
+    if friends and not followed_user.is_remote and not follower.is_remote and not is_pulled_on_read(follower.id):
+        _add_entries([followed_user.id], Post.objects.filter(author=follower, visibility="FRIENDS").only('id', 'published'))
+
+
+def follow_removed(follower, followed_user):
+    """
+    Prune the home feeds after follower stops following followed_user
+    """
+    # follower no longer sees any of followed_user's posts
+    Timeline.objects.filter(owner=follower, post__author=followed_user).delete()
+    # they are no longer friends, so followed_user loses follower's friends only posts
+    Timeline.objects.filter(owner=followed_user, post__author=follower, post__visibility="FRIENDS").delete()
+
+
+def rebuild_timeline(owner):
+    """
+    Rebuild the home feed of a local author from scratch
+    """
+    following = Follower.objects.filter(follower=owner)
+    friend_ids = get_friend_ids(owner.id)
+    pulled_ids = get_pulled_author_ids(owner)
+
+    posts = Post.objects.filter(
+        Q(author__in=following.values_list('followed_user', flat=True), visibility="PUBLIC") |
+        Q(author__in=friend_ids, visibility="FRIENDS") |
+        Q(author=owner, visibility="FRIENDS")
+    ).exclude(author__in=pulled_ids - {owner.id}).only('id', 'published')
+
+    Timeline.objects.filter(owner=owner).delete()
+    _add_entries([owner.id], posts)
+
+
+def get_pulled_author_ids(owner):
+    """
+    Get the ids of the authors that owner follows whose posts are pulled on read
+    """
+    followed_ids = Follower.objects.filter(follower=owner).values_list('followed_user', flat=True)
+    return set(Author.objects.filter(id__in=followed_ids).annotate(
+        follower_count=Count('followers', distinct=True)
+    ).filter(follower_count__gt=settings.TIMELINE_FANOUT_LIMIT).values_list('id', flat=True))
+
+
+def get_home_timeline(owner_id, before=None):
+    """
+    Get the posts of owner_id's home feed, newest first.
+    If before = (published, post id) is given only the posts after it are returned (see api/pagination.py)
+    """
+    # the owner and the cursor are one filter() so both are on the owner's timeline rows
+    entries = Q(timeline_entries__owner_id=owner_id)
+    if before is not None:
+        entries &= keyset_condition(before, 'timeline_entries__published')
+    posts = Post.objects.filter(entries)
+
+    owner = Author.objects.filter(id=owner_id).first()
+    if owner is None:
+        return posts.select_related('author').order_by('-timeline_entries__published', '-id')
+
+    pulled_ids = get_pulled_author_ids(owner)
+    if pulled_ids:
+        # posts of very popular authors are not in the timeline table, read them directly
+        friend_ids = set(Follower.objects.filter(follower_id__in=pulled_ids, followed_user=owner).values_list('follower_id', flat=True))
+        pulled = keyset_filter(Post.objects.filter(
+            Q(author__in=pulled_ids, visibility="PUBLIC") | Q(author__in=friend_ids, visibility="FRIENDS")
+        ), before)
+        # a union can't select_related, PostSerializer loads the authors of the page in bulk instead
+        return posts.union(pulled).order_by('-published', '-id')
+
+    return posts.select_related('author').order_by('-timeline_entries__published', '-id')
@@ -1,9 +1,12 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import views, async_views
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 from rest_framework import permissions
 app_name = "api"
+# the views that mostly wait on other nodes are async when ASYNC_FEDERATION_VIEWS is on (see api/async_views.py)
+federation_views = async_views if settings.ASYNC_FEDERATION_VIEWS else views
 schema_view = get_schema_view(
    openapi.Info(
       title="Snack-Overflow-team API",
@@ -25,6 +28,8 @@ urlpatterns = [
    path("user/", views.UserView.as_view(), name="user"),
 
    path("authors/", views.get_authors, name="get_authors"),
+   path("authors/search", views.search_authors, name="search_authors"),
+   path("authors/search/", views.search_authors, name="search_authors_trailing_slash"),
    path("authors/<uuid:id>", views.get_and_update_author, name="get_and_update_author"),
 
    path("authors/<uuid:id>/", views.get_and_update_author, name="get_and_update_author_trailing_slash"),
@@ -53,23 +58,23 @@ urlpatterns = [
    path("authors/<uuid:id_author>/followrequests/<uuid:id_sender>/", views.get_create_delete_and_accept_follow_request, name="get_and_delete_a_follow_request_trailling_slash"),
 
    # apis for posts
-   path("authors/<uuid:id_author>/posts/", views.get_and_create_post, name="get_and_create_post"),
-   path("authors/<uuid:id_author>/posts/<uuid:id_post>/image", views.get_image, name="get_image"),
+   path("authors/<uuid:id_author>/posts/", federation_views.get_and_create_post, name="get_and_create_post"),
+   path("authors/<uuid:id_author>/posts/<uuid:id_post>/image", federation_views.get_image, name="get_image"),
    path("authors/<uuid:id_author>/posts/<uuid:id_post>", views.get_update_and_delete_specific_post, name="get_update_and_delete_specific_post"),
 
-   path("authors/<uuid:id_author>/posts/<uuid:id_post>/image/", views.get_image, name="get_image_trailing_slash"),
+   path("authors/<uuid:id_author>/posts/<uuid:id_post>/image/", federation_views.get_image, name="get_image_trailing_slash"),
    path("authors/<uuid:id_author>/posts/<uuid:id_post>/", views.get_update_and_delete_specific_post, name="get_update_and_delete_specific_post_trailling_slash"),
 
    # apis for comments
-   path("authors/<uuid:id_author>/posts/<uuid:id_post>/comments", views.get_and_create_comment, name="get_and_create_comment"),
+   path("authors/<uuid:id_author>/posts/<uuid:id_post>/comments", federation_views.get_and_create_comment, name="get_and_create_comment"),
 
-   path("authors/<uuid:id_author>/posts/<uuid:id_post>/comments/", views.get_and_create_comment, name="get_and_create_comment"),
+   path("authors/<uuid:id_author>/posts/<uuid:id_post>/comments/", federation_views.get_and_create_comment, name="get_and_create_comment"),
 
    # apis for likes
-   path("authors/<uuid:id_author>/posts/<uuid:id_post>/likes", views.get_post_likes, name="get_post_likes"),
+   path("authors/<uuid:id_author>/posts/<uuid:id_post>/likes", federation_views.get_post_likes, name="get_post_likes"),
    path("authors/<uuid:id_author>/liked", views.get_liked, name="get_liked"),
 
-   path("authors/<uuid:id_author>/posts/<uuid:id_post>/likes/", views.get_post_likes, name="get_post_likes_trailing_slash"),
+   path("authors/<uuid:id_author>/posts/<uuid:id_post>/likes/", federation_views.get_post_likes, name="get_post_likes_trailing_slash"),
    path("authors/<uuid:id_author>/liked/", views.get_liked, name="get_liked_trailing_slash"),
 
    # apis for inbox
@@ -83,8 +88,14 @@ urlpatterns = [
 
 
    # urls for remote stuff
+   # served from the remote author directory, the refresh_remote_authors worker keeps it up to date
    path("remote-authors/", views.get_remote_authors, name="get_remote_authors"),
-   # this should be called every x seconds from frontend
+   # the reconcile_follows worker keeps these up to date, they only return the stored state
    path("checkRemoteFollowRequests/<uuid:id_author>", views.check_remote_follow_requests_approved, name="check_remote_follow_requests_approved"),
    path("checkRemoteFollowers/<uuid:id_author>", views.check_remote_follower_still_exists, name="check_remote_follower_still_exists"),
+
+   # staff only stats on the pooled federation connections
+   path("federation-stats/", views.get_federation_stats, name="get_federation_stats"),
+   # staff only request metrics, for Prometheus
+   path("metrics", views.get_metrics, name="get_metrics"),
 ]
\ No newline at end of file
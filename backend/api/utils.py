@@ -1,90 +1,376 @@
+import contextvars
+import logging
 import requests
-from .models import Node
+import threading
+import hashlib
+import re
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from django.conf import settings
+from django.core.cache import cache
+from .nodes import get_node_by_host, get_node_registry
+from .breaker import NodeUnavailable, get_breaker, save_breaker_states
+from .metrics import record_node_call
+
+logger = logging.getLogger(__name__)
+
+# one pooled session per node, so connections to a peer are kept alive and reused
+# instead of paying a new TCP+TLS handshake on every federation call
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+# expired responses are kept this many extra seconds so they can still be revalidated with their ETag
+_REVALIDATE_WINDOW = 3600
+
+# remote posts already parsed out of node responses with their image urls rewritten (see get_remote_posts),
+# least recently used first, bounded by the size of the responses they came from
+_ingested_posts = OrderedDict()
+_ingested_sizes = {}
+_ingested_bytes = 0
+_ingested_lock = threading.Lock()
+
+# bounded pool shared by every request that fans out to several nodes at once
+_fanout_executor = ThreadPoolExecutor(max_workers=settings.FEDERATION_FANOUT_WORKERS, thread_name_prefix="federation")
+
+
+def get_node_session(node):
+    """
+    Get (or lazily create) the pooled requests session for a node
+    """
+    session = _sessions.get(node.id)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(node.id)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=settings.FEDERATION_POOL_SIZE)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.headers.update({
+                    "Accept-Encoding": "gzip, deflate",
+                    "Connection": "keep-alive",
+                })
+                _sessions[node.id] = session
+    return session
+
+
+def node_request(node, method, request_url, **kwargs):
+    """
+    Send a request to a node through its pooled session.
+    Connection errors are not caught here, callers decide how to handle them.
+    If the node's circuit breaker is open, NodeUnavailable (a ConnectionError) is raised without sending anything.
+    """
+    breaker = get_breaker(node)
+    if not breaker.allow_request():
+        raise NodeUnavailable(f"circuit open for node {node.team_name}")
+
+    headers = kwargs.pop("headers", {})
+    headers.setdefault("Authorization", f"Basic {node.base64_authorization}")
+    kwargs.setdefault("timeout", (settings.FEDERATION_CONNECT_TIMEOUT, settings.FEDERATION_READ_TIMEOUT))
+    start = time.perf_counter()
+    try:
+        response = get_node_session(node).request(method, request_url, headers=headers, **kwargs)
+    except requests.exceptions.RequestException as e:
+        record_node_call(node, time.perf_counter() - start)
+        breaker.record_failure(e)
+        raise
+    record_node_call(node, time.perf_counter() - start, response.status_code)
+
+    if response.status_code >= 500:
+        breaker.record_failure(f"{response.status_code} from {request_url}")
+    else:
+        breaker.record_success()
+    return response
+
+
+def get_session_stats():
+    """
+    Report how many requests each node's pools served and how many of them reused a kept-alive connection
+    """
+    stats = {}
+    for node_id, session in list(_sessions.items()):
+        node_requests = 0
+        node_connections = 0
+        for adapter in set(session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is not None:
+                    node_requests += pool.num_requests
+                    node_connections += pool.num_connections
+        stats[str(node_id)] = {
+            "requests": node_requests,
+            "connections": node_connections,
+            "reused": max(node_requests - node_connections, 0),
+        }
+    return stats
+
 
 def get_request_remote(host_url, path):
 
-    node = Node.objects.filter(host_url=host_url, is_active=True).first()
+    node = get_node_by_host(host_url, active=True)
     if node != None:
-        print("Node from get_request_remote: "+ node.team_name)
+        logger.debug("Node from get_request_remote: %s", node.team_name)
     else:
-        print("Node is none.")
+        logger.debug("Node is none.")
     if node:
-        request_url = f"{node.api_url}{path}"
+        response = get_request_node(node, path)
+        save_breaker_states()
+        return response
+            
+    else:
+        logger.warning("No active node found for host: %s", host_url)
+        return None
 
-        if node.team_name == 'TeamAttack':
-            # remove trailing slash from request_url if it exists
-            if request_url[-1] == '/':
-                request_url = request_url[:-1]
-                
-            print("Requesting from TeamAttack: ", request_url)
 
+def get_cache_ttl(path):
+    """
+    Get how many seconds a remote response for path stays fresh, 0 means it is never cached
+    """
+    for pattern, ttl in settings.FEDERATION_CACHE_TTLS:
+        if re.search(pattern, path):
+            return ttl
+    return 0
 
-        try:
-            response = requests.get(request_url, headers={'Authorization': f'Basic {node.base64_authorization}'})
-        except requests.exceptions.RequestException as e:
-            print("Request failed for node: ", node.team_name, node.api_url)
-            print("Error: ", e)
-            return None
 
-        if response.status_code == 403:
-            print("Authorization failed for node: ", node.team_name, node.api_url)
+def response_from_cache(entry):
+    """
+    Rebuild a requests response from a cached entry so callers can't tell the difference
+    """
+    response = requests.Response()
+    response.status_code = entry["status"]
+    response._content = entry["content"]
+    response.headers = CaseInsensitiveDict(entry["headers"])
+    response.encoding = entry["encoding"]
+    response.url = entry["url"]
+    return response
+
+
+def get_conditional_headers(entry):
+    """
+    Get the headers that revalidate a cached entry with the node
+    """
+    headers = {}
+    if entry is not None and entry["status"] == 200:
+        if entry["headers"].get("ETag"):
+            headers["If-None-Match"] = entry["headers"]["ETag"]
+        if entry["headers"].get("Last-Modified"):
+            headers["If-Modified-Since"] = entry["headers"]["Last-Modified"]
+    return headers
+
+
+def update_cache_entry(ttl, entry, response):
+    """
+    Work out what a fetch (response is None if the node was unreachable) does to the cached entry.
+    Returns (response for the caller, new entry or None to leave the cache alone, cache timeout)
+    """
+    now = time.time()
+
+    if response is None:
+        if entry is not None and entry["status"] == 200:
+            # the node is unreachable, keep serving what we have until it goes stale
+            return response_from_cache(entry), None, None
+        # briefly remember that the node is unreachable so we don't keep waiting on it
+        return None, {"status": None, "expires": now + settings.FEDERATION_CACHE_NEGATIVE_TTL}, settings.FEDERATION_CACHE_NEGATIVE_TTL
+
+    if response.status_code == 304 and entry is not None and entry["status"] == 200:
+        entry["expires"] = now + ttl
+        entry["stale_until"] = now + ttl + settings.FEDERATION_CACHE_STALE_TTL
+        return response_from_cache(entry), entry, ttl + settings.FEDERATION_CACHE_STALE_TTL + _REVALIDATE_WINDOW
+
+    if len(response.content) > settings.FEDERATION_CACHE_MAX_ENTRY_BYTES:
+        # too big to keep in memory
+        return response, None, None
+
+    if response.status_code == 200 or response.status_code == 404 or response.status_code >= 500:
+        if response.status_code != 200:
+            # errors are only cached briefly
+            ttl = settings.FEDERATION_CACHE_NEGATIVE_TTL
+        return response, {
+            "status": response.status_code,
+            "content": response.content,
+            "headers": {name: response.headers[name] for name in ("Content-Type", "ETag", "Last-Modified") if name in response.headers},
+            "encoding": response.encoding,
+            "url": response.url,
+            "expires": now + ttl,
+            "stale_until": now + ttl + (settings.FEDERATION_CACHE_STALE_TTL if response.status_code == 200 else 0),
+        }, ttl + settings.FEDERATION_CACHE_STALE_TTL + _REVALIDATE_WINDOW
+
+    return response, None, None
 
-        elif response.status_code == 500:
-            print("Internal server error for node: ", node.team_name, node.api_url)
 
-        elif response.status_code == 404:
-            print(f"Requested url {request_url} not found for node: ", node.team_name, node.api_url)
-        
-        # add more error code handling as needed
+def _refresh_cached_response(node, path, key, ttl, entry, lock_key=None):
+    """
+    Fetch path from the node, revalidating the cached entry if there is one, and update the cache
+    """
+    try:
+        response = _fetch_from_node(node, path, headers=get_conditional_headers(entry))
+        response, new_entry, timeout = update_cache_entry(ttl, entry, response)
+        if new_entry is not None:
+            cache.set(key, new_entry, timeout)
         return response
+    finally:
+        if lock_key is not None:
+            cache.delete(lock_key)
+
+
+def get_cache_key(node, path):
+    return f"remote:{node.id}:{hashlib.sha1(path.encode()).hexdigest()}"
+
+
+def get_request_node(node, path):
+    """
+    Send a get request for path to the given node, returns None if the node could not be reached.
+    Responses are cached per node and path for the ttl in FEDERATION_CACHE_TTLS.
+    """
+    ttl = get_cache_ttl(path)
+    if ttl <= 0:
+        return _fetch_from_node(node, path)
+
+    key = get_cache_key(node, path)
+    entry = cache.get(key)
+    now = time.time()
+
+    if entry is not None:
+        if now < entry["expires"]:
+            if entry["status"] is None:
+                return None
+            return response_from_cache(entry)
+
+        if entry["status"] == 200 and now < entry["stale_until"]:
+            # serve the stale copy right away and let a single background refresh update it
+            lock_key = f"{key}:refreshing"
+            if cache.add(lock_key, True, settings.FEDERATION_CONNECT_TIMEOUT + settings.FEDERATION_READ_TIMEOUT):
+                _fanout_executor.submit(_refresh_cached_response, node, path, key, ttl, entry, lock_key)
+            return response_from_cache(entry)
+
+    return _refresh_cached_response(node, path, key, ttl, entry)
+
+
+def get_node_request_url(node, path):
+    request_url = f"{node.api_url}{path}"
+
+    if node.team_name == 'TeamAttack':
+        # remove trailing slash from request_url if it exists
+        if request_url[-1] == '/':
+            request_url = request_url[:-1]
             
-    else:
-        print("No active node found for host: ", host_url)
+        logger.debug("Requesting from TeamAttack: %s", request_url)
+    return request_url
+
+
+def log_node_response(node, request_url, response):
+    if response.status_code == 403:
+        logger.warning("Authorization failed for node: %s %s", node.team_name, node.api_url)
+
+    elif response.status_code == 500:
+        logger.warning("Internal server error for node: %s %s", node.team_name, node.api_url)
+
+    elif response.status_code == 404:
+        logger.warning("Requested url %s not found for node: %s %s", request_url, node.team_name, node.api_url)
+    
+    # add more error code handling as needed
+
+
+def _fetch_from_node(node, path, headers=None):
+    """
+    Send a get request for path to the given node without going through the cache
+    """
+    request_url = get_node_request_url(node, path)
+
+    try:
+        response = node_request(node, "get", request_url, headers=headers or {})
+    except requests.exceptions.RequestException as e:
+        logger.warning("Request failed for node: %s %s: %s", node.team_name, node.api_url, e)
         return None
+
+    log_node_response(node, request_url, response)
+    return response
+
+
+def get_request_remote_many(targets, deadline=None, headers=None):
+    """
+    Send the get requests in targets ({key: (host_url, path)}) concurrently.
+    Returns ({key: response or None}, partial), partial is True if some requests missed the deadline
+    and their keys are left out of the responses.
+    The requests with headers ({key: headers}) go straight to the node, the caller keeps its own validators.
+    """
+    if deadline is None:
+        deadline = settings.FEDERATION_FANOUT_DEADLINE
+    headers = headers or {}
+
+    responses = {}
+    futures = {}
+    # nodes are resolved here so the worker threads never touch the database
+    for key, (host_url, path) in targets.items():
+        node = get_node_by_host(host_url, active=True)
+        if node is None:
+            logger.warning("No active node found for host: %s", host_url)
+            responses[key] = None
+        # run in the request's context, so the calls are counted in its metrics
+        elif key in headers:
+            futures[_fanout_executor.submit(contextvars.copy_context().run, _fetch_from_node, node, path, headers[key])] = key
+        else:
+            futures[_fanout_executor.submit(contextvars.copy_context().run, get_request_node, node, path)] = key
+
+    done, not_done = wait(futures, timeout=deadline)
+    for future in not_done:
+        future.cancel()
+    for future in done:
+        try:
+            responses[futures[future]] = future.result()
+        except Exception as e:
+            logger.warning("Fan-out request failed: %s", e)
+            responses[futures[future]] = None
+
+    save_breaker_states()
+    return responses, len(not_done) > 0
     
 
 def post_request_remote(host_url, path, data):
     
-        node = Node.objects.filter(host_url=host_url, is_active=True).first()
+        node = get_node_by_host(host_url, active=True)
     
         if node:
             request_url = f"{node.api_url}{path}"
             try:
-                response = requests.post(request_url, json=data, headers={'Authorization': f'Basic {node.base64_authorization}'})
+                response = node_request(node, "post", request_url, json=data)
             except requests.exceptions.RequestException as e:
-                print("Request failed for node: ", node.team_name, node.api_url)
-                print("Error: ", e)
+                logger.warning("Request failed for node: %s %s: %s", node.team_name, node.api_url, e)
                 return None
+            finally:
+                save_breaker_states()
     
             if response.status_code == 403:
-                print("Authorization failed for node: ", node.team_name, node.api_url)
+                logger.warning("Authorization failed for node: %s %s", node.team_name, node.api_url)
     
             elif response.status_code == 500:
-                print("Internal server error for node: ", node.team_name, node.api_url)
+                logger.warning("Internal server error for node: %s %s", node.team_name, node.api_url)
     
             elif response.status_code == 404:
-                print(f"Requested url {request_url} not found for node: ", node.team_name, node.api_url)
+                logger.warning("Requested url %s not found for node: %s %s", request_url, node.team_name, node.api_url)
             
             # add more error code handling as needed
                 
             return response
                 
         else:
-            print("No active node found for host: ", host_url)
+            logger.warning("No active node found for host: %s", host_url)
             return None
 
 
-def change_image_url(content, check_url ,api_url):
-    if f"![image]({check_url}" in content:
-        content = content.replace(f"![image]({check_url}", f"![image]({api_url}")
-    return content
-
-def check_content_type_and_change_url(content, nodes, api_url):
-    print(content)
-    if content.get('contentType') == 'text/markdown':
-        for node in nodes:
-            content['content'] = change_image_url(content.get('content'), node.api_url, api_url)
-    return content
+def rewrite_image_urls(post, api_url):
+    """
+    Point the markdown images of a remote post at our api, which serves them with the node's credentials.
+    One pass of the node registry's precompiled pattern over the content.
+    """
+    pattern = get_node_registry().image_url_pattern
+    if pattern is not None and post.get('contentType') == 'text/markdown' and post.get('content'):
+        post['content'] = pattern.sub(lambda match: f"![image]({api_url}", post['content'])
+    return post
 
 def get_our_host(request):
     protocol = 'https' if request.is_secure() else 'http'
@@ -93,11 +379,35 @@ def get_our_host(request):
 
     return host_url
 
-def check_content(post, request):
-    nodes = Node.objects.all()
 
+def get_remote_posts(response, request, single=False):
+    """
+    Get the posts of a node's response (the "items" of a list, or the post itself if single) with their image
+    urls rewritten. A response's posts are parsed and rewritten once, later reads of the same content get copies.
+    """
+    global _ingested_bytes
     api_url = get_our_host(request)
+    pattern = get_node_registry().image_url_pattern
+    # the pattern changes with the nodes, so a node change rewrites the posts again
+    key = (hashlib.sha1(response.content).hexdigest(), single, api_url, pattern)
+
+    with _ingested_lock:
+        posts = _ingested_posts.get(key)
+        if posts is not None:
+            _ingested_posts.move_to_end(key)
 
-    post = check_content_type_and_change_url(post, nodes, api_url)
+    if posts is None:
+        payload = response.json()
+        posts = [payload] if single else (payload.get('items') or [])
+        posts = [rewrite_image_urls(post, api_url) for post in posts]
+        with _ingested_lock:
+            if key not in _ingested_posts:
+                _ingested_posts[key] = posts
+                _ingested_sizes[key] = len(response.content)
+                _ingested_bytes += len(response.content)
+            while _ingested_bytes > settings.FEDERATION_INGESTED_POSTS_BYTES and len(_ingested_posts) > 1:
+                old_key, _ = _ingested_posts.popitem(last=False)
+                _ingested_bytes -= _ingested_sizes.pop(old_key)
 
-    return post
\ No newline at end of file
+    # the views add to the posts they send, they get their own copies
+    return [dict(post) for post in posts]
@@ -1,27 +1,42 @@
-from rest_framework.decorators import api_view, parser_classes
+from rest_framework.decorators import api_view, parser_classes, permission_classes
 from rest_framework.generics import get_object_or_404
 from rest_framework.response import Response
-from .models import Author, Follower, FollowRequest, Post, Comment, Like, Inbox, Node
+from .models import Author, Follower, FollowRequest, Post, Comment, Like, Inbox, Image, RemoteAuthor
 from .serializers import AuthorSerializer, FollowRequestSerializer, UserRegisterSerializer, UserLoginSerializer, PostSerializer, CommentSerializer, LikeSerializer, InboxSerializer
 from django.contrib.auth import login, logout
 from rest_framework import status, permissions
 from rest_framework.views import APIView
 from rest_framework.authentication import BasicAuthentication, SessionAuthentication
 from django.views import View
-from django.http import HttpResponse, HttpResponseNotFound
-import requests, json, os
+from django.http import HttpResponse, HttpResponseNotFound, FileResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+import json, os, io, logging
 from django.core.paginator import Paginator
 from drf_yasg.utils import swagger_auto_schema
+from drf_yasg import openapi
 from django.contrib.auth import authenticate
 import uuid
 from itertools import chain
-from api.utils import get_request_remote, check_content, post_request_remote
+from api.utils import get_request_remote, get_remote_posts, post_request_remote, get_session_stats
+from api.outbox import queue_remote_delivery
+from api.nodes import get_node_by_host, get_nodes
+from api.timeline import get_home_timeline
+from api.relationships import get_relationships
+from api.mirror import get_mirrored_posts, get_synced_author_ids
+from api.directory import get_unsynced_node_count
+from api.search import find_authors
+from api.pagination import paginate_by_cursor, paginate_by_offset_cursor, get_cursor_page_size, decode_cursor, split_page
+from api.metrics import render_metrics
+from api.log import SAMPLED
+from api.images import get_image_variant, get_variant_name, get_variant_width, VARIANT_FORMATS
 from rest_framework.parsers import FormParser, MultiPartParser, JSONParser
-import base64
 from django.http import Http404
 import validators
 from urllib.parse import unquote, quote
 
+logger = logging.getLogger(__name__)
+
 #TODO: does a post not have a like value?
 #TODO: should comment have content type like post?
 
@@ -157,11 +172,58 @@ def get_authors(request):
         authors = paginator.get_page(page_number)
         response["page"] = authors.number
         response["size"] = size
+    # cursor pagination: ?cursor= for the first page, then the "next" cursor of the previous page
+    elif 'cursor' in request.query_params:
+        authors, response["next"] = paginate_by_cursor(authors, request.query_params['cursor'], size, field='created_at', attr='created_at')
+        response["size"] = size
 
     serializer = AuthorSerializer(authors, many=True)
     response["items"] = serializer.data
     return Response(response)
 
+@swagger_auto_schema(
+        method="get",
+        operation_summary="searches the local and remote authors",
+        operation_description="Returns the local authors and the authors of the remote author directory whose display name or github username \
+            match q, best match first. A query word matches the words it starts, and names that are close to it (trigram similarity). \
+            Paginated with page and size (default 1 and 10), next is the number of the next page or null on the last page.",
+        manual_parameters=[
+            openapi.Parameter('q', openapi.IN_QUERY, type=openapi.TYPE_STRING, required=True),
+            openapi.Parameter('page', openapi.IN_QUERY, type=openapi.TYPE_INTEGER, required=False),
+            openapi.Parameter('size', openapi.IN_QUERY, type=openapi.TYPE_INTEGER, required=False),
+        ],
+        responses={200: "Ok", 400: "Bad Request"},
+)
+@api_view(['GET'])
+def search_authors(request):
+    """
+    Search the local and remote authors
+    """
+    query = request.query_params.get('q', '').strip()
+    if not query:
+        return Response({"details": "q is required"}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        page_number = max(int(request.query_params.get('page', 1)), 1)
+        size = int(request.query_params.get('size', 10))
+    except ValueError:
+        return Response({"details": "page and size must be integers"}, status=status.HTTP_400_BAD_REQUEST)
+    if size <= 0:
+        size = 10
+
+    # the ranking is done on the index (see api/search.py), only the page's authors are serialized
+    request_domain = request.build_absolute_uri('/')[:-1]
+    entries = find_authors(query).exclude(remote_author__host__startswith=request_domain)
+    # one more than the page tells if there is a next page, without counting the matches
+    page = list(entries[(page_number - 1) * size:page_number * size + 1])
+    items = [AuthorSerializer(entry.author).data if entry.author is not None else entry.remote_author.data for entry in page[:size]]
+    return Response({
+        "type": "authors",
+        "page": page_number,
+        "size": size,
+        "next": page_number + 1 if len(page) > size else None,
+        "items": items,
+    })
+
 @swagger_auto_schema(
         method="get",
         operation_summary="gets the authors with the given id",   
@@ -229,7 +291,7 @@ def get_followers(request, id):
     Get all followers of a single profile
     """
     author = get_object_or_404(Author, id=id)
-    followers = author.followers.all()
+    followers = author.followers.select_related('follower')
 
     followers_set = set()
     for follower_object in followers:
@@ -292,19 +354,19 @@ def get_update_and_delete_follower(request, id_author, id_follower):
         if author.exists() and author.count() == 1:
             follower, created = Follower.objects.get_or_create(follower_id=id_follower, followed_user_id=id_author)
 
-            print("ACCEPTING FOLLOW REQUEST ==> CREATE NEW FOLLOW")
-            print("before follower host: ", follower.follower.host)
+            logger.debug("ACCEPTING FOLLOW REQUEST ==> CREATE NEW FOLLOW")
+            logger.debug("before follower host: %s", follower.follower.host)
 
             # send a get request to authors/<uuid:requesting_author>/followers/<path:foreign_author_id>/accept
             if "testing" in follower.follower.host:
                 try:
-                    print("testing for team OK")
-                    print("follower host: ", follower.follower.host)
-                    print("follower id: ", follower.follower.id)
-                    print("path: ", f"authors/{follower.follower.id}/followers/{quote(follower.followed_user.url)}/accept")
+                    logger.debug("testing for team OK")
+                    logger.debug("follower host: %s", follower.follower.host)
+                    logger.debug("follower id: %s", follower.follower.id)
+                    logger.debug("path: authors/%s/followers/%s/accept", follower.follower.id, quote(follower.followed_user.url))
                     response = get_request_remote(host_url=follower.follower.host, path=f"authors/{follower.follower.id}/followers/{quote(follower.followed_user.url)}/accept")
                 except:
-                    print("ERROR sending request to /accept for team OK")
+                    logger.warning("ERROR sending request to /accept for team OK")
 
 
             return Response(status=status.HTTP_201_CREATED)
@@ -328,7 +390,7 @@ def get_followings(request, id_author):
     Get all followings of a single profile
     """
     author = get_object_or_404(Author, id=id_author)
-    followings = author.following.all()
+    followings = author.following.select_related('followed_user')
 
     followings_set = set()
     for following_object in followings:
@@ -358,7 +420,7 @@ def get_friends(request, id_author):
     followers = author.followers.all()
 
     # for my following, check if they are also in my followers
-    friends = following.filter(followed_user__in=followers.values_list('follower', flat=True))    
+    friends = following.filter(followed_user__in=followers.values_list('follower', flat=True)).select_related('followed_user')
     # print(friends)
 
     friends_set = set()
@@ -384,7 +446,7 @@ def get_received_follow_requests(request, id):
     Get all received friend requests
     """
     author = get_object_or_404(Author, id=id)
-    follow_requests = author.received_follow_requests.all()
+    follow_requests = author.received_follow_requests.select_related('from_user', 'to_user')
 
     serializer = FollowRequestSerializer(follow_requests, context={'request': request}, many=True)
     response = {
@@ -406,7 +468,7 @@ def get_sent_follow_requests(request,id):
     """
 
     author= get_object_or_404(Author, id=id)
-    sent_follow_requests = FollowRequest.objects.filter(from_user_id=id)
+    sent_follow_requests = FollowRequest.objects.filter(from_user_id=id).select_related('from_user', 'to_user')
     serializer = FollowRequestSerializer(sent_follow_requests, context={'request': request}, many=True)
     response = {
         "type": "followrequests",
@@ -505,7 +567,7 @@ def get_all_public_posts(request):
     if request.method == 'GET':
         page_number = request.query_params.get('page', 0)
         size = request.query_params.get('size', 0)
-        posts = Post.objects.filter(visibility="PUBLIC").order_by('-published')
+        posts = Post.objects.filter(visibility="PUBLIC").select_related('author').order_by('-published')
         if int(page_number) and int(size):
             paginator = Paginator(posts, size)
             posts = paginator.get_page(page_number)
@@ -515,6 +577,15 @@ def get_all_public_posts(request):
                 "items": serializer.data,
             }
             return Response(response)
+        elif 'cursor' in request.query_params:
+            posts, next_cursor = paginate_by_cursor(posts, request.query_params['cursor'], get_cursor_page_size(request))
+            serializer = PostSerializer(posts, context={'request': request}, many=True)
+            response = {
+                "type": "posts",
+                "items": serializer.data,
+                "next": next_cursor,
+            }
+            return Response(response)
         else:
             serializer = PostSerializer(posts, context={'request': request}, many=True)
             response = {
@@ -540,112 +611,89 @@ def get_all_friends_follows_posts(request, id_author):
     and the friends only posts of the people I am friends with (they follow and I follow them)
     """
     userId = id_author
-    print("userId: ", userId)
-    print("getting all friends and follows posts")
+    logger.debug("userId: %s", userId)
+    logger.debug("getting all friends and follows posts")
     if request.method == 'GET':
         if userId is None:
             return Response({"details":"User is not authenticated"}, status=status.HTTP_401_UNAUTHORIZED)
         else:
-            following = Follower.objects.filter(follower__id=userId)
+            # the remote posts come from the mirror (see api/mirror.py), the feed doesn't wait on the other nodes
+            remote_author_ids = get_feed_remote_authors(request, userId)
+            remote_posts = get_feed_remote_posts(request, userId, remote_author_ids)
+            # the authors whose posts were never mirrored yet are missing from the feed
+            partial = len(get_synced_author_ids(remote_author_ids)) < len(remote_author_ids)
+            return Response(get_feed_response(request, userId, remote_posts, partial))
 
-            followers = Follower.objects.filter(followed_user__id=userId)
 
-            friends = following.filter(followed_user__in=followers.values_list('follower', flat=True))
+def get_feed_remote_authors(request, userId):
+    """
+    Get the ids of the remote authors whose posts go in the feed
+    """
+    # with cursor pagination the remote posts can't be paged, they all come with the first page
+    if request.query_params.get('cursor'):
+        return []
 
-            public_posts = Post.objects.filter(author__in=following.values_list('followed_user', flat=True), visibility="PUBLIC")
+    # remote friends are a subset of the remote following
+    remote_author_ids = list(Follower.objects.filter(follower__id=userId, followed_user__is_remote=True).values_list('followed_user_id', flat=True))
+    # which of them are friends is loaded once for all of them
+    get_relationships(request, userId).load(remote_author_ids)
+    return remote_author_ids
 
-            friends_posts = Post.objects.filter(author__in=friends.values_list('followed_user', flat=True), visibility="FRIENDS")
 
-            own_friends_only_posts = Post.objects.filter(author__id=userId, visibility="FRIENDS")
-            
-            # get all the following whose is_remote is true
-            remote_following = following.filter(followed_user__is_remote=True)
-            remote_following_posts_list = []
-            # get all the posts of the remote following
-            for remote_author in remote_following:
-                response = get_request_remote(host_url=remote_author.followed_user.host, path=f"authors/{remote_author.followed_user.id}/posts/")
-
-                if response is not None:
-                    if response.status_code == 200:
-                        all_posts = response.json().get('items')
-                        for post in all_posts:
-                            # check if the post type is public
-                            # filter the post so that the post id is not equal to the post source
-                            print("source: ", post.get("source"))
-                            print("id: ", post.get("id"))
-                            if post.get("source") and post.get("source") != post.get("id"):
-                                print("going to continue")
-                                continue
-                            else:
-                                print("good")
-                            if post.get('visibility').upper() == "PUBLIC":
-                                post = check_content(post, request)
-                                remote_following_posts_list.append(post)
-                    else:
-                        print("remote_following_posts error: ", response.status_code)
-            print("remote_following_posts_list: ", remote_following_posts_list)
-            # get all the friends whose is_remote is true            
-            remote_friends = friends.filter(followed_user__is_remote=True)
-            print("remote_friends: ", remote_friends)
-            remote_friends_posts_list = []
-            # get all the posts of the remote friends
-            for remote_author in remote_friends:
-                response = get_request_remote(host_url=remote_author.followed_user.host, path=f"authors/{remote_author.followed_user.id}/posts/")
-                
-                if response is not None:
-                    if response.status_code == 200:
-                        all_posts = response.json().get('items')
-
-                        for post in all_posts:
-                            print("source 2: ", post.get("source"))
-                            print("id 2: ", post.get("id"))
-                            if post.get("source") and post.get("source") != post.get("id"):
-                                print("going to continue 2")
-                                continue
-                            else:
-                                print("good 2")
-                            if post.get('visibility').upper() == "FRIENDS":
-                                print("freins post")
-                                post = check_content(post, request)
-                                remote_friends_posts_list.append(post)
-            # print("remote_friends_posts_list: ", remote_friends_posts_list)
-
-            posts = public_posts.union(friends_posts)
-
-            posts = posts.union(own_friends_only_posts)
-            # pagination
-            page_number = request.query_params.get('page', 0)
-            size = request.query_params.get('size', 0)
-            if int(page_number) and int(size):
-                paginator = Paginator(posts, size)
-                posts = paginator.get_page(page_number)
-                serializer = PostSerializer(posts, context={'request': request}, many=True)
-            
-                #responseSerializer = PostSerializer(remote_following_posts.union(remote_friends_posts), context={'request': request}, many=True)
-                items = serializer.data + remote_following_posts_list + remote_friends_posts_list
-                # print("items: ", items)
-                # items = serializer.data + responseSerializer.data
-                response = {
-                    "type": "posts",
-                    "items": items,
-                }
-                return Response(response)
-            else:
-                print("before serializer")
-                try:
-                    serializer = PostSerializer(posts, context={'request': request}, many=True)
-                    #responseSerializer = PostSerializer(remote_following_posts.union(remote_friends_posts), context={'request': request}, many=True)
-                    items = serializer.data + remote_following_posts_list + remote_friends_posts_list
-                    # print("items: ", items)
-                    # items = serializer.data + responseSerializer.data
-                    response = {
-                        "type": "posts",
-                        "items": items,
-                    }
-                    return Response(response)
-                except Exception as e:
-                    print(str(e))
-                return Response(response)
+def get_feed_remote_posts(request, userId, remote_author_ids):
+    """
+    Pick the posts that go in the feed out of the remote authors' mirrored posts
+    """
+    if not remote_author_ids:
+        return []
+    relationships = get_relationships(request, userId)
+    # public posts of the people I follow, friends only posts of the people I am friends with
+    remote_following_posts_list = get_mirrored_posts(request, remote_author_ids, "PUBLIC")
+    friend_ids = [author_id for author_id in remote_author_ids if relationships.is_friend(author_id)]
+    remote_friends_posts_list = get_mirrored_posts(request, friend_ids, "FRIENDS") if friend_ids else []
+
+    # filter the post so that the post id is not equal to the post source
+    return [post for post in remote_following_posts_list + remote_friends_posts_list if not post.get("source") or post.get("source") == post.get("id")]
+
+
+def get_feed_response(request, userId, remote_posts, partial):
+    """
+    Build the feed page, the local posts come from the timeline table
+    """
+    # the local posts are materialized in the timeline table when they are created
+    posts = get_home_timeline(userId)
+    cursor = request.query_params.get('cursor')
+
+    # pagination
+    page_number = request.query_params.get('page', 0)
+    size = request.query_params.get('size', 0)
+    if int(page_number) and int(size):
+        paginator = Paginator(posts, size)
+        posts = paginator.get_page(page_number)
+        serializer = PostSerializer(posts, context={'request': request}, many=True)
+        response = {
+            "type": "posts",
+            "items": serializer.data + remote_posts,
+        }
+    elif cursor is not None:
+        size = get_cursor_page_size(request)
+        posts, next_cursor = split_page(get_home_timeline(userId, before=decode_cursor(cursor) if cursor else None)[:size + 1], size)
+        serializer = PostSerializer(posts, context={'request': request}, many=True)
+        response = {
+            "type": "posts",
+            "items": serializer.data + remote_posts,
+            "next": next_cursor,
+        }
+    else:
+        logger.debug("before serializer")
+        serializer = PostSerializer(posts, context={'request': request}, many=True)
+        response = {
+            "type": "posts",
+            "items": serializer.data + remote_posts,
+        }
+    if partial:
+        response["partial"] = True
+    return response
 
 @swagger_auto_schema(
         method="get",
@@ -685,55 +733,28 @@ def get_and_create_post(request, id_author):
         if author is None:
             return Response(status=status.HTTP_404_NOT_FOUND)
         elif author.is_remote:
+            if get_synced_author_ids([id_author]):
+                # followed here, so their posts are mirrored (see api/mirror.py)
+                return Response(get_remote_author_posts_response(request, get_mirrored_posts(request, [id_author]), id_author))
+
             response = get_request_remote(host_url=author.host, path=f"authors/{id_author}/posts/")
 
             if response is not None and response.status_code == 200:
-                all_posts = response.json().get('items')
-                posts = []
-                for post in all_posts:
-                    # check if the post type is public
-                    post = check_content(post, request)
-                    if post.get('visibility').upper() == "PUBLIC":
-                        posts.append(post)
-                    if userId is not None:
-                        follower = Follower.objects.filter(follower__id=id_author, followed_user__id=userId).exists()
-                        following = Follower.objects.filter(follower__id=userId, followed_user__id=id_author).exists()
-                        if follower and following:
-                            if post.get('visibility').upper() == "FRIENDS":
-                                posts.append(post)
-                if int(page_number) and int(size):
-                    paginator = Paginator(posts, size)
-                    posts = paginator.get_page(page_number)
-                    response = {
-                        "type": "posts",
-                        "items": posts,
-                    }
-                    return Response(response)
-                else:
-                    response = {
-                        "type": "posts",
-                        "items": posts,
-                    }
-                    return Response(response)
+                return Response(get_remote_author_posts_response(request, get_remote_posts(response, request), id_author))
+            return Response({"details": "Error getting posts from remote server"}, status=status.HTTP_400_BAD_REQUEST)
         else:
             # the author is in our local server
-            print("userId remote",userId)
-            if userId is None:
-                posts = Post.objects.filter(author=author, visibility="PUBLIC")
-            elif userId == id_author:
+            logger.debug("userId remote %s", userId)
+            relationships = get_relationships(request)
+            if relationships.is_self(id_author):
                 posts = Post.objects.filter(author=author)
+            elif relationships.can_see_friends_posts(id_author):
+                # a friend of the author, or a remote node
+                posts = Post.objects.filter(author=author, visibility__in=["PUBLIC", "FRIENDS"])
             else:
-                # check if the user is a friend of the author
-                follower = Follower.objects.filter(follower__id=id_author, followed_user__id=userId).exists()
-                following = Follower.objects.filter(follower__id=userId, followed_user__id=id_author).exists()
-                print("user: ", user)
-                print("user remote", user.is_remote)
-                if (follower and following) or user.is_remote:
-                    posts = Post.objects.filter(author=author, visibility__in=["PUBLIC", "FRIENDS"])
-                else:
-                    posts = Post.objects.filter(author=author, visibility="PUBLIC")
-            print("all posts",posts)
-            posts = posts.order_by('-published')
+                posts = Post.objects.filter(author=author, visibility="PUBLIC")
+            logger.debug("all posts %s", posts)
+            posts = posts.select_related('author').order_by('-published')
             if int(page_number) and int(size):
                 paginator = Paginator(posts, size)
                 posts = paginator.get_page(page_number)
@@ -743,6 +764,15 @@ def get_and_create_post(request, id_author):
                     "items": serializer.data,
                 }
                 return Response(response)
+            elif 'cursor' in request.query_params:
+                posts, next_cursor = paginate_by_cursor(posts, request.query_params['cursor'], get_cursor_page_size(request))
+                serializer = PostSerializer(posts, context={'request': request}, many=True)
+                response = {
+                    "type": "posts",
+                    "items": serializer.data,
+                    "next": next_cursor,
+                }
+                return Response(response)
             else:
                 serializer = PostSerializer(posts, context={'request': request}, many=True)
                 response = {
@@ -752,10 +782,10 @@ def get_and_create_post(request, id_author):
                 return Response(response)
 
     if request.method == 'POST':
-        print("inside post")
+        logger.debug("inside post")
         if userId != id_author:
-            print("userId",userId)
-            print("id_author",id_author)
+            logger.debug("userId %s", userId)
+            logger.debug("id_author %s", id_author)
             return Response({"detail":"Can't create post for another user"}, status=status.HTTP_401_UNAUTHORIZED)
         # requestData = dict(request.data)
         requestData = request.data
@@ -764,7 +794,7 @@ def get_and_create_post(request, id_author):
 
         if serializer.is_valid():
             serializer.save(author=author)
-            print("Post created")
+            logger.info("Post created")
             # send the serializer.data (post) to the inbox of the author's followers
             # send the post to the author's followers or friends
             # check if the post is coming from our host. If its from our host do this else just add that to the inbox (everything is correct in that case)
@@ -773,11 +803,7 @@ def get_and_create_post(request, id_author):
             post = Post.objects.filter(id=postId).first()
             postType = post.visibility
 
-            # slice out the data:image... section of the base64 string
-            if post.contentType == "image/jpeg;base64":
-                post.content = post.content[23:]
-            elif post.contentType == "image/png;base64":
-                post.content = post.content[22:]
+            # the base64 content of image posts was moved into the Image table when the post was saved (see Post.save)
 
             # set the origin for the post
             if post.origin == "":
@@ -787,17 +813,17 @@ def get_and_create_post(request, id_author):
             post.save()
             
             if postType == "PUBLIC":
-                print("Public post")
+                logger.debug("Public post")
                 followers = Follower.objects.filter(followed_user__id=id_author)
                 for follower in followers:
                     # check if the follower is in another server and if it is then send the request
                     followerAuthor = Author.objects.filter(id=follower.follower.id).first()
                     if followerAuthor.is_remote:
-                        print("Remote author")
+                        logger.debug("Remote author", extra=SAMPLED)
                         # send the request to the remote server
                         host_url = followerAuthor.host
 
-                        node = Node.objects.filter(host_url=host_url).first()
+                        node = get_node_by_host(host_url)
 
                         request_url = f"{node.api_url}authors/{follower.follower.id}/inbox"
 
@@ -808,33 +834,31 @@ def get_and_create_post(request, id_author):
                         }
 
                         if "testing" in request_url:
-                            print("testing url")
+                            logger.debug("testing url", extra=SAMPLED)
                             post_payload = serializer.data
-                            print("post payload for team ok", post_payload)
+                            logger.debug("post payload for team ok %s", post_payload, extra=SAMPLED)
 
-                        response = requests.post(request_url, json=post_payload, headers={'Authorization': f'Basic {node.base64_authorization}'})
-                        if response.status_code ==200:
-                            print("Post sent to the remote server inbox")
-                        else:
-                            print("Error sending the post to the remote server inbox")
-                            print(response.status_code, response.text)
-                            return Response(response.text, status=response.status_code)
+                        # queue it, the outbox worker delivers it so a slow or failing node doesn't hold up the other followers
+                        queue_remote_delivery(node, request_url, post_payload)
+                        logger.info("Post queued for the remote server inbox", extra=SAMPLED)
                     else:
                         requestData = serializer.data
                         inboxSerializer = InboxSerializer(data=requestData, context={'request': request})
                         if inboxSerializer.is_valid():
                             inboxSerializer.save()
             elif postType == "FRIENDS":
-                print("Friends post")
-                followers = Follower.objects.filter(followed_user__id=id_author)
+                logger.debug("Friends post")
+                followers = Follower.objects.filter(followed_user__id=id_author).select_related('follower')
+                # the followers the author follows back are the friends, checked all at once
+                relationships = get_relationships(request, id_author)
+                relationships.load([follower.follower_id for follower in followers])
                 for follower in followers:
-                    followerObject = Follower.objects.filter(follower__id=id_author, followed_user__id=follower.follower.id).first()
-                    if followerObject is not None:
-                        friendAuthor = Author.objects.filter(id=follower.follower.id).first()
+                    if relationships.follows(follower.follower_id):
+                        friendAuthor = follower.follower
                         if friendAuthor.is_remote:
                             # send the request to the remote server
                             host_url = friendAuthor.host
-                            node = Node.objects.filter(host_url=host_url).first()
+                            node = get_node_by_host(host_url)
                             request_url = f"{node.api_url}authors/{follower.follower.id}/inbox"
                             post_payload = {
                                 "type":"inbox",
@@ -845,62 +869,187 @@ def get_and_create_post(request, id_author):
                             # like this
                             # { serializer.data, "viewing_author": id_author}
                             if "testing" in request_url:
-                                print("testing url")
+                                logger.debug("testing url", extra=SAMPLED)
                                 post_payload = serializer.data
-                                print("post payload for team ok", post_payload)
+                                logger.debug("post payload for team ok %s", post_payload, extra=SAMPLED)
                             
-                            response = requests.post(request_url, json=post_payload, headers={'Authorization': f'Basic {node.base64_authorization}'})
-                            if response.status_code ==200:
-                                print("Post sent to the remote server inbox")
-                            else:
-                                print("Error sending the post to the remote server inbox")
-                                print(response.status_code)
-                                return Response({"details":"wrong response"}, status=response.status_code)
+                            queue_remote_delivery(node, request_url, post_payload)
+                            logger.info("Post queued for the remote server inbox", extra=SAMPLED)
                         else:
                             requestData = serializer.data
                             inboxSerializer = InboxSerializer(data=requestData, context={'request': request})
                             if inboxSerializer.is_valid():
                                 inboxSerializer.save()
             else:
-                print("unlisted post")
+                logger.debug("unlisted post")
 
             return Response(serializer.data, status=status.HTTP_201_CREATED)
-        print("Here:",serializer.errors)
+        logger.warning("Post is not valid: %s", serializer.errors)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+def get_remote_author_posts_response(request, remote_posts, id_author):
+    """
+    Pick the posts of a remote author the user may see out of the posts their node serves
+    """
+    page_number = request.query_params.get('page', 0)
+    size = request.query_params.get('size', 0)
+    friends = get_relationships(request).is_friend(id_author)
+
+    posts = []
+    for post in remote_posts:
+        # check if the post type is public
+        if post.get('visibility').upper() == "PUBLIC":
+            posts.append(post)
+        if friends:
+            if post.get('visibility').upper() == "FRIENDS":
+                posts.append(post)
+    if int(page_number) and int(size):
+        paginator = Paginator(posts, size)
+        posts = paginator.get_page(page_number)
+    return {
+        "type": "posts",
+        "items": list(posts),
+    }
+
+
+def get_image_cache_control(request, post):
+    """
+    The image of a post can change when the post is edited, so it is revalidated with its ETag,
+    except when the url pins the version with ?v=<ETag>, then it never changes
+    """
+    scope = "public" if post.visibility == "PUBLIC" else "private"
+    if request.query_params.get('v', '').strip('"') == post.image_id:
+        return f"{scope}, max-age=31536000, immutable"
+    return f"{scope}, no-cache"
+
+
+def parse_byte_range(header, size):
+    """
+    Parse a single range Range header (bytes=start-end, bytes=start- or bytes=-suffix).
+    Returns (start, end) inclusive, None to send the whole image or False if the range can't be satisfied
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start, _, end = header[6:].strip().partition("-")
+    try:
+        if start == "":
+            # the last end bytes
+            start, end = max(size - int(end), 0), None
+        else:
+            start, end = int(start), int(end) if end else None
+    except ValueError:
+        return None
+    if end is not None and start > end:
+        # not a valid range, it's ignored
+        return None
+    if start >= size:
+        return False
+    return start, size - 1 if end is None else min(end, size - 1)
+
+
+def serve_image_file(request, file, size, content_type, etag, cache_control, read_range=None):
+    """
+    Stream an image file, or the part of it asked for with a Range header.
+    With read_range(start, end) the part is read without the file, file is then a function opening it for the whole image
+    """
+    byte_range = None
+    if request.headers.get('If-Range', etag) == etag:
+        byte_range = parse_byte_range(request.headers.get('Range'), size)
+
+    if byte_range is False:
+        if read_range is None:
+            file.close()
+        response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        response["Content-Range"] = f"bytes */{size}"
+        return response
+    if byte_range is not None:
+        start, end = byte_range
+        if read_range is None:
+            file.seek(start)
+            part = file.read(end - start + 1)
+            file.close()
+        else:
+            part = read_range(start, end)
+        response = FileResponse(io.BytesIO(part), content_type=content_type, status=status.HTTP_206_PARTIAL_CONTENT)
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+    else:
+        response = FileResponse(file if read_range is None else file(), content_type=content_type)
+
+    response["ETag"] = etag
+    response["Accept-Ranges"] = "bytes"
+    response["Cache-Control"] = cache_control
+    return response
+
+
 @swagger_auto_schema(
         method="get",
         operation_summary="gets the image of the post with the given id_post and id_author",
-        operation_description="Returns the image of the post with the given id_post. The post has to be in the server. Otherwise it will return a 404 error.",
-        responses={200: "Ok", 404: "Not found"},
+        operation_description="Returns the image of the post with the given id_post. The post has to be in the server. Otherwise it will return a 404 error.\
+            The response has a strong ETag (If-None-Match gets a 304) and supports Range requests. Adding ?v=<ETag> to the url makes the response cacheable forever.\
+            ?w=<width> resizes the image (the width is rounded up to 64, 160, 320, 640 or 1280) and ?fmt=<webp|jpeg|png> re-encodes it.",
+        manual_parameters=[
+            openapi.Parameter('w', openapi.IN_QUERY, type=openapi.TYPE_INTEGER, required=False),
+            openapi.Parameter('fmt', openapi.IN_QUERY, type=openapi.TYPE_STRING, enum=["webp", "jpeg", "png"], required=False),
+        ],
+        responses={200: "Ok", 206: "Partial Content", 304: "Not Modified", 400: "Bad Request", 404: "Not found", 416: "Range Not Satisfiable"},
 )
 @api_view(['GET'])
 def get_image(request, id_author, id_post):
     author = Author.objects.filter(id=id_author).first()
     if not author:
         raise Http404("Author does not exist.")
-    if author.is_remote:
+    # the async view (see api/async_views.py) already asked the node when it hands the request over
+    if author.is_remote and not getattr(request, 'remote_image_fetched', False):
         response = get_request_remote(host_url=author.host, path=f"authors/{id_author}/posts/{id_post}/image")
 
         if response is not None and response.status_code == 200:
-            print("response", response)
+            logger.debug("response %s", response)
             return HttpResponse(response.content, content_type=response.headers.get('Content-Type'))
     try:
+        # the image bytes are only loaded once we know the client doesn't already have them
         post = Post.objects.get(id=id_post, author__id=id_author)
 
-        if not post.contentType.startswith("image/"):
+        if not post.contentType.startswith("image/") or not post.image_id:
             raise Http404("No image found.")
 
-        # if full dataURL given, parse out, otherwise decode as given
-        if post.content[:4] == "data":
-            format, imgstr = post.content.split(';base64,') 
-            data = base64.b64decode(imgstr) # Decoding the base64 string to image data
-        else:
-            data = base64.b64decode(post.content)
+        # resized or re-encoded variant, ?w=<width>&fmt=<webp|jpeg|png>
+        width = request.query_params.get('w')
+        fmt = request.query_params.get('fmt', post.contentType.split(";")[0].split("/")[-1]).lower()
+        if width is not None:
+            if not width.isdigit() or int(width) <= 0:
+                return Response({"details": "w has to be a positive number"}, status=status.HTTP_400_BAD_REQUEST)
+            width = get_variant_width(int(width))
+        if fmt not in VARIANT_FORMATS:
+            return Response({"details": f"fmt has to be one of {', '.join(VARIANT_FORMATS)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        if width is not None or 'fmt' in request.query_params:
+            # the hash of the original and the variant parameters make a strong ETag for the variant
+            etag = quote_etag(get_variant_name(post.image_id, width, fmt))
+            not_modified = get_conditional_response(request, etag=etag)
+            if not_modified is not None:
+                not_modified["Cache-Control"] = get_image_cache_control(request, post)
+                return not_modified
+
+            file = get_image_variant(post.image_id, width, fmt, lambda: bytes(Image.objects.get(hash=post.image_id).data))
+            if file is not None:
+                return serve_image_file(request, file, os.fstat(file.fileno()).st_size, VARIANT_FORMATS[fmt][1], etag, get_image_cache_control(request, post))
+            # the variant couldn't be made, send the original
+
+        # the image hash is a strong ETag, a matching If-None-Match gets a 304 without reading the image
+        etag = quote_etag(post.image_id)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            not_modified["Cache-Control"] = get_image_cache_control(request, post)
+            return not_modified
+
+        # a Range request only reads its part of the image from the database
+        image = Image.objects.defer('data').get(hash=post.image_id)
+        return serve_image_file(
+            request, lambda: io.BytesIO(Image.objects.values_list('data', flat=True).get(hash=image.hash)), image.size, image.content_type,
+            etag, get_image_cache_control(request, post), read_range=lambda start, end: Image.objects.read_range(image.hash, start, end),
+        )
 
-        return HttpResponse(data, content_type=post.contentType) # correct MIME type
-    
     except Post.DoesNotExist:
         raise Http404("Post does not exist.")
 
@@ -937,7 +1086,6 @@ def get_update_and_delete_specific_post(request, id_author, id_post):
     """
     Get, update, or delete a single post
     """
-    print("wasdasdjasjdnasdjnasdjn")
     user = request.user
     if(isinstance(user, Author)):
         userId = user.id
@@ -945,19 +1093,18 @@ def get_update_and_delete_specific_post(request, id_author, id_post):
         userId = None
 
     if request.method == 'GET':
-        print("id_author", id_author)
+        logger.debug("id_author %s", id_author)
         post_author = get_object_or_404(Author, id=id_author)
-        print("post_author",post_author)
+        logger.debug("post_author %s", post_author)
         if post_author.is_remote:
             # send the request to the remote server
             response = get_request_remote(host_url=post_author.host, path=f"authors/{id_author}/posts/{id_post}")
 
             if response is not None:
                 if response.status_code == 200:
-                    response_json = response.json()
+                    response_json = get_remote_posts(response, request, single=True)[0]
                     response_json["author"] = response_json.get('author').get("id").split("/")[-1]
                     response_json["author"] = Author.objects.filter(id = response_json["author"]).first()
-                    response_json = check_content(response_json, request)
 
                     # create the new post object
                     new_post = Post(response_json)
@@ -980,23 +1127,21 @@ def get_update_and_delete_specific_post(request, id_author, id_post):
                 else:
                     return Response(response.text, status=response.status_code)
                         
-        print("before post")
+        logger.debug("before post")
         post = get_object_or_404(Post, id=id_post)
-        print("after post")
+        logger.debug("after post")
         serializer = PostSerializer(post, context={'request': request})
         if post.visibility == "PUBLIC" or userId == id_author:
-            print("public post")
+            logger.debug("public post")
             return Response(serializer.data)
         elif post.visibility == "FRIENDS":
-            print("friends post")
+            logger.debug("friends post")
             if userId is None:
                 return Response(status=status.HTTP_401_UNAUTHORIZED)
-            follower = Follower.objects.filter(follower__id=id_author, followed_user__id=userId).exists()
-            following = Follower.objects.filter(follower__id=userId, followed_user__id=id_author).exists()
-            if (follower and following) or user.is_remote:
+            if get_relationships(request).can_see(id_author, post.visibility):
                 return Response(serializer.data)
             else:
-                print("Post not found with friends")
+                logger.debug("Post not found with friends")
                 return Response(status=status.HTTP_404_NOT_FOUND)
         elif post.visibility == "UNLISTED":
             return Response(serializer.data)
@@ -1065,7 +1210,7 @@ def get_and_create_comment(request, id_author, id_post):
         post = get_object_or_404(Post, id=id_post)
         page_number = request.query_params.get('page', 0)
         size = request.query_params.get('size', 0)
-        comments = Comment.objects.filter(post=post).order_by('-published')
+        comments = Comment.objects.filter(post=post).select_related('author', 'post__author').order_by('-published')
         if int(page_number) and int(size):
             paginator = Paginator(comments, size)
             comments = paginator.get_page(page_number)
@@ -1075,6 +1220,15 @@ def get_and_create_comment(request, id_author, id_post):
                 "items": serializer.data,
             }
             return Response(response)
+        elif 'cursor' in request.query_params:
+            comments, next_cursor = paginate_by_cursor(comments, request.query_params['cursor'], get_cursor_page_size(request))
+            serializer = CommentSerializer(comments, context={'request': request}, many=True)
+            response = {
+                "type": "comments",
+                "items": serializer.data,
+                "next": next_cursor,
+            }
+            return Response(response)
         else:
             serializer = CommentSerializer(comments, context={'request': request}, many=True)
             response = {
@@ -1140,13 +1294,13 @@ def get_post_likes(request, id_author, id_post):
     post_author = get_object_or_404(Author, id=id_author)
     if post_author.is_remote:
 
-        print("BEFORE RESPONSE")
+        logger.debug("BEFORE RESPONSE")
         # send the request to the remote server
         response = get_request_remote(host_url=post_author.host, path=f"authors/{id_author}/posts/{id_post}/likes")
-        print("AFTER RESPONSE")
+        logger.debug("AFTER RESPONSE")
 
         if response is not None:
-            print("RESPONSE CODE: ", response.status_code)
+            logger.debug("RESPONSE CODE: %s", response.status_code)
             if response.status_code == 200:
                 return Response(response.json())
             else:
@@ -1155,7 +1309,7 @@ def get_post_likes(request, id_author, id_post):
             return Response({"details": "Error getting likes from remote server"}, status=status.HTTP_400_BAD_REQUEST)
         
     post = get_object_or_404(Post, id=id_post, author__id=id_author)
-    likes = Like.objects.filter(post=post)
+    likes = Like.objects.filter(post=post).select_related('author', 'post__author')
     
     serializer = LikeSerializer(likes, context={'request': request}, many=True)
     response = {
@@ -1188,7 +1342,7 @@ def get_liked(request, id_author):
             else:
                 return Response(response.text, status=response.status_code)
             
-    likes = Like.objects.filter(author=author)
+    likes = Like.objects.filter(author=author).select_related('author', 'post__author')
     serializer = LikeSerializer(likes, context={'request': request}, many=True)
     response = {
         "type": "likes",
@@ -1231,7 +1385,7 @@ def get_and_post_inbox(request, id_author):
     else:
         userId = None
 
-    print("User: ", userId)
+    logger.debug("User: %s", userId)
 
     if request.method == 'GET':
         author = get_object_or_404(Author, id=id_author)
@@ -1250,6 +1404,16 @@ def get_and_post_inbox(request, id_author):
                 "items": serializer.data,
             }
             return Response(response)
+        elif 'cursor' in request.query_params:
+            inbox, next_cursor = paginate_by_cursor(inbox, request.query_params['cursor'], get_cursor_page_size(request))
+            serializer = InboxSerializer(inbox, context={'request': request}, many=True)
+            response = {
+                "type": "inbox",
+                "author": request.build_absolute_uri(f"/api/authors/{id_author}"),
+                "items": serializer.data,
+                "next": next_cursor,
+            }
+            return Response(response)
         else:
             serializer = InboxSerializer(inbox, context={'request': request}, many=True)
             response = {
@@ -1284,7 +1448,7 @@ def get_and_post_inbox(request, id_author):
                 # except create the payload for the request, else do what we are doing currently
                 # send the request to the remote server
                 host_url = author.host
-                node = Node.objects.filter(host_url=host_url).first()
+                node = get_node_by_host(host_url)
                 request_url = f"{node.api_url}authors/{id_author}/inbox"
                 postId = item.get("object").split("/")[-1]
                 item["object"] = f"{node.api_url}authors/{id_author}/posts/{postId}"
@@ -1299,7 +1463,7 @@ def get_and_post_inbox(request, id_author):
                     }],
                 }
 
-                print("LIKE PAYLOAD: ", like_payload)
+                logger.debug("LIKE PAYLOAD: %s", like_payload)
                 
                 if "testing" in request_url:
                     like_payload = {
@@ -1308,22 +1472,11 @@ def get_and_post_inbox(request, id_author):
                         "summary": likeAuthor.display_name + " liked your post",
                         "object": item.get("object"),
                     }
-                    print("sending to team OK like payload", like_payload)
+                    logger.debug("sending to team OK like payload %s", like_payload)
                 
-                response = post_request_remote(host_url=author.host, path=f"authors/{id_author}/inbox", data=like_payload)
-
-                print("AFTER LIKE PAYLOAD SENDING REMOTE")
-
-                if response is not None:
-                    if response.status_code ==200 or response.status_code == 201: 
-                        print("Like sent to the remote server inbox")
-                        return Response({"details":"like sent"}, status=response.status_code)
-                    else:
-                        print("Error sending the like to the remote server inbox")
-                        print(response.status_code)
-                        return Response({"details":"like sent error"}, status=response.status_code)
-                else:
-                    return Response({"details":"Error sending the like to the remote server inbox"}, status=status.HTTP_400_BAD_REQUEST)
+                queue_remote_delivery(node, request_url, like_payload)
+                logger.info("Like queued for the remote server inbox")
+                return Response({"details":"like queued"}, status=status.HTTP_202_ACCEPTED)
                 
 
             likeData = item.copy()
@@ -1336,7 +1489,7 @@ def get_and_post_inbox(request, id_author):
                         return Response({"details":"object have a comment"}, status=status.HTTP_200_OK)
                     else:
                         if "testing" in likeAuthor.host:
-                            print("testing request for team ok")
+                            logger.debug("testing request for team ok")
                             if objectString is not None or objectString != "":
                                 if "posts" in objectString:
                                     if "comments" in objectString:
@@ -1345,34 +1498,34 @@ def get_and_post_inbox(request, id_author):
                                         postId = objectString.split("/")[-1]
 
                                     likeData["post"] = get_object_or_404(Post, id=postId).id
-                                    print(likeData["post"])
+                                    logger.debug("like post: %s", likeData["post"])
                                 else:
                                     return Response({"details":"object should have a post"}, status=status.HTTP_400_BAD_REQUEST)
                             else:
                                 return Response({"details":"object is required"}, status=status.HTTP_400_BAD_REQUEST)
                         elif "linkup" in likeAuthor.host:
                             fakePostId = objectString.split("/")[-1]
-                            print("fakePostId: ", fakePostId)
+                            logger.debug("fakePostId: %s", fakePostId)
                             request_url_fakepostId = "".join(["authors", objectString.split("authors")[1]])
                             #make a request to the remote server to get the post
                             response = get_request_remote(host_url=likeAuthor.host, path=f"{request_url_fakepostId}")
-                            print(request_url_fakepostId)
+                            logger.debug("request_url_fakepostId: %s", request_url_fakepostId)
                             if response is not None:
-                                print(response.status_code)
+                                logger.debug("response code: %s", response.status_code)
                                 if response.status_code == 200:
-                                    print("getting post")
+                                    logger.debug("getting post")
                                     post = response.json()
-                                    print(post)
+                                    logger.debug("post: %s", post)
                                     postId = post.get("source").split("/")[-1]
-                                    print(postId)
+                                    logger.debug("postId: %s", postId)
                                     likeData["post"] = get_object_or_404(Post, id=postId).id
-                                    print(likeData["post"])
+                                    logger.debug("like post: %s", likeData["post"])
                                 else:
                                     return Response(response.text, status=response.status_code) 
                             else:
                                 return Response({"details":"Error getting the post from the remote server"}, status=status.HTTP_400_BAD_REQUEST)
                         elif "3rdTeam" in likeAuthor.host:
-                            print("likeAuthor.host: ", likeAuthor.host)
+                            logger.debug("likeAuthor.host: %s", likeAuthor.host)
                         else:
                             # for our remote node
                             if objectString is not None or objectString != "":
@@ -1404,16 +1557,16 @@ def get_and_post_inbox(request, id_author):
             
             likeExists = Like.objects.filter(author=likeAuthor, post=likeData["post"]).exists()
             
-            print("checking likeExists")
+            logger.debug("checking likeExists")
 
             if likeExists:
-                print("likeExists")
+                logger.debug("likeExists")
                 return Response({"details":"like already exists"}, status=status.HTTP_400_BAD_REQUEST)
 
             likeSerializer = LikeSerializer(data=likeData, context={'request': request})
-            print("likeSerializer created")
+            logger.debug("likeSerializer created")
             if likeSerializer.is_valid():
-                print("saving likeSerializer")
+                logger.debug("saving likeSerializer")
                 likeSerializer.save()
                 requestData["item"] = likeSerializer.data
             else:
@@ -1421,13 +1574,13 @@ def get_and_post_inbox(request, id_author):
 
         elif itemType == "follow":
             # send the follow request to the objectAuthor's inbox - frontend
-            print("we are in follow")
+            logger.debug("we are in follow")
 
             actor = item.get("actor")
             object = item.get("object")
 
-            print("actor: ", actor)
-            print("object: ", object)
+            logger.debug("actor: %s", actor)
+            logger.debug("object: %s", object)
             if actor is None or object is None:
                 return Response({"details":"actor and object are required"}, status=status.HTTP_400_BAD_REQUEST)
             
@@ -1436,8 +1589,8 @@ def get_and_post_inbox(request, id_author):
             actorId = actor.get("id").split("/")[-1]
             objectId = object.get("id").split("/")[-1]
 
-            print("actorId: ", actorId)
-            print("objectId: ", objectId)
+            logger.debug("actorId: %s", actorId)
+            logger.debug("objectId: %s", objectId)
 
             if objectId != str(id_author):
                 return Response({"details":"Can't send follow request to someone else's inbox"}, status=status.HTTP_401_UNAUTHORIZED)
@@ -1448,7 +1601,7 @@ def get_and_post_inbox(request, id_author):
             if actorAuthor is None:
                 # actorAuthor is most likely from another server
                 # create a new author with the actor's details
-                print("Creating actor author...")
+                logger.debug("Creating actor author...")
                 actorAuthor = Author.objects.create(
                     id=actorId, 
                     host=actor.get("host"), 
@@ -1458,12 +1611,12 @@ def get_and_post_inbox(request, id_author):
                     profile_image=actor.get("profileImage"),
                     is_remote=True
                 )
-                print("after creating actor author...")
+                logger.debug("after creating actor author...")
             if objectAuthor is None or objectAuthor.is_remote:
                 # the id_author is remote now
                 # most likely a remote author,  create the author
                 # need to send to the remote user inbox
-                print("Creating object author...")
+                logger.debug("Creating object author...")
                 if objectAuthor is None:
                     objectAuthor = Author.objects.create(
                         id=objectId, 
@@ -1474,24 +1627,24 @@ def get_and_post_inbox(request, id_author):
                         profile_image=object.get("profileImage"),
                         is_remote=True
                     )
-                print("after creating object author...")
+                logger.debug("after creating object author...")
                 
                 author = Author.objects.filter(id=id_author).first()
 
-                print("Author in creating object author: ", author)
+                logger.debug("Author in creating object author: %s", author)
 
                 # now we need to send it to remote server
-                node = Node.objects.filter(host_url = author.host).first()
-                print("Node: ", node)
+                node = get_node_by_host(author.host)
+                logger.debug("Node: %s", node)
 
                 request_url = f"{node.api_url}authors/{id_author}/inbox"
-                print("Request url: ", request_url)
+                logger.debug("Request url: %s", request_url)
                 
                 actorAuthorSerializerDict = AuthorSerializer(actorAuthor, context={'request': request}).data
                 objectAuthorSerializerDict = AuthorSerializer(objectAuthor, context={'request': request}).data
 
-                print(actorAuthorSerializerDict)
-                print(objectAuthorSerializerDict)
+                logger.debug("actor author: %s", actorAuthorSerializerDict)
+                logger.debug("object author: %s", objectAuthorSerializerDict)
 
                 actor["id"] = f"{actorAuthorSerializerDict.get('host')}api/authors/{actorId}"
                 object["id"] = f"{objectAuthorSerializerDict.get('host')}api/authors/{objectId}"
@@ -1516,51 +1669,23 @@ def get_and_post_inbox(request, id_author):
                         "actor": actor,
                         "object": object
                     }
-                    print("sending to team OK follow payload", payload)
+                    logger.debug("sending to team OK follow payload %s", payload)
 
 
-                print("encoding: ", node.base64_authorization)
+                followRequest = FollowRequest.objects.filter(from_user=actorAuthor, to_user=objectAuthor).exists()
+        
+                if followRequest:
+                    return Response({"details":f"{actorAuthor.display_name} already follows {objectAuthor.display_name}"}, status=status.HTTP_400_BAD_REQUEST)
 
+                # create a follow request and queue it for the remote inbox, the outbox worker delivers it
                 try:
-                    response = requests.post(request_url, json=payload, headers={'Authorization': f'Basic {node.base64_authorization}'})
+                    newFollowRequest = FollowRequest.objects.create(from_user=actorAuthor, to_user=objectAuthor)
+                    queue_remote_delivery(node, request_url, payload)
+                    serializer = FollowRequestSerializer(newFollowRequest, context={'request': request})
                 except Exception as e:
-                    print("Error sending the follow request to the remote server inbox")
-                    print(str(e))
                     return Response({"details":str(e)}, status=status.HTTP_400_BAD_REQUEST)
-
-                # print("Response: ", response.status_code, response.json())
-                
-
-                if (response.status_code != 201) and (response.status_code != 200):
-                    print("Not 201")
-                    print(response.status_code)
-                    print(response.json())
-                    return Response(status=status.HTTP_400_BAD_REQUEST)
-                else:
-                    print("Yes 201 or 200")
-
-                    followRequest = FollowRequest.objects.filter(from_user=actorAuthor, to_user=objectAuthor).exists()
-            
-                    if followRequest:
-                        return Response({"details":f"{actorAuthor.display_name} already follows {objectAuthor.display_name}"}, status=status.HTTP_400_BAD_REQUEST)
-                    
-                    followRequestData = {
-                        "from_user": actorAuthor,
-                        "to_user": objectAuthor
-                    }
-                    # create a follow request
-                    try:
-                        newFollowRequest = FollowRequest.objects.create(from_user=actorAuthor, to_user=objectAuthor)
-                        serializer = FollowRequestSerializer(newFollowRequest, context={'request': request})
-                        requestData["item"] = serializer.data
-                    except Exception as e:
-                        return Response({"details":str(e)}, status=status.HTTP_400_BAD_REQUEST)
-                    # if resposne.json exist sent it
-                    # else return the response
-                    try:
-                        return Response(response.json(), status=response.status_code)
-                    except Exception as e:
-                        return Response({"details":"correct response"}, status=response.status_code)
+                logger.info("Follow request queued for the remote server inbox")
+                return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
 
             followRequest = FollowRequest.objects.filter(from_user=actorAuthor, to_user=objectAuthor).exists()
             
@@ -1575,7 +1700,7 @@ def get_and_post_inbox(request, id_author):
             try:
                 newFollowRequest = FollowRequest.objects.create(from_user=actorAuthor, to_user=objectAuthor)
                 serializer = FollowRequestSerializer(newFollowRequest, context={'request': request})
-                print("follow request created")
+                logger.info("follow request created")
                 requestData["item"] = serializer.data
             except Exception as e:
                 return Response({"details":str(e)}, status=status.HTTP_400_BAD_REQUEST)
@@ -1600,7 +1725,7 @@ def get_and_post_inbox(request, id_author):
             if author.is_remote:
                 # send the request to the remote server
                 host_url = author.host
-                node = Node.objects.filter(host_url=host_url).first()
+                node = get_node_by_host(host_url)
                 request_url = f"{node.api_url}authors/{id_author}/inbox"
                 item_author_id = item.get("author").get("id").split("/")[-1]
                 item_author = Author.objects.filter(id=item_author_id).first()
@@ -1609,9 +1734,9 @@ def get_and_post_inbox(request, id_author):
                 item["post"]["id"] = f"{node.api_url}authors/{id_author}/posts/{psot_id}"
                 if "testing" in request_url:
                     item["post"] = item["post"]["id"]
-                    print("item post sending to team ok", item["post"])
+                    logger.debug("item post sending to team ok %s", item["post"])
                     comment_payload = item
-                    print("sending to team OK comment payload", comment_payload)
+                    logger.debug("sending to team OK comment payload %s", comment_payload)
                 else:
                     item["id"] = item.get("post").get("id")
                     comment_payload = {
@@ -1620,27 +1745,19 @@ def get_and_post_inbox(request, id_author):
                         "items":[item],
                     }
 
-                    print("ITEM: ", item)
-                    print("COMMENT PAYLOAD for team HTTP: ", comment_payload)
+                    logger.debug("ITEM: %s", item)
+                    logger.debug("COMMENT PAYLOAD for team HTTP: %s", comment_payload)
 
-                response = requests.post(request_url, json=comment_payload, headers={'Authorization': f'Basic {node.base64_authorization}'})
-                if response.status_code ==201 or response.status_code ==200:
-                    print("Comment sent to the remote server inbox")
-                    try:
-                        return Response(response.json(), status=response.status_code)
-                    except Exception as e:
-                        return Response({"details":"correct response"}, status=response.status_code)
-                else:
-                    print("Error sending the comment to the remote server inbox")
-                    print(response.status_code, response.text)
-                    return Response(response.text, status=response.status_code)
+                queue_remote_delivery(node, request_url, comment_payload)
+                logger.info("Comment queued for the remote server inbox")
+                return Response({"details":"comment queued"}, status=status.HTTP_202_ACCEPTED)
             commentAuthorId = item.get("author").get("id").split("/")[-1]
 
             # check if the comment author is in our server
             commentAuthor = Author.objects.filter(id=commentAuthorId).first()
             if commentAuthor is None:
                 # do something - create an author copy
-                print("Comment author is not in our server")
+                logger.debug("Comment author is not in our server")
                 return
             commentData = item.copy()
             commentData["author"] = commentAuthor.id
@@ -1650,26 +1767,26 @@ def get_and_post_inbox(request, id_author):
                 if "linkup" in commentAuthor.host:
                     getPostUrl = item.get("id").split("/")[:-2]
                     getPostUrl = "/".join(getPostUrl)
-                    print("getPostUrl: ", getPostUrl)
+                    logger.debug("getPostUrl: %s", getPostUrl)
                     request_url_fakepostId = "".join(["authors", getPostUrl.split("authors")[1]])
-                    print("request_url_fakepostId: ", request_url_fakepostId)
+                    logger.debug("request_url_fakepostId: %s", request_url_fakepostId)
                     response = get_request_remote(host_url=commentAuthor.host, path=f"{request_url_fakepostId}")
                     if response is not None:
                         if response.status_code == 200:
-                            print("getting post for commenting")
+                            logger.debug("getting post for commenting")
                             post = response.json()
-                            print(post)
+                            logger.debug("post: %s", post)
                             postId = post.get("source").split("/")[-1]
-                            print(postId)
+                            logger.debug("postId: %s", postId)
                             commentData["post"] = get_object_or_404(Post, id=postId).id
-                            print(commentData["post"])
+                            logger.debug("comment post: %s", commentData["post"])
                         else:
                             return Response(response.text, status=response.status_code)
                     else:
-                        print("response is none")
+                        logger.warning("response is none")
                 elif "testing" in commentAuthor.host:
-                    print("testing comment request for team ok")
-                    print(item.get("post"))
+                    logger.debug("testing comment request for team ok")
+                    logger.debug("item post: %s", item.get("post"))
                     postId = item.get("post").split("/")[-1]
                     commentData["post"] = get_object_or_404(Post, id=postId).id
                     
@@ -1680,17 +1797,13 @@ def get_and_post_inbox(request, id_author):
                     commentData["post"] = item.get("post").get("id").split("/")[-1]    
             else:
                 commentData["post"] = item.get("post").get("id").split("/")[-1]
-            #increment the comment count in the post
-            post = Post.objects.filter(id=commentData["post"]).first()
-            post.count += 1
-            post.save()
-
+            # the comment count of the post is incremented when the comment is saved (see api/counters.py)
             commentSerializer = CommentSerializer(data=commentData, context={'request': request})
             if commentSerializer.is_valid():
                 commentSerializer.save()
                 requestData["item"] =  commentSerializer.data
             else:
-                print(commentSerializer.errors)
+                logger.warning("Comment is not valid: %s", commentSerializer.errors)
                 return Response(commentSerializer.errors, status=status.HTTP_400_BAD_REQUEST)
         else:
             return Response({"details":"item type is required and should be one of post, comment, like, follow"}, status=status.HTTP_400_BAD_REQUEST)
@@ -1702,8 +1815,7 @@ def get_and_post_inbox(request, id_author):
             inboxSerializer.save()
             return Response(inboxSerializer.data, status=status.HTTP_201_CREATED)
 
-        print("inboxSerializer.errors")
-        print(inboxSerializer.errors)
+        logger.warning("inboxSerializer.errors: %s", inboxSerializer.errors)
         return Response(inboxSerializer.errors, status=status.HTTP_400_BAD_REQUEST)
             
     if request.method == 'DELETE':
@@ -1717,91 +1829,112 @@ def get_and_post_inbox(request, id_author):
     
 
 
+@swagger_auto_schema(
+        method="get",
+        operation_summary="gets the authors of the other nodes",
+        operation_description="Returns the authors of the other nodes from the remote author directory, newest first. \
+            The refresh_remote_authors worker keeps it up to date in the background. Cursor paginated (Optional, ?cursor= for the first page), \
+            q searches the display names and github usernames like /api/authors/search, best match first.",
+        manual_parameters=[
+            openapi.Parameter('q', openapi.IN_QUERY, type=openapi.TYPE_STRING, required=False),
+            openapi.Parameter('cursor', openapi.IN_QUERY, type=openapi.TYPE_STRING, required=False),
+            openapi.Parameter('size', openapi.IN_QUERY, type=openapi.TYPE_INTEGER, required=False),
+        ],
+        responses={200: "Ok", 400: "Bad Request"},
+)
 @api_view(['GET'])
 def get_remote_authors(request):
     """
-    Get all remote authors from all remote servers
+    Get the authors of the other nodes from the directory
     """
-    remote_nodes = Node.objects.filter(is_active=True)
-    allRemoteAuthors = []
-    print(remote_nodes)
-    for node in remote_nodes:
-        response = get_request_remote(host_url=node.host_url, path="authors/")
-        print(response)
-        if response is not None:
-            print("Response for get remote authors")
-            if response.status_code == 200:
-                payload = response.json()
-                authors = payload.get("items")
-                print(payload)
-                # discard author whose host field is not a valid url
-                # discard author who is a local author, that is, its host field is the same as the current server's host
-                request_domain = request.build_absolute_uri('/')[:-1]
-                authors = [author for author in authors if validators.url(author.get("host")) and not author.get("host").startswith(request_domain)]
-                allRemoteAuthors += authors
-
-    data = {
-        "type": "authors",
-        "items": allRemoteAuthors
-    }
-
-    return Response(data, status=status.HTTP_200_OK)
-
+    # the refresh_remote_authors worker reads the nodes' lists, this only reads the directory (see api/directory.py)
+    request_domain = request.build_absolute_uri('/')[:-1]
+    authors = RemoteAuthor.objects.filter(node__is_active=True).exclude(host__startswith=request_domain)
+    query = request.query_params.get('q', '').strip()
+
+    response = {"type": "authors"}
+    if query:
+        # the authors matching q in the search index, best match first (see api/search.py)
+        entries = find_authors(query).filter(remote_author__in=authors)
+        if 'cursor' in request.query_params:
+            size = get_cursor_page_size(request)
+            entries, response["next"] = paginate_by_offset_cursor(entries, request.query_params['cursor'], size)
+            response["size"] = size
+        authors = [entry.remote_author for entry in entries]
+    elif 'cursor' in request.query_params:
+        size = get_cursor_page_size(request)
+        authors, response["next"] = paginate_by_cursor(authors.only('data', 'first_seen_at'), request.query_params['cursor'], size,
+                                                        field='first_seen_at', attr='first_seen_at')
+        response["size"] = size
+    else:
+        authors = authors.only('data').order_by('-first_seen_at', '-id')
+    response["items"] = [author.data for author in authors]
+    # the nodes whose authors were never read yet are missing
+    if get_unsynced_node_count():
+        response["partial"] = True
+    return Response(response, status=status.HTTP_200_OK)
 
+@swagger_auto_schema(
+        method="get",
+        operation_summary="gets the pending follow requests the author sent to remote authors",
+        operation_description="Returns the follow requests id_author sent to remote authors that were not accepted yet. \
+            The reconcile_follows worker checks them with the remote nodes in the background, accepted requests become followings.",
+        responses={200: "Ok"},
+)
 @api_view(['GET'])
 def check_remote_follow_requests_approved(request, id_author):
     """
-    Check if the remote follow request is approved
+    Get the remote follow requests of id_author that are still pending
     """
-    # check if any of the remote follow requests sent by id_author are approved
-    # if it is then create a follower object and delete the follow request object
-
-    print("Checking remote follow requests")
-    # get all follow requests, with receiver being a remote author and sender being id_author
-    follow_requests = FollowRequest.objects.filter(to_user__is_remote=True, from_user__id=id_author)
-    print("Remote Follow requests: ", follow_requests)
-
-    # loop through all the remote follow requests and check if they are approved
-    for follow_request in follow_requests:
-        print(follow_request.from_user.id, follow_request.to_user.id)
-        sender_id = follow_request.from_user.id # the person who sent the follow request
-        receiver_id = follow_request.to_user.id # the person who received the follow request
-
-        response = get_request_remote(host_url=follow_request.to_user.host, path=f"authors/{follow_request.to_user.id}/followers/{quote(follow_request.from_user.url)}")
-
-        if response is not None:
-            if response.status_code == 200:
-                print("Follow request was approved")
-                # follow request was approved, local user is now a follower of the remote user
-                # create a follower object in our local db
-                follower = Follower.objects.create(follower_id=sender_id, followed_user_id=receiver_id)
-                # delete the local follow request
-                follow_request.delete()            
-
-    return Response(status=status.HTTP_200_OK)
+    # the reconcile_follows worker checks the remote nodes, this only returns what it found
+    follow_requests = FollowRequest.objects.filter(to_user__is_remote=True, from_user__id=id_author).select_related('from_user', 'to_user')
+    serializer = FollowRequestSerializer(follow_requests, context={'request': request}, many=True)
+    response = {
+        "type": "followrequests",
+        "items": serializer.data,
+    }
+    return Response(response, status=status.HTTP_200_OK)
 
 
+@swagger_auto_schema(
+        method="get",
+        operation_summary="gets the remote followers of the author",
+        operation_description="Returns the remote followers of id_author. \
+            The reconcile_follows worker checks them with the remote nodes in the background and removes the ones that stopped following.",
+        responses={200: "Ok"},
+)
 @api_view(['GET'])
 def check_remote_follower_still_exists(request, id_author):
     """
-    Check if the remote followers of id_author still exists
+    Get the remote followers of id_author
     """
-    # check if the follower still exists
-    # if it doesn't then delete the follower object
+    # the reconcile_follows worker checks the remote nodes, this only returns what it found
+    followers = Follower.objects.filter(follower__is_remote=True, followed_user__id=id_author).select_related('follower')
+    serializer = AuthorSerializer([follower.follower for follower in followers], many=True)
+    response = {
+        "type": "followers",
+        "items": serializer.data,
+    }
+    return Response(response, status=status.HTTP_200_OK)
 
-    print("Checking remote followers")
-    # get all remote followers if id_author
-    # all remote followers that is on our db
-    followers = Follower.objects.filter(follower__is_remote=True, followed_user__id=id_author)
-    print("Remote Followers: ", followers)
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def get_federation_stats(request):
+    """
+    Get the connection reuse stats of the pooled federation sessions (staff only)
+    """
+    nodes = {str(node.id): node.team_name for node in get_nodes()}
+    items = []
+    for node_id, stats in get_session_stats().items():
+        items.append({"node": nodes.get(node_id, node_id), **stats})
 
-    # loop through all the followers and check if they still exist
-    for follower in followers:
-        response = get_request_remote(host_url=follower.follower.host, path=f"authors/{follower.followed_user.id}/followers/{quote(follower.follower.url)}")
+    return Response({"type": "federationStats", "items": items}, status=status.HTTP_200_OK)
 
-        if response is not None:
-            if response.status_code == 404:
-                # no longer a follower, delete follower object
-                follower.delete()
 
-    return Response(status=status.HTTP_200_OK)
\ No newline at end of file
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def get_metrics(request):
+    """
+    Get the request metrics of all the workers in the Prometheus text format (staff only)
+    """
+    return HttpResponse(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
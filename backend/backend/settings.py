@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
 import django_on_heroku
 from dotenv import load_dotenv
 from corsheaders.defaults import default_headers, default_methods
@@ -53,9 +54,12 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first, so it measures everything below it (see api/metrics.py)
+    'api.metrics.metrics_middleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    # WhiteNoise, able to run in the async middleware chain (see api/middleware.py)
+    'api.middleware.StaticFilesMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -86,6 +90,24 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'backend.wsgi.application'
+ASGI_APPLICATION = 'backend.asgi.application'
+
+# new inbox items are pushed to the authors' websockets through the channel layer.
+# The in-memory layer only reaches sockets connected to the same process, with several processes set REDIS_URL
+# (needs the channels_redis package)
+if os.getenv('REDIS_URL'):
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {'hosts': [os.getenv('REDIS_URL')]},
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
 
 
 # Database
@@ -99,6 +121,21 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# used for the remote response cache, point it at a shared backend (e.g. redis) to share it between workers
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'snackoverflow',
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
+    }
+}
+
+
 # CORS_ALLOWED_ORIGINS = [
 #     'http://127.0.0.1:8000',
 # ]
@@ -177,6 +214,138 @@ REST_FRAMEWORK = {
 }
 
 
+# Federation
+# outbound calls to other nodes go through one pooled keep-alive session per node (see api/utils.py)
+
+FEDERATION_POOL_SIZE = int(os.getenv('FEDERATION_POOL_SIZE', 10))
+# seconds to wait for a node to accept the connection and to send back a response
+FEDERATION_CONNECT_TIMEOUT = float(os.getenv('FEDERATION_CONNECT_TIMEOUT', 3.05))
+FEDERATION_READ_TIMEOUT = float(os.getenv('FEDERATION_READ_TIMEOUT', 10))
+# remote fetches that fan out (e.g. the home feed) run at most this many at once, and give up after the deadline (seconds)
+FEDERATION_FANOUT_WORKERS = int(os.getenv('FEDERATION_FANOUT_WORKERS', 8))
+FEDERATION_FANOUT_DEADLINE = float(os.getenv('FEDERATION_FANOUT_DEADLINE', 5))
+
+# remote get responses are cached per node and path, the first pattern matching the path gives its ttl in seconds.
+# paths that match nothing (or have a ttl of 0) are never cached
+FEDERATION_CACHE_TTLS = [
+    (r'/followers/', 0),  # follow state is what the follow checks look for, never serve it stale
+    (r'/posts/[^/]+/(comments|likes)/?$', 15),
+    (r'/posts/?$', 30),
+    (r'/posts/[^/]+/?$', 60),
+    (r'/liked/?$', 30),
+    (r'^authors/?$', 300),
+    (r'^authors/[^/]+/?$', 300),
+]
+# the cache is kept in each process's memory, responses bigger than this many bytes aren't cached
+FEDERATION_CACHE_MAX_ENTRY_BYTES = int(os.getenv('FEDERATION_CACHE_MAX_ENTRY_BYTES', 256 * 1024))
+# how long 404s, server errors and unreachable nodes are remembered
+FEDERATION_CACHE_NEGATIVE_TTL = float(os.getenv('FEDERATION_CACHE_NEGATIVE_TTL', 10))
+# how long an expired response may still be served while a background refresh revalidates it
+FEDERATION_CACHE_STALE_TTL = float(os.getenv('FEDERATION_CACHE_STALE_TTL', 300))
+# remote posts are parsed and get their image urls rewritten once per response, each process keeps the results of
+# responses up to this many bytes in total
+FEDERATION_INGESTED_POSTS_BYTES = int(os.getenv('FEDERATION_INGESTED_POSTS_BYTES', 32 * 1024 * 1024))
+# each process keeps the nodes in memory, it checks the cache for node changes this often and reloads them at least this often (seconds)
+NODE_REGISTRY_CHECK_INTERVAL = float(os.getenv('NODE_REGISTRY_CHECK_INTERVAL', 5))
+NODE_REGISTRY_MAX_AGE = float(os.getenv('NODE_REGISTRY_MAX_AGE', 60))
+# a node's circuit breaker opens after this many failed calls in a row, and lets a probe through after the cooldown (seconds)
+FEDERATION_BREAKER_FAILURES = int(os.getenv('FEDERATION_BREAKER_FAILURES', 5))
+FEDERATION_BREAKER_COOLDOWN = float(os.getenv('FEDERATION_BREAKER_COOLDOWN', 30))
+# error rates shown in the admin cover this many seconds, and are saved at most every FEDERATION_BREAKER_SAVE_INTERVAL seconds
+FEDERATION_BREAKER_WINDOW = float(os.getenv('FEDERATION_BREAKER_WINDOW', 300))
+FEDERATION_BREAKER_SAVE_INTERVAL = float(os.getenv('FEDERATION_BREAKER_SAVE_INTERVAL', 10))
+
+# deliveries to remote inboxes are queued in the outbox and sent by `manage.py deliver_outbox`
+OUTBOX_WORKERS = int(os.getenv('OUTBOX_WORKERS', 4))
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 100))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 8))
+# seconds before the first retry, doubled on every failed attempt up to the max
+OUTBOX_RETRY_BASE_DELAY = float(os.getenv('OUTBOX_RETRY_BASE_DELAY', 30))
+OUTBOX_RETRY_MAX_DELAY = float(os.getenv('OUTBOX_RETRY_MAX_DELAY', 3600))
+# seconds a worker holds the deliveries it claimed, after that another worker can send them
+OUTBOX_CLAIM_TIMEOUT = float(os.getenv('OUTBOX_CLAIM_TIMEOUT', 300))
+
+# serve the federation heavy views (remote authors, remote posts, comments and likes) as async views that await
+# the other nodes on aiohttp, worth it under ASGI (see the Procfile), turn it off when serving through WSGI
+ASYNC_FEDERATION_VIEWS = os.getenv('ASYNC_FEDERATION_VIEWS', 'true').lower() == 'true'
+
+# request metrics (served at /api/metrics): each process writes its histograms to its own file in METRICS_DIR from a
+# background thread every METRICS_FLUSH_INTERVAL seconds, the files of all the gunicorn workers are added up when scraped
+METRICS_DIR = os.getenv('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'snackoverflow-metrics'))
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 5))
+
+# the reconcile_follows worker checks each pending remote follow request and each remote follower this often (seconds),
+# at most FOLLOW_RECONCILE_BATCH_SIZE per round and FOLLOW_RECONCILE_PER_NODE per node per round
+FOLLOW_RECONCILE_INTERVAL = float(os.getenv('FOLLOW_RECONCILE_INTERVAL', 60))
+FOLLOW_RECONCILE_BATCH_SIZE = int(os.getenv('FOLLOW_RECONCILE_BATCH_SIZE', 200))
+FOLLOW_RECONCILE_PER_NODE = int(os.getenv('FOLLOW_RECONCILE_PER_NODE', 25))
+FOLLOW_RECONCILE_DEADLINE = float(os.getenv('FOLLOW_RECONCILE_DEADLINE', 30))
+
+# the posts of the remote authors that local authors follow are mirrored by `manage.py sync_remote_posts`, each author is
+# synced this often (seconds), at most REMOTE_POST_SYNC_BATCH_SIZE authors per round, paging through their posts
+# REMOTE_POST_SYNC_PAGE_SIZE at a time, newest first, up to REMOTE_POST_SYNC_MAX_PAGES pages
+REMOTE_POST_SYNC_INTERVAL = float(os.getenv('REMOTE_POST_SYNC_INTERVAL', 60))
+REMOTE_POST_SYNC_BATCH_SIZE = int(os.getenv('REMOTE_POST_SYNC_BATCH_SIZE', 100))
+REMOTE_POST_SYNC_PAGE_SIZE = int(os.getenv('REMOTE_POST_SYNC_PAGE_SIZE', 50))
+REMOTE_POST_SYNC_MAX_PAGES = int(os.getenv('REMOTE_POST_SYNC_MAX_PAGES', 10))
+REMOTE_POST_SYNC_DEADLINE = float(os.getenv('REMOTE_POST_SYNC_DEADLINE', 30))
+
+# the directory of the other nodes' authors (/api/remote-authors/) is refreshed by `manage.py refresh_remote_authors`,
+# each node this often (seconds), paging through its authors REMOTE_AUTHOR_DIRECTORY_PAGE_SIZE at a time,
+# up to REMOTE_AUTHOR_DIRECTORY_MAX_PAGES pages
+REMOTE_AUTHOR_DIRECTORY_INTERVAL = float(os.getenv('REMOTE_AUTHOR_DIRECTORY_INTERVAL', 300))
+REMOTE_AUTHOR_DIRECTORY_PAGE_SIZE = int(os.getenv('REMOTE_AUTHOR_DIRECTORY_PAGE_SIZE', 100))
+REMOTE_AUTHOR_DIRECTORY_MAX_PAGES = int(os.getenv('REMOTE_AUTHOR_DIRECTORY_MAX_PAGES', 50))
+REMOTE_AUTHOR_DIRECTORY_DEADLINE = float(os.getenv('REMOTE_AUTHOR_DIRECTORY_DEADLINE', 30))
+
+# posts are written into their readers' home feeds when created, unless the author has more followers than this,
+# then their posts are read directly when the feed is loaded
+TIMELINE_FANOUT_LIMIT = int(os.getenv('TIMELINE_FANOUT_LIMIT', 1000))
+
+# resized post images (get_image ?w=&fmt=) are cached on local disk, the least recently used are removed over the size limit
+IMAGE_VARIANT_CACHE_DIR = os.getenv('IMAGE_VARIANT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'snackoverflow-image-variants'))
+IMAGE_VARIANT_CACHE_BYTES = int(os.getenv('IMAGE_VARIANT_CACHE_BYTES', 256 * 1024 * 1024))
+IMAGE_VARIANT_WIDTHS = [64, 160, 320, 640, 1280]
+IMAGE_VARIANT_WORKERS = int(os.getenv('IMAGE_VARIANT_WORKERS', 2))
+# seconds a request waits for its variant before getting the original image
+IMAGE_VARIANT_TIMEOUT = float(os.getenv('IMAGE_VARIANT_TIMEOUT', 10))
+
+
+# Logging
+# the api's logs are queued and written to stdout as JSON lines by a background thread (see api/log.py).
+# LOG_LEVEL is the level of all the api modules, LOG_LEVELS overrides it per module, e.g. "api.views=DEBUG,api.utils=WARNING".
+# Long messages are cut at LOG_MAX_LENGTH characters and only 1 in LOG_SAMPLE_EVERY of each per-item debug event is kept
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_LEVELS = dict(item.strip().split('=', 1) for item in os.getenv('LOG_LEVELS', '').split(',') if '=' in item)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'structured': {
+            '()': 'api.log.StructuredFormatter',
+            'max_length': int(os.getenv('LOG_MAX_LENGTH', 1000)),
+        },
+    },
+    'handlers': {
+        'queue': {
+            '()': 'api.log.QueueLogHandler',
+            'formatter': 'structured',
+            'sample_every': int(os.getenv('LOG_SAMPLE_EVERY', 100)),
+        },
+    },
+    'loggers': {
+        'api': {
+            'handlers': ['queue'],
+            'level': LOG_LEVEL,
+            'propagate': False,
+        },
+        **{name: {'level': level.upper()} for name, level in LOG_LEVELS.items()},
+    },
+}
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
 
@@ -200,10 +369,13 @@ STATICFILES_DIRS = [
 ]
 
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+os.makedirs(STATIC_ROOT, exist_ok=True)
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
-django_on_heroku.settings(locals())
\ No newline at end of file
+# the api's logging (above) replaces the Heroku one, and the static files are set up above: the Heroku ones would
+# add WhiteNoise's sync only middleware to MIDDLEWARE (see api/middleware.py)
+django_on_heroku.settings(locals(), logging=False, staticfiles=False)
\ No newline at end of file
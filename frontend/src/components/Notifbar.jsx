@@ -3,7 +3,7 @@ import Drawer from "@mui/material/Drawer";
 import Button from "@mui/material/Button";
 import { orange } from "@mui/material/colors";
 import { createTheme, ThemeProvider } from "@mui/material/styles";
-import { getRequest } from "../utils/Requests.jsx";
+import { getRequest, openSocket } from "../utils/Requests.jsx";
 import { useAuth } from "../utils/Auth.jsx";
 import { Link } from "react-router-dom";
 import { extractUUID } from "../utils/Auth.jsx";
@@ -31,6 +31,17 @@ function Notifications() {
 			.catch((error) => {
 				console.log("ERROR: ", error.message);
 			});
+
+		// new notifications are pushed by the server as they arrive, newest first like the inbox
+		const socket = openSocket(`ws/authors/${auth.user.id}/inbox`);
+		socket.onmessage = (event) => {
+			const message = JSON.parse(event.data);
+			setNotifs((current) => ({
+				...current,
+				items: [message.item, ...(current ? current.items : [])],
+			}));
+		};
+		return () => socket.close();
 	}, []);
 
 	var allNotifs = [];
@@ -34,9 +34,9 @@ function PostCard({
 	const serviceUrl = window.location.protocol + "//" + window.location.host;
 	const navigate = useNavigate();
 
-	// if image content and no full dataURL, parse together dataURL
+	// if image content and no full dataURL or image url (post lists link to the image), parse together dataURL
 	if (contentType === "image/jpeg;base64" || contentType === "image/png;base64") {
-		if (content.slice(0,4) !== "data" ) {
+		if (content.slice(0,4) !== "data" && content.slice(0,4) !== "http") {
 			content = "data:" + contentType + "," + content
 		}
 	}
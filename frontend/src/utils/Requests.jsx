@@ -91,4 +91,11 @@ async function putRequest(apiEndpoint, data) {
 	}
 }
 
-export { getRequest, postRequest, deleteRequest, putRequest };
+// Function to open a websocket to the backend, socketPath is relative to the server root (not to /api/)
+function openSocket(socketPath) {
+	const url = new URL(`/${socketPath}`, baseURL);
+	url.protocol = url.protocol === "https:" ? "wss:" : "ws:";
+	return new WebSocket(url);
+}
+
+export { getRequest, postRequest, deleteRequest, putRequest, openSocket };